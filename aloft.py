@@ -11,7 +11,7 @@
 #test aloft with both python3 and python2.7
 #see http://docs.python.org/3.0/whatsnew/3.0.html
 
-import sys, os, re, string, array, datetime
+import sys, os, re, string, array, datetime, shutil, threading, heapq, tempfile, glob, functools, multiprocessing, bisect
 from optparse import OptionParser
 from subprocess import Popen, PIPE, CalledProcessError
 from vat_run import *
@@ -19,16 +19,48 @@ from sequencing import *
 from common import *
 import argparse
 import pickle
+import json
 import distutils.spawn
 import gzip
 import vcf2bigwigbed
+import sequence_store
+import transcript_store
+import reference_bundle
+import frequency_store
+import attribute_table
+import disorder_store
+import element_store
+from io import BytesIO
+from collections import OrderedDict
+
+#resource is not available on windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+#Queue and StringIO modules were renamed in python3
+try:
+    #2.x
+    import Queue as queue
+    from StringIO import StringIO
+except ImportError:
+    #3.x
+    import queue
+    from io import StringIO
 
 VERBOSE = None
 
 ALOFT_VERSION = "1.0.0"
 
+#Path that stands for stdin when given as input, or stdout when given as output
+STDIO_PATH = "-"
+
+#Data files that data.txt must list
+REQUIRED_DATA_FILES = ['annotation', 'annotation_interval', 'annotation_sequence', 'genome', 'chromosomes', 'ensembl_table', 'phosphorylation', 'protein_features', 'thousandG', 'ppi', 'dominant_genes', 'recessive_genes', 'scores', 'elements', 'dNdS', 'paralogs', 'ancestor', 'segdup', 'exomes', 'pseudogenes', 'disopred_sequences']
+
 def abortIfPathDoesNotExist(parser, path, shouldShowHelp=False):
-    if path is not None and not os.path.exists(path):
+    if path is not None and path != STDIO_PATH and not os.path.exists(path):
         if shouldShowHelp:
             parser.print_help()
         printError("%s does not exist" % (path))
@@ -41,6 +73,17 @@ def abortIfCannotCreateDirectory(parser, directory):
             parser.print_help()
             printError("Failed to create directory %s" % (directory))
 
+#Returns the name that output files are named after for an input path, which is stdin for -
+def getInputName(inputPath):
+    return "stdin" if inputPath == STDIO_PATH else os.path.basename(inputPath)
+
+#Returns a file writing to the original stdout, and sends everything else printed to stdout to stderr instead, so that only output goes down a pipeline
+def takeOverStdout():
+    sys.stdout.flush()
+    outputFile = os.fdopen(os.dup(sys.stdout.fileno()), 'w')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    return outputFile
+
 def abortIfCannotWriteFile(parser, filepath):
     try:
         newFile=open(filepath, 'w')
@@ -54,25 +97,122 @@ def parseCommandLineArguments(programName, commandLineArguments):
 
     parser.add_argument('--version', action='version', version=ALOFT_VERSION)
 
-    parser.add_argument('--vcf', help='Path to VCF input file. This can be a compressed .gz file. If not specified, then --vat must be specified.')
-    parser.add_argument('--vat', help='Path to VAT input file. If not specified, then --vcf must be specified. This file must be sorted numerically.')
+    parser.add_argument('--vcf', help='Path to VCF input file, or - to read it from stdin. This can be a compressed .gz file. If not specified, then --vat must be specified.')
+    parser.add_argument('--vat', help='Path to VAT input file, or - to read it from stdin. If not specified, then --vcf must be specified. This file should be sorted numerically; if its chromosomes are interleaved, each chromosome is annotated once and the output is put back in input order.')
 
-    parser.add_argument('--output', help='Path to output directory; directory is created if it does not exist', default='aloft_output/')
+    parser.add_argument('--output', help='Path to output directory; directory is created if it does not exist. If - is given, the VCF output is written to stdout and the tabbed output files to the current directory', default='aloft_output/')
 
-    parser.add_argument('--cache', help='Output to directory for cached files; directory is created if it does not exist. Only needed for networkx module.', default='cache/')
+    parser.add_argument('--cache', help='Output to directory for cached files, such as packed genome and ancestor sequences and PPI shortest paths; directory is created if it does not exist.', default='cache/')
 
     parser.add_argument('--nmd_threshold', help='Distance from premature stop to last exon-exon junction; used to find NMD cause', type=int, default=50)
 
+    parser.add_argument('--workers', help='Number of worker processes; each chromosome is split into shards with similar numbers of variants, which the workers annotate in parallel', type=int, default=1)
+
+    parser.add_argument('--max-memory', dest='max_memory', help='Memory limit in MB for loading the next chromosome\'s reference data in the background. The next chromosome is only prefetched if the memory used by aloft and its workers plus an estimate for that chromosome stays within it. 0 uses the size of physical memory', type=int, default=0)
+
+    parser.add_argument('--resume', help='Checkpoint the VAT output, GERP scores and each annotated chromosome in the output directory, and continue from the checkpoint of an earlier run that stopped before finishing. The checkpoint is discarded if the input, reference data or options changed', action='store_true')
+
+    parser.add_argument('--vat-sites-only', dest='vat_sites_only', help='Only pass the 8 site columns of the VCF input through VAT, and reattach the sample genotype columns to its output afterwards', action='store_true')
+
+    parser.add_argument('--drop-genotypes', dest='drop_genotypes', help='Leave sample genotype columns out of the tabbed .lof and .splice output files; the VCF output keeps them', action='store_true')
+
+    parser.add_argument('--stream', help='Pass VAT output, GERP scores and worker results between stages in memory instead of through intermediate files. Implied when an input or output path is -', action='store_true')
+
+    parser.add_argument('--verbose', '-v', help='Verbose mode', action='store_true')
+
+    parser.add_argument('--data', help="Path to data directory containing data.txt which contains paths to all aloft data files", default='data')
+
+    args = parser.parse_args(commandLineArguments)
+
+    dataFiles = getDataFiles(parser, args.data)
+
+    global VERBOSE
+    VERBOSE = args.verbose
+
+    #safe way to test if args has an attribute named arg whose name is equal to key
+    def testArgumentEquality(args, arg, key):
+        if not hasattr(args, key):
+            raise Exception("%s attribute does not exist!" % (key))
+        return key == arg
+
+    #Expand ~ to user's home directory for all argument paths
+    for arg, path in vars(args).items():
+        if path is not None and not any(map(lambda key: testArgumentEquality(args, arg, key), ['nmd_threshold', 'workers', 'max_memory', 'vat_sites_only', 'drop_genotypes', 'resume', 'stream', 'verbose'])):
+            setattr(args, arg, os.path.expanduser(path))
+
+    if not args.vcf and not args.vat:
+        parser.print_help()
+        sys.exit(1)
+
+    if args.vcf and args.vat:
+        parser.print_help()
+        printError("Both a VCF or VAT file were specified. You must supply only one of these as your input file, but not both")
+
+    abortIfPathDoesNotExist(parser, args.vat)
+    abortIfPathDoesNotExist(parser, args.vcf)
+
+    if args.workers < 1:
+        parser.print_help()
+        printError("--workers must be at least 1")
+
+    if args.max_memory < 0:
+        parser.print_help()
+        printError("--max-memory must not be negative")
+
+    if args.resume and STDIO_PATH in [args.vcf, args.vat]:
+        parser.print_help()
+        printError("--resume needs an input file that can be read again, not stdin")
+
+    if STDIO_PATH in [args.vcf, args.vat, args.output]:
+        args.stream = True
+
+    if args.output != STDIO_PATH:
+        abortIfCannotCreateDirectory(parser, args.output)
+    abortIfCannotCreateDirectory(parser, args.cache)
+
+    for dataFile, dataPath in dataFiles.items():
+        setattr(args, dataFile, dataPath)
+    
+    return parser, args
+
+def parseIndexCommandLineArguments(programName, commandLineArguments):
+    parser = argparse.ArgumentParser(prog=programName, description='Build the ALoFT reference index in the cache directory: the small tabular data files are compiled into one lookup file, and the transcript model and genome and ancestor sequences are converted into their cached forms. Later runs with the same --data and --cache use them automatically while the data files are unchanged.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--cache', help='Output to directory for cached files; directory is created if it does not exist.', default='cache/')
+
+    parser.add_argument('--workers', help='Number of worker processes building independent parts of the index in parallel', type=int, default=multiprocessing.cpu_count())
+
     parser.add_argument('--verbose', '-v', help='Verbose mode', action='store_true')
 
     parser.add_argument('--data', help="Path to data directory containing data.txt which contains paths to all aloft data files", default='data')
 
     args = parser.parse_args(commandLineArguments)
 
-    dataListPath = os.path.join(args.data, 'data.txt')
+    dataFiles = getDataFiles(parser, args.data)
+
+    global VERBOSE
+    VERBOSE = args.verbose
+
+    args.cache = os.path.expanduser(args.cache)
+    args.data = os.path.expanduser(args.data)
+
+    if args.workers < 1:
+        parser.print_help()
+        printError("--workers must be at least 1")
+
+    abortIfCannotCreateDirectory(parser, args.cache)
+
+    for dataFile, dataPath in dataFiles.items():
+        setattr(args, dataFile, dataPath)
+
+    return parser, args
+
+#Returns the paths of the data files listed in dataDirectory's data.txt, aborting if any required one is missing
+def getDataFiles(parser, dataDirectory):
+    dataListPath = os.path.join(dataDirectory, 'data.txt')
     abortIfPathDoesNotExist(parser, dataListPath, True)
 
-    requiredDataFiles = ['annotation', 'annotation_interval', 'annotation_sequence', 'genome', 'chromosomes', 'ensembl_table', 'phosphorylation', 'protein_features', 'thousandG', 'ppi', 'dominant_genes', 'recessive_genes', 'scores', 'elements', 'dNdS', 'paralogs', 'ancestor', 'segdup', 'exomes', 'pseudogenes', 'disopred_sequences']
+    requiredDataFiles = REQUIRED_DATA_FILES
 
     dataFiles = {}
     for line in open(dataListPath):
@@ -85,7 +225,7 @@ def parseCommandLineArguments(programName, commandLineArguments):
         if components[0] not in requiredDataFiles:
             continue
 
-        path = os.path.join(args.data, components[1])
+        path = os.path.join(dataDirectory, components[1])
         if not os.path.exists(path):
             #use absolute path
             path = os.path.expanduser(components[1])
@@ -106,72 +246,76 @@ def parseCommandLineArguments(programName, commandLineArguments):
         if dataFile not in dataFiles:
             printError("%s is not specified by data file: %s" % (dataFile, dataListPath))
 
-    global VERBOSE
-    VERBOSE = args.verbose
+    return dataFiles
 
-    #safe way to test if args has an attribute named arg whose name is equal to key
-    def testArgumentEquality(args, arg, key):
-        if not hasattr(args, key):
-            raise Exception("%s attribute does not exist!" % (key))
-        return key == arg
+#Directories in the cache directory holding the packed genome and ancestor sequences, and the parsed transcript model
+def getSequencesDirectory(args):
+    return os.path.join(args.cache, "sequences")
 
-    #Expand ~ to user's home directory for all argument paths
-    for arg, path in vars(args).items():
-        if path is not None and not any(map(lambda key: testArgumentEquality(args, arg, key), ['nmd_threshold', 'verbose'])):
-            setattr(args, arg, os.path.expanduser(path))
+def getTranscriptsDirectory(args):
+    return os.path.join(args.cache, "transcripts")
 
-    if not args.vcf and not args.vat:
-        parser.print_help()
-        sys.exit(1)
+#Directory in the cache directory holding the position indexed stores of population frequency files
+def getFrequenciesDirectory(args):
+    return os.path.join(args.cache, "frequencies")
 
-    if args.vcf and args.vat:
-        parser.print_help()
-        printError("Both a VCF or VAT file were specified. You must supply only one of these as your input file, but not both")
+#Directory in the cache directory holding the merged GERP elements of each chromosome
+def getElementsDirectory(args):
+    return os.path.join(args.cache, "elements")
 
-    abortIfPathDoesNotExist(parser, args.vat)
-    abortIfPathDoesNotExist(parser, args.vcf)
+#Directory in the cache directory holding the packed archive of the DISOPRED predictions
+def getDisopredDirectory(args):
+    return os.path.join(args.cache, "disopred")
 
-    abortIfCannotCreateDirectory(parser, args.output)
-    try:
-        import networkx
-        abortIfCannotCreateDirectory(parser, args.cache)
-    except:
-        pass
+#Returns the DISOPRED predictions, looked up in a packed archive of the .diso files that is written the first time
+#Falls back to reading each transcript's .diso file if the archive can not be written
+def getDisorderPredictions(args):
+    disopredArchive = disorder_store.getDisopredArchive(args.disopred_sequences, getDisopredDirectory(args))
+    if disopredArchive is None:
+        printError("Failed to write DISOPRED archive of %s to %s, reading the .diso files instead" % (args.disopred_sequences, getDisopredDirectory(args)), False)
+    return disorder_store.DisorderPredictions(args.disopred_sequences, disopredArchive)
 
-    for dataFile, dataPath in dataFiles.items():
-        setattr(args, dataFile, dataPath)
-    
-    return parser, args
+#Returns a FASTA file's sequence as a memory mapped packed sequence kept in sequencesDirectory, converting it the first time
+#Falls back to reading the sequence into a string if the packed sequence can not be written
+def getFastaSequence(fastaPath, sequencesDirectory):
+    if sequencesDirectory is not None:
+        packedSequence = sequence_store.getPackedSequence(fastaPath, sequencesDirectory)
+        if packedSequence is not None:
+            return packedSequence
+        printError("Failed to write packed sequence of %s to %s, reading it into memory instead" % (fastaPath, sequencesDirectory), False)
 
-def getAncestorData(ancespath, chromosome):
+    ##skip first >chr* line
+    return '0' + ''.join([line.strip() for line in open(fastaPath)][1:])
+
+def getAncestorData(ancespath, chromosome, sequencesDirectory=None):
     individualAncestorPattern = os.path.join(ancespath, "*_%s.fa" % (chromosome))
     individualAncestorPath = getFilePathMatchingPattern(individualAncestorPattern, True)
 
-    return '0' + ''.join([line.strip() for line in open(individualAncestorPath)][1:])
+    return getFastaSequence(individualAncestorPath, sequencesDirectory)
 
 def getGERPData(isSplice, GERPelements, exons, start, end, direction):
-    truncatedExons = getTruncatedExons(exons, start, direction) if exons and not isSplice else None
+    sortedExons = bool(exons) and not isSplice and areSortedIntervals(exons)
+    truncatedExons = getTruncatedExons(exons, start, direction, sortedExons) if exons and not isSplice else None
     exonCountData = ":".join([str(len(truncatedExons)) if truncatedExons else ("." if not isSplice else "NA"), str(len(exons)) if exons else "."])
 
     rejectionData = "."
-    elementIndex = findGERPelementIndex(GERPelements, start, end)
+    elementIndex = GERPelements.findElementIndex(start, end)
     if elementIndex == -1:
         elementData = "."
     else:
         elementData = str(GERPelements[elementIndex])
 
         if exons and truncatedExons and not isSplice:
-            rejectedPercentage = getRejectionElementIntersectionPercentage(exons, truncatedExons, GERPelements, elementIndex, direction)
+            rejectedPercentage = GERPelements.getRejectionElementIntersectionPercentage(exons, truncatedExons, elementIndex, direction, sortedExons)
             rejectionData = "%.2f" % rejectedPercentage
 
     return elementData, rejectionData, exonCountData
 
-def getSegDupData(vatFile, segdupPath, chrs):
+#Returns the segdup intervals of every chromosome, {chromosome: (starts, ends, running max of the ends)}, sorted by start and end
+def getSegDupIndex(segdupPath, chrs):
     segdups={}
-    segdupmax={}
     for i in chrs:
         segdups[i] = []
-        segdupmax[i] = []
     if VERBOSE: print("Reading segdup information...")
     segdupfile = open(segdupPath)
     line = segdupfile.readline()
@@ -185,81 +329,41 @@ def getSegDupData(vatFile, segdupPath, chrs):
             continue
         segdups[chr_num].append((int(data[1]),int(data[2])))
         line = segdupfile.readline()
+    segdupfile.close()
+
+    segdupIndex = {}
     for i in chrs:
-        segdups[i] = sorted(segdups[i])
+        intervals = sorted(segdups[i])
+        maxEnds = []
         maxsofar = 0
-        for interval in segdups[i]:
+        for interval in intervals:
             maxsofar = max(interval[1], maxsofar)
-            segdupmax[i].append(maxsofar)
-    segdupdata=[]
-    vatFile.seek(0)
-    line = vatFile.readline()
-    while line.startswith("#") or line=="\n":
-        segdupdata.append('')
-        line=vatFile.readline()
-    if VERBOSE: print('Calculating segdup overlaps...')
-    while line!="":
-        data = line.split('\t')
-        chr_num = data[0].split('chr')[-1]
-        start = int(data[1])
-        length = len(data[3])
-        end = start + length-1  ##inclusive endpoint
-
-        if chr_num not in segdups:
-            line = vatFile.readline()
-            continue
-
-        ##find right endpoint of interval search 
-        low = 0; high = len(segdups[chr_num])-1
-        while low<=high:
-            mid = (low+high)//2
-            if end<segdups[chr_num][mid][0]:
-                high = mid-1
-            elif mid == len(segdups[chr_num])-1 or end<segdups[chr_num][mid+1][0]:
-                break
-            else:
-                low = mid+1
-        right = mid
-            
-        ##find left endpoint of interval search
-        low = 0; high = len(segdups[chr_num])-1
-        while low<=high:
-            mid = (low+high)//2
-            if start>segdups[chr_num][mid][1] and start>segdupmax[chr_num][mid]:
-                low = mid+1
-            elif mid==0:
-                break
-            elif start>segdups[chr_num][mid-1][1] and start>segdupmax[chr_num][mid-1]:
-                break
-            else:
-                high = mid-1
-        left = mid
-        
-        overlaps = []
-        for interval in segdups[chr_num][left:right+1]:
-            ##compare bigger of left enpoints to smaller of right endpoints
-            if max(start, interval[0]) <= min(end, interval[1]):
-                overlaps.append(interval)
-        segdupdata.append(str(overlaps))
-
-        line = vatFile.readline()
-
-    segdupfile.close()
-    return segdupdata
+            maxEnds.append(maxsofar)
+        segdupIndex[i] = ([interval[0] for interval in intervals], [interval[1] for interval in intervals], maxEnds)
+    return segdupIndex
+
+#Returns the segdup intervals of a chromosome overlapping the inclusive interval [start, end], as (start, end) tuples in sorted order
+def getSegDupOverlaps(segdupIndex, chromosome, start, end):
+    starts, ends, maxEnds = segdupIndex[chromosome]
+    #intervals before the first whose running max reaches start, or starting after end, can not overlap
+    first = bisect.bisect_left(maxEnds, start)
+    last = bisect.bisect_right(starts, end)
+    ##compare bigger of left endpoints to smaller of right endpoints
+    return [(starts[index], ends[index]) for index in range(first, last) if max(start, starts[index]) <= min(end, ends[index])]
 
 ##domain value=amino acid coordinate of premature stop
 #Returns a short description of YES, NO, or NA if the pfam domain is matched and not truncated,
 #and returns a verbose description of domains matched (domain, domain length, percent lost) and truncated (domain, domain length)
-def getPfamDescription(transcriptToProteinHash, chromosome, transcriptID, domainValue, chromosomesPFam, domainType):
+def getPfamDescription(proteinID, chromosome, domainValue, chromosomesPFam, domainType):
     domainsMatched = []
     domainsLost = []
 
     chromosomesPFam = chromosomesPFam[domainType]
 
-    transcriptMatched = (transcriptID in transcriptToProteinHash and transcriptToProteinHash[transcriptID] in chromosomesPFam[chromosome])
+    transcriptMatched = (proteinID is not None and proteinID in chromosomesPFam[chromosome])
 
     if transcriptMatched:
-        pfamComponentsList = chromosomesPFam[chromosome][transcriptToProteinHash[transcriptID]]
+        pfamComponentsList = chromosomesPFam[chromosome][proteinID]
 
         for pfamComponents in pfamComponentsList:
             domainComponents = pfamComponents[1].split("-")
@@ -292,20 +396,18 @@ def getPfamDescription(transcriptToProteinHash, chromosome, transcriptID, domain
 
     return pfamShortDescription, verboseDomainsMatched, verboseDomainsLost
 
-def getGenomeSequences(genomePath, chromosome):
+def getGenomeSequences(genomePath, chromosome, sequencesDirectory=None):
     individualSequencePath = os.path.join(genomePath, "chr%s.fa" % (chromosome))
     try:
         f=open(individualSequencePath)
+        f.close()
     except:
         printError("%s could not be opened" % (individualSequencePath))
 
-    ##skip first >chr* line
-    genomeSequences = '0' + ''.join([line.strip() for line in f][1:])
-    f.close()
-
-    return genomeSequences
+    return getFastaSequence(individualSequencePath, sequencesDirectory)
 
-def getCDSAndExonDictionaries(annotationPath, chrs):
+#Parses the transcript model of the chromosomes in chrs from the lines of a GTF file
+def getCDSAndExonDictionaries(annotationLines, chrs):
     CDS={}; exon={}; stop_codon={}  ##{chr_num: {transcript: [(a,b),(c,d)..] } }
     transcript_strand={}            ##{transcript_id:+ or -}
     for chr_num in chrs:
@@ -316,13 +418,11 @@ def getCDSAndExonDictionaries(annotationPath, chrs):
     exon['M']={}
     stop_codon['M']={}
 
-    annotfile = open(annotationPath)
-
     ##begin going through actual annotation data
     oldtr = ""  ##last seen transcript
     oldchr = "" ##chr num of last seen transcript
     tlines = [] ##all split CDS lines in oldtr
-    for line in annotfile:
+    for line in annotationLines:
         if line.startswith("#"):
             continue
         data = line.strip().split('\t')
@@ -381,17 +481,11 @@ def getCDSAndExonDictionaries(annotationPath, chrs):
             for CDSline in oldsort[1:]:
                 CDS[oldchr][oldtr].append((int(CDSline[3]),int(CDSline[4])))
 
-    annotfile.close()
-
     return transcript_strand, CDS, exon, stop_codon
 
-def get1000GChromosomeInfo(thousandGPath):
-    thousandGChromosomeInfo = {}
-
-    if thousandGPath.endswith(".gz"):
-        thousandGFile = gzip.open(thousandGPath)
-    else:
-        thousandGFile = open(thousandGPath)
+#Yields (chromosome, position, variant key, INFO) for every alternate allele in the 1000G file
+def read1000GRecords(thousandGPath):
+    thousandGFile = openTextFile(thousandGPath)
 
     for thousandGLine in thousandGFile:
         if not thousandGLine.startswith("#"):
@@ -400,49 +494,131 @@ def get1000GChromosomeInfo(thousandGPath):
             for altIndex in range(len(alts)):
                 refAltPosition = getRefAltPositionKey(thousandGLineComponents, altIndex)
                 thousandGChromosomeNumber = thousandGLineComponents[0].split("chr")[-1]
-                if not (thousandGChromosomeNumber in thousandGChromosomeInfo):
-                    thousandGChromosomeInfo[thousandGChromosomeNumber] = {}
-                
-                assert(refAltPosition not in thousandGChromosomeInfo[thousandGChromosomeNumber])
-                thousandGChromosomeInfo[thousandGChromosomeNumber][refAltPosition] = thousandGLineComponents[7]
+                yield thousandGChromosomeNumber, int(thousandGLineComponents[1]), refAltPosition, thousandGLineComponents[7]
+
+    thousandGFile.close()
+
+def get1000GChromosomeInfo(thousandGPath):
+    thousandGChromosomeInfo = {}
+
+    for thousandGChromosomeNumber, position, refAltPosition, info in read1000GRecords(thousandGPath):
+        if not (thousandGChromosomeNumber in thousandGChromosomeInfo):
+            thousandGChromosomeInfo[thousandGChromosomeNumber] = {}
+
+        assert(refAltPosition not in thousandGChromosomeInfo[thousandGChromosomeNumber])
+        thousandGChromosomeInfo[thousandGChromosomeNumber][refAltPosition] = info
 
     return thousandGChromosomeInfo
 
-#returns a hash (with chromosome and ref_alt_position as keys) for gerp scores
-def getGerpScores(vatPath, outputDirectory, scoresPath):
-    gerpScoresHash = {}
-    bigWigAverageOverBedPath = os.path.join(getScriptDirectory(), os.path.join(os.path.join('bigwig-bin', platformName()), 'bigWigAverageOverBed'))
-    bigWigTabOutputPath = os.path.join(outputDirectory, 'bigwig.tab')
-    bigWigBedInputPath = os.path.join(outputDirectory, 'bigwig_input.bed')
-    bigWigBedOutputPath = os.path.join(outputDirectory, 'bigwig_output.bed')
+#Returns the 1000G INFO fields by chromosome and variant key, looked up in a position indexed store in the cache
+#directory that is converted from the 1000G file the first time. Falls back to reading the whole file into memory
+def get1000GFrequencies(args):
+    thousandGStore = frequency_store.getFrequencyStore(args.thousandG, getFrequenciesDirectory(args), read1000GRecords)
+    if thousandGStore is not None:
+        return thousandGStore
+
+    printError("Failed to write 1000G store of %s to %s, reading it into memory instead" % (args.thousandG, getFrequenciesDirectory(args)), False)
+    return get1000GChromosomeInfo(args.thousandG)
+
+#Adds the scores from the lines of bigWigAverageOverBed's bed output to gerpScoresHash
+def addGerpScores(gerpScoresHash, bigWigLines):
+    for line in bigWigLines:
+        data = line.strip().split("\t")
+        chromosome = data[0].split("chr")[-1]
+        if chromosome not in gerpScoresHash:
+            gerpScoresHash[chromosome] = {}
+
+        position = int(data[1])+1 #to 1 based coordinate
+        _, ref, alt = data[3].split("_")
+        refAltPosition = getVariantKey(position, ref, alt)
+        score = float(data[4])
+        assert(refAltPosition not in gerpScoresHash[chromosome] or gerpScoresHash[chromosome][refAltPosition] == score)
+        gerpScoresHash[chromosome][refAltPosition] = score
+
+def getBigWigAverageOverBedPath():
+    return os.path.join(getScriptDirectory(), os.path.join(os.path.join('bigwig-bin', platformName()), 'bigWigAverageOverBed'))
+
+#Reads the scores that a streaming bigWigAverageOverBed writes to its stdout while its bed input is still being written
+#After a failure it keeps draining the output, so bigWigAverageOverBed never blocks on a full pipe
+def readGerpScores(gerp):
+    try:
+        addGerpScores(gerp['gerpScoresHash'], gerp['pipe'].stdout)
+    except Exception as exception:
+        gerp['readerError'] = exception
+        for line in gerp['pipe'].stdout:
+            pass
+
+#Starts fetching gerp scores for the VAT records; their bed input is written with addGerpBedRecord while the VAT is ingested
+#When streaming, the bed input and output are piped through bigWigAverageOverBed's stdin and stdout instead of temporary files
+def startGerpScores(outputDirectory, scoresPath, stream=False):
+    gerp = {'scoresPath' : scoresPath, 'stream' : stream, 'gerpScoresHash' : {}, 'bedCounter' : 1, 'bedFile' : None, 'failed' : False, 'readerError' : None,
+            'bigWigTabOutputPath' : os.path.join(outputDirectory, 'bigwig.tab'),
+            'bigWigBedInputPath' : os.path.join(outputDirectory, 'bigwig_input.bed'),
+            'bigWigBedOutputPath' : os.path.join(outputDirectory, 'bigwig_output.bed')}
+    try:
+        if stream:
+            if VERBOSE: print("Using bigWigAverageOver to fetch gerp scores...")
+            with open(os.devnull, 'w') as devnull:
+                gerp['pipe'] = Popen([getBigWigAverageOverBedPath(), scoresPath, 'stdin', os.devnull, '-bedOut=stdout'], stdin=PIPE, stdout=PIPE, stderr=devnull, universal_newlines=True)
+            gerp['bedFile'] = gerp['pipe'].stdin
+            gerp['reader'] = startPipelineStage(readGerpScores, gerp)
+        else:
+            gerp['bedFile'] = open(gerp['bigWigBedInputPath'], "w")
+    except (IOError, OSError):
+        printError("Failed to call bigWigAverageOverBed with an IO error")
+    return gerp
+
+#Writes the bed input for the gerp scores of a tokenized VAT record
+#If writing fails, no more input is written; the failure is reported once the scores are asked for
+def addGerpBedRecord(gerp, data):
+    if gerp['bedFile'] is None:
+        return
+    try:
+        gerp['bedCounter'] = vcf2bigwigbed.writeBedRecord(gerp['bedFile'], data, gerp['bedCounter'])
+    except IOError:
+        gerp['failed'] = True
+        closeGerpBedInput(gerp)
+
+def closeGerpBedInput(gerp):
+    bedFile = gerp['bedFile']
+    gerp['bedFile'] = None
+    try:
+        bedFile.close()
+    except IOError:
+        gerp['failed'] = True
+
+#returns a hash (with chromosome and ref_alt_position as keys) for gerp scores of the VAT records whose bed input was written
+def finishGerpScores(gerp):
+    bigWigAverageOverBedPath = getBigWigAverageOverBedPath()
+    if gerp['bedFile'] is not None:
+        closeGerpBedInput(gerp)
     try:
-        vcf2bigwigbed.writeBed(vatPath, bigWigBedInputPath)
-        if VERBOSE: print("Using bigWigAverageOver to fetch gerp scores...")
-        subprocess.check_output([bigWigAverageOverBedPath, scoresPath, bigWigBedInputPath, bigWigTabOutputPath, '-bedOut=%s' % bigWigBedOutputPath], stderr=subprocess.STDOUT) #ignore stderr
-
-        with open(bigWigBedOutputPath) as bigWigFile:
-            for line in bigWigFile:
-                data = line.strip().split("\t")
-                chromosome = data[0].split("chr")[-1]
-                if chromosome not in gerpScoresHash:
-                    gerpScoresHash[chromosome] = {}
-
-                position = int(data[1])+1 #to 1 based coordinate
-                _, ref, alt = data[3].split("_")
-                refAltPosition = getRefAltPositionKey([chromosome, str(position), '.', ref, alt], 0)
-                score = float(data[4])
-                assert(refAltPosition not in gerpScoresHash[chromosome] or gerpScoresHash[chromosome][refAltPosition] == score)
-                gerpScoresHash[chromosome][refAltPosition] = score
-
-        os.remove(bigWigBedInputPath)
-        os.remove(bigWigTabOutputPath)
-        os.remove(bigWigBedOutputPath)
+        if gerp['stream']:
+            gerp['reader'].join()
+            if gerp['pipe'].wait() != 0:
+                raise CalledProcessError(gerp['pipe'].returncode, bigWigAverageOverBedPath)
+            if gerp['readerError'] is not None:
+                raise gerp['readerError']
+            if gerp['failed']:
+                raise IOError()
+        else:
+            if gerp['failed']:
+                raise IOError()
+            if VERBOSE: print("Using bigWigAverageOver to fetch gerp scores...")
+            subprocess.check_output([bigWigAverageOverBedPath, gerp['scoresPath'], gerp['bigWigBedInputPath'], gerp['bigWigTabOutputPath'], '-bedOut=%s' % gerp['bigWigBedOutputPath']], stderr=subprocess.STDOUT) #ignore stderr
+
+            with open(gerp['bigWigBedOutputPath']) as bigWigFile:
+                addGerpScores(gerp['gerpScoresHash'], bigWigFile)
+
+            os.remove(gerp['bigWigBedInputPath'])
+            os.remove(gerp['bigWigTabOutputPath'])
+            os.remove(gerp['bigWigBedOutputPath'])
     except CalledProcessError:
         printError("Failed to call bigWigAverageOverBed")
-    except IOError:
+    except (IOError, OSError):
         printError("Failed to call bigWigAverageOverBed with an IO error")
 
-    return gerpScoresHash
+    return gerp['gerpScoresHash']
 
 #Returns graph using edges from ppiPath file
 def getPPINetwork(networkx, ppiPath):
@@ -500,44 +676,81 @@ def getdNdSData(dNdSPath):
     dNdSfile.close()
     return dNdSmacaque, dNdSmouse
 
+#Returns a transcript's dN/dS as written to the splice output, or NA if it is missing or N/A
+def getSpliceDNdS(transcriptAttributes, transcriptRow, species):
+    dNdSText = transcriptAttributes.getDNdSText(transcriptRow, species)
+    if dNdSText is None or dNdSText == 'N/A':
+        return 'NA'
+    dNdS = transcriptAttributes.getDNdS(transcriptRow, species)
+    #text that is not a number is converted again, so that it fails like it did before
+    return "%.3f" % (dNdS if dNdS == dNdS else float(dNdSText))
+
 def calculateExomeCoordinate(component):
     values = component.split("=")[1].split(",")
     if (int(values[0]) + int(values[1])) == 0:
         return 0.0
     return int(values[0]) * 1.0 / (int(values[0]) + int(values[1]))
 
-def getESPExomeChromosomeInfo(exomesPath, chromosome):
-    exomesChromosomeInfo = {}
-    exomeFiles = os.listdir(exomesPath)
+#Returns the ESP6500 allele frequencies "EA,AA,TAC" of a record from its INFO allele count fields
+def getESPAlleleFrequencies(alleleCounts):
+    x = "NA"
+    y = "NA"
+    z = "NA"
+    for component in alleleCounts.split(";"):
+        if component.startswith('EA_AC='):
+            x = "%.4f" % (calculateExomeCoordinate(component))
+        elif component.startswith('AA_AC='):
+            y = "%.4f" % (calculateExomeCoordinate(component))
+        elif component.startswith('TAC='):
+            z = "%.4f" % (calculateExomeCoordinate(component))
+
+    return "%s,%s,%s" % (x, y, z)
+
+#Yields (chromosome, position, variant key, allele counts) for every alternate allele in a chromosome's ESP6500 file
+#Only the INFO fields getESPAlleleFrequencies reads are kept, so that frequencies are only calculated for variants that are looked up
+def readESPRecords(chromosome, exomeInputPath):
+    for exomeLine in open(exomeInputPath):
+        if not exomeLine.startswith("#"):
+            exomeLineComponents = exomeLine.strip().split("\t")
+            alleleCounts = ";".join(component for component in exomeLineComponents[7].split(";") if component.startswith(('EA_AC=', 'AA_AC=', 'TAC=')))
+            alts = exomeLineComponents[4].split(",")
+            for altIndex in range(len(alts)):
+                yield chromosome, int(exomeLineComponents[1]), getRefAltPositionKey(exomeLineComponents, altIndex), alleleCounts
 
+def getESPExomeInputPath(exomesPath, chromosome):
     exomeInputPath = getFilePathMatchingPattern(os.path.join(exomesPath, '*.chr%s.*.vcf' % chromosome), False)
     if exomeInputPath is None:
-        printError("Couldn't read %s, skipping.." % (exomePath), False)
+        printError("Couldn't read ESP6500 file of chromosome %s in %s, skipping.." % (chromosome, exomesPath), False)
+    return exomeInputPath
 
+def getESPExomeChromosomeInfo(exomesPath, chromosome):
+    exomesChromosomeInfo = {}
+
+    exomeInputPath = getESPExomeInputPath(exomesPath, chromosome)
     if exomeInputPath is not None:
-        for exomeLine in open(exomeInputPath):
-            if not exomeLine.startswith("#"):
-                exomeLineComponents = exomeLine.strip().split("\t")
-                alts = exomeLineComponents[4].split(",")
-                for altIndex in range(len(alts)):
-                    refAltPosition = getRefAltPositionKey(exomeLineComponents, altIndex)
-                    
-                    x = "NA"
-                    y = "NA"
-                    z = "NA"
-                    for component in exomeLineComponents[7].split(";"):
-                        if component.startswith('EA_AC='):
-                            x = "%.4f" % (calculateExomeCoordinate(component))
-                        elif component.startswith('AA_AC='):
-                            y = "%.4f" % (calculateExomeCoordinate(component))
-                        elif component.startswith('TAC='):
-                            z = "%.4f" % (calculateExomeCoordinate(component))
-                    
-                    assert(refAltPosition not in exomesChromosomeInfo)
-                    exomesChromosomeInfo[refAltPosition] = ("%s,%s,%s" % (x, y, z))
+        for chromosome, position, refAltPosition, alleleCounts in readESPRecords(chromosome, exomeInputPath):
+            assert(refAltPosition not in exomesChromosomeInfo)
+            exomesChromosomeInfo[refAltPosition] = getESPAlleleFrequencies(alleleCounts)
 
     return exomesChromosomeInfo
 
+#Returns a chromosome's ESP6500 allele frequencies by variant key, looked up in a position indexed store in the cache
+#directory that is converted from the chromosome's ESP6500 file the first time. Falls back to reading the whole file into memory
+def getESPExomeFrequencies(args, chromosome):
+    exomeInputPath = getESPExomeInputPath(args.exomes, chromosome)
+    if exomeInputPath is None:
+        return {}
+
+    exomeStore = frequency_store.getFrequencyStore(exomeInputPath, getFrequenciesDirectory(args), functools.partial(readESPRecords, chromosome))
+    if exomeStore is not None:
+        if chromosome in exomeStore:
+            return exomeStore.getChromosome(chromosome, getESPAlleleFrequencies)
+        exomeStore.close()
+        return {}
+
+    printError("Failed to write ESP6500 store of %s to %s, reading it into memory instead" % (exomeInputPath, getFrequenciesDirectory(args)), False)
+    return getESPExomeChromosomeInfo(args.exomes, chromosome)
+
 #Finds shortest distance and # of neighbors for gene_name in genes, in the ppi graph
 def parsePPI(networkx, ppi, ppiHash, hashKey, gene_name, genes):
     dist = None
@@ -556,20 +769,21 @@ def parsePPI(networkx, ppi, ppiHash, hashKey, gene_name, genes):
     numberOfNeighbors = sum(1 for gene in genes if gene != gene_name and gene in ppi.neighbors(gene_name))
     return dist, numberOfNeighbors
 
-#Returns a hash for NMD info for indels and premature stops
-def findNMDForIndelsAndPrematureStop(nmdThreshold, data, chr_num, transcript, start, end, exon, stop_codon, genomeSequences, CDS, subst, transcript_strand):
-    nmdHash = {"NMD" : None, 'splice1' : None, 'splice2' : None, 'canonical' : None, 'newCDSpos' : None, 'stopCDS' : None, 'nextATG' : None, 'incrcodingpos' : None, 'issinglecodingexon' : None} # what will be returned from the function
+#Number of transcripts per chromosome whose spliced CDS sequence and coordinate maps are kept for findNMDForIndelsAndPrematureStop
+TRANSCRIPT_MODEL_CACHE_SIZE = 256
 
+#Returns the sorted CDS and exon intervals of a transcript, its spliced CDS sequence, and the maps between CDS, exon and
+#transcript coordinates that findNMDForIndelsAndPrematureStop works from, or None if the transcript has no CDS
+def getTranscriptModel(chr_num, transcript, exon, stop_codon, genomeSequences, CDS, transcript_strand):
     l = sorted(CDS[chr_num][transcript])
     if len(l)==0:
-        return nmdHash
-    nmdHash['issinglecodingexon'] = "YES" if len(l)==1 else "NO"
+        return None
     numberOfExonsHash = sorted(exon[chr_num][transcript])
-    CDSseq = ''; exonseq = ''
+    CDSseq = ''
     CDSprec = []; exonprec = []             ## prec holds # preceding nucleotides
     ispositivestr = transcript_strand[transcript]=='+'
     
-    ## build spliced exon and CDS sequences and maintain coordinate wrt transcript
+    ## build spliced CDS sequence and maintain coordinate wrt transcript
     tot = 0
     for j in range(0,len(l)):
         if ispositivestr:
@@ -592,12 +806,7 @@ def findNMDForIndelsAndPrematureStop(nmdThreshold, data, chr_num, transcript, st
     
     tot = 0
     for j in range(0,len(numberOfExonsHash)):
-        if ispositivestr:
-            i=j
-            exonseq+=genomeSequences[numberOfExonsHash[i][0]:numberOfExonsHash[i][1]+1].upper()
-        else:
-            i=len(numberOfExonsHash)-j-1
-            exonseq+=compstr(genomeSequences[numberOfExonsHash[i][0]:numberOfExonsHash[i][1]+1].upper())
+        i = j if ispositivestr else len(numberOfExonsHash)-j-1
         exonprec.append(tot)            ## stores in index i
         tot += numberOfExonsHash[i][1]+1-numberOfExonsHash[i][0]
     
@@ -613,12 +822,44 @@ def findNMDForIndelsAndPrematureStop(nmdThreshold, data, chr_num, transcript, st
                 j2 = j if ispositivestr else len(l)-j-1     ## j2 = CDSpos
                 CDS2ex[j2]=i
                 break
+
+    ## first stop codon of the spliced CDS sequence, or None if it has bases other than ACGT
+    CDSstop = findStopCodon(CDSseq) if isTranslatable(CDSseq) else None
+
+    return {'l' : l, 'numberOfExonsHash' : numberOfExonsHash, 'ispositivestr' : ispositivestr, 'CDSseq' : CDSseq, 'CDSprec' : CDSprec, 'exonprec' : exonprec, 'coding_exons' : coding_exons, 'CDS2ex' : CDS2ex, 'CDSstop' : CDSstop}
+
+#Returns getTranscriptModel(...) from transcriptModels, a least recently used cache of a chromosome's transcript models, building it if it is not there
+def getCachedTranscriptModel(transcriptModels, chr_num, transcript, exon, stop_codon, genomeSequences, CDS, transcript_strand):
+    if transcriptModels is None:
+        return getTranscriptModel(chr_num, transcript, exon, stop_codon, genomeSequences, CDS, transcript_strand)
+    if transcript in transcriptModels:
+        transcriptModel = transcriptModels.pop(transcript)
+    else:
+        transcriptModel = getTranscriptModel(chr_num, transcript, exon, stop_codon, genomeSequences, CDS, transcript_strand)
+        if len(transcriptModels) >= TRANSCRIPT_MODEL_CACHE_SIZE:
+            transcriptModels.popitem(last=False)
+    transcriptModels[transcript] = transcriptModel
+    return transcriptModel
+
+#Returns a hash for NMD info for indels and premature stops
+#transcriptModels is the chromosome's cache of transcript models, see getCachedTranscriptModel; the models are not modified here
+def findNMDForIndelsAndPrematureStop(nmdThreshold, data, chr_num, transcript, start, end, exon, stop_codon, genomeSequences, CDS, subst, transcript_strand, transcriptModels=None):
+    nmdHash = {"NMD" : None, 'splice1' : None, 'splice2' : None, 'canonical' : None, 'newCDSpos' : None, 'stopCDS' : None, 'nextATG' : None, 'incrcodingpos' : None, 'issinglecodingexon' : None} # what will be returned from the function
+
+    transcriptModel = getCachedTranscriptModel(transcriptModels, chr_num, transcript, exon, stop_codon, genomeSequences, CDS, transcript_strand)
+    if transcriptModel is None:
+        return nmdHash
+    l = transcriptModel['l']
+    nmdHash['issinglecodingexon'] = "YES" if len(l)==1 else "NO"
+    numberOfExonsHash = transcriptModel['numberOfExonsHash']
+    ispositivestr = transcriptModel['ispositivestr']
+    CDSseq = transcriptModel['CDSseq']
+    CDSprec = transcriptModel['CDSprec']
+    exonprec = transcriptModel['exonprec']
+    coding_exons = transcriptModel['coding_exons']
+    CDS2ex = transcriptModel['CDS2ex']
                 
     ncodingexons = sum(coding_exons)    ## number of coding exons
-    try:
-        UTR=len(numberOfExonsHash)-(coding_exons.index(1)+ncodingexons) ## number of 3'UTR exons
-    except:     ## no coding exons
-        UTR=0
     
     ## find CDS and exon interval numbers
     flag1=0
@@ -677,29 +918,36 @@ def findNMDForIndelsAndPrematureStop(nmdThreshold, data, chr_num, transcript, st
         
     if ispositivestr:
         modCDSseq = CDSseq[0:newCDSpos-1]
-        modCDSseq += subst
+        unchanged = len(modCDSseq)
+        inserted = subst
+        modCDSseq += inserted
         modCDSseq += CDSseq[newCDSpos-1+len(data[3]):]
     else:
         modCDSseq = CDSseq[0:newCDSpos-len(data[3])]
-        modCDSseq += compstr(subst)
+        unchanged = len(modCDSseq)
+        inserted = compstr(subst)
+        modCDSseq += inserted
         modCDSseq += CDSseq[newCDSpos:]
-    ref_aa = translate_aa(CDSseq)
-    alt_aa = translate_aa(modCDSseq)
+    nextATG = '3' if code.get(modCDSseq[0:3])=='M' else 'NA'
     
-    try:
-        nextATG = str(3*(alt_aa[:1].index('M')+1))
-    except:
-        nextATG = 'NA'
+    ## # of CDS nucleotides before stop codon in alternate sequence
+    stopcodon = transcriptModel['CDSstop']
+    if stopcodon is not None and isTranslatable(inserted):
+        ## the codons before the first changed one are those of CDSseq, so the new stop is only searched for from there on
+        if stopcodon<0 or stopcodon>=unchanged//3:
+            stopcodon = findStopCodon(modCDSseq, unchanged//3)
+    else:
+        ## translating fails on codons that are not made of ACGT, which aborts the lookup for the transcript
+        translate_aa(CDSseq)
+        stopcodon = translate_aa(modCDSseq).find('*')
 
     nmdHash['nextATG'] = nextATG
     
-    ## # of CDS nucleotides before stop codon in alternate sequence
-    try:
-        stopCDS = 3*alt_aa.index('*')
-        nmdHash['stopCDS'] = stopCDS
-    except:
+    if stopcodon<0:
         nmdHash['NMD'] = "No_stop_codon_found_in_alt_aa"
         return nmdHash
+    stopCDS = 3*stopcodon
+    nmdHash['stopCDS'] = stopCDS
     
     ## stopexon is # of exon nucleotides preceding first nucleotide of stop codon
     ## increxon is the exon position (not exon index) where the new stop occurs
@@ -893,65 +1141,1235 @@ def calculateAbsolutePosition(lofPosition, codingExonIntervals, direction):
             break
     return absoluteStopPosition
 
+phosphorylationTags = ["ACETYLATION", "DI-METHYLATION", "METHYLATION", "MONO-METHYLATION", "O-GlcNAc", "PHOSPHORYLATION", "SUMOYLATION", "TRI-METHYLATION", "UBIQUITINATION"]
+
+ptmParams = ["ACETYLATION", "DI-METHYLATION", "METHYLATION", "MONO-METHYLATION", "O-GlcNAc","PHOSPHORYLATION", "SUMOYLATION", "TRI-METHYLATION", "UBIQUITINATION"]
+
+#params for PF, SSF, SM, etc
+#this variable could use a better name since it's not just PFAM, but not sure what to call it
+pfamParams = ["PF", "SSF", "SM", "Tmhmm", "Sigp"]
+
+pfamParamsWithTruncations = sum([[param, param + "truncated"] for param in pfamParams + ptmParams], []) #using sum to flatten the list
+
+##list of output parameters for LOF and splice variants
+basicparams = ["gene", "gene_id", "partial/full", "transcript", "coding_transcript_length", "coding_transcript"]
+LOFparams = ["is_single_coding_exon",\
+            "variant_position_in_CDS", "stop_position_in_CDS",\
+            "causes_NMD", "5'_flanking_splice_site",\
+            "3'_flanking_splice_site", "canonical_splice_flank",\
+            "ancestral_allele",\
+            "num_of_lof_flags", "lof_flags",\
+            "GERP_score", "GERP_element", "percentage_gerp_elements_in_truncated_exons", "truncated_exons:total_exons",\
+            "segmental_duplications", "disorder_prediction"] + pfamParamsWithTruncations +\
+            ["1000GPhase1", "1000GPhase1_AF", "1000GPhase1_ASN_AF",\
+            "1000GPhase1_AFR_AF", "1000GPhase1_EUR_AF",\
+            "ESP6500", "ESP6500_AAF",\
+            "#_pseudogenes_associated_to_transcript",\
+            "#_paralogs_associated_to_gene",\
+            "dN/dS_(macaque)", "dN/dS_(mouse)",\
+            "shortest_path_to_recessive_gene", "recessive_neighbors",\
+            "shortest_path_to_dominant_gene", "dominant_neighbors"]
+spliceparams = ["donor", "acceptor",\
+            "SNP_in_canonical_site", "other_splice_site_canonical",\
+            "SNP_location", "alt_donor", "alt_acceptor", "nagnag_positions",\
+            "intron_length", "num_of_lof_flags", "lof_flags",\
+            "GERP_score", "GERP_element", "percentage_gerp_elements_in_truncated_exons", "truncated_exons:total_exons",\
+            "segmental_duplications", "1000GPhase1", "1000GPhase1_AF", "1000GPhase1_ASN_AF",\
+            "1000GPhase1_AFR_AF", "1000GPhase1_EUR_AF",\
+            "ESP6500", "ESP6500_AAF",\
+            "#_pseudogenes_associated_to_transcript",\
+            "#_paralogs_associated_to_gene",\
+            "dN/dS_(macaque)", "dN/dS_(mouse)",\
+            "shortest_path_to_recessive_gene", "recessive_neighbors",\
+            "shortest_path_to_dominant_gene", "dominant_neighbors"]
+
+#Loads the reference data that is specific to one chromosome
+def loadChromosomeData(args, chromosome):
+    if VERBOSE: print("Reading data from chromosome %s..." % (chromosome))
+    chromosomeData = {'chromosome' : chromosome}
+    sequencesDirectory = getSequencesDirectory(args)
+    chromosomeData['ancestorData'] = getAncestorData(args.ancestor, chromosome, sequencesDirectory)
+    chromosomeData['exomesChromosomeInfo'] = getESPExomeFrequencies(args, chromosome) #Scan ESP6500 (exome) fields
+    chromosomeData['genomeSequences'] = getGenomeSequences(args.genome, chromosome, sequencesDirectory)
+
+    elementPath = getFilePathMatchingPattern(os.path.join(args.elements, "*chr%s_*.txt" % (chromosome)), True)
+    chromosomeData['GERPelements'] = element_store.getCachedGERPElements(elementPath, getElementsDirectory(args))
+
+    #the transcript model and domain tables only hold this chromosome, in the same {chromosome: ...} layout as before
+    transcript_strand, CDS, exon, stop_codon = transcript_store.getCachedChromosomeCDSAndExonDictionaries(getCDSAndExonDictionaries, args.annotation, chromosome, getTranscriptsDirectory(args))
+    chromosomeData.update({'transcript_strand' : transcript_strand, 'CDS' : CDS, 'exon' : exon, 'stop_codon' : stop_codon})
+    chromosomeData['chromosomesPFam'] = getChromosomesPFam(args, [chromosome])
+    chromosomeData['transcriptModels'] = OrderedDict()
+    return chromosomeData
+
+#Returns an estimate of the bytes of memory a chromosome's data will use before it is loaded, from the size of its data files
+def getChromosomeDataFileSize(args, chromosome):
+    patterns = [os.path.join(args.ancestor, "*_%s.fa" % (chromosome)), os.path.join(args.exomes, '*.chr%s.*.vcf' % chromosome), os.path.join(args.genome, "chr%s.fa" % (chromosome)), os.path.join(args.elements, "*chr%s_*.txt" % (chromosome))]
+    size = sum(os.path.getsize(path) for pattern in patterns for path in glob.glob(pattern)[:1])
+    size += sum(os.path.getsize(path) for path in getPfamTablePaths(args, [chromosome]))
+    return size + transcript_store.getChromosomeLinesSize(args.annotation, getTranscriptsDirectory(args), chromosome)
+
+#Returns the number of bytes of memory allowed by --max-memory, which defaults to the size of physical memory, or None if that is unknown
+def getMaxMemory(args):
+    if args.max_memory > 0:
+        return args.max_memory * 1024 * 1024
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+#Returns the bytes of memory this process has resident, or its peak resident memory if the current amount can not be read
+def getResidentMemory():
+    try:
+        with open('/proc/self/statm') as statmFile:
+            return int(statmFile.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #ru_maxrss is in bytes on mac os x and in KB elsewhere
+    return peakMemory if sys.platform == 'darwin' else peakMemory * 1024
+
+#Returns the bytes of memory that a child process does not share with this process, or 0 if that can not be read
+#Forked workers share the pages they have not written to, so only their private pages count
+def getChildPrivateMemory(pid):
+    privateMemory = 0
+    try:
+        with open('/proc/%d/smaps_rollup' % (pid)) as smapsFile:
+            for line in smapsFile:
+                if line.startswith('Private_Clean:') or line.startswith('Private_Dirty:'):
+                    privateMemory += int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError, IndexError):
+        return 0
+    return privateMemory
+
+#Returns the bytes of memory used by this process and any worker processes it has running
+def getUsedMemory():
+    return getResidentMemory() + sum(getChildPrivateMemory(child.pid) for child in multiprocessing.active_children())
+
+#Returns true if the next chromosome's data can be loaded while the current chromosome's data is still in use, without going over --max-memory
+#The measured memory includes the current chromosome's data and every other loaded table; the next chromosome's data is estimated
+def canPrefetchChromosomeData(args, chromosome):
+    maxMemory = getMaxMemory(args)
+    if maxMemory is None:
+        return True
+    usedMemory = getUsedMemory()
+    chromosomeSize = getChromosomeDataFileSize(args, chromosome)
+    if VERBOSE: print("Using %d MB of memory, and chromosome %s needs about %d MB more" % (usedMemory // (1024 * 1024), chromosome, chromosomeSize // (1024 * 1024)))
+    return usedMemory + chromosomeSize <= maxMemory
+
+#Returns true if a VAT line has a LoF or splice variant, which are the only lines aloft annotates
+def isLofOrSpliceLine(line):
+    return "deletionFS" in line or "insertionFS" in line or "premature" in line or "splice" in line
+
+#Returns true if a tokenized VAT line has a LoF or splice variant; none of the keywords has a tab, so testing each field is the same as testing the line
+def isLofOrSpliceRecord(data):
+    return any(isLofOrSpliceLine(field) for field in data)
+
+#Number of VCF columns that describe a site; any columns after them hold sample genotypes
+SITE_COLUMN_COUNT = 8
+
+#Splits a VCF line into its site columns, followed by the sample genotype columns as one untouched field if there are any
+#Joining the fields with tabs gives back the stripped line, so wide VCFs never have their genotypes split and joined again
+def tokenizeSites(line):
+    return line.strip().split('\t', SITE_COLUMN_COUNT)
+
+#Maximum number of items waiting between two stages of the annotation pipeline
+PIPELINE_QUEUE_SIZE = 256
+
+#Returns a hash for tracking how backed up a pipeline queue gets
+def getQueueStats():
+    return {'puts' : 0, 'totalDepth' : 0, 'maxDepth' : 0}
+
+#Puts an item on a pipeline queue, recording the queue depth it found
+def putInPipelineQueue(pipelineQueue, item, queueStats):
+    depth = pipelineQueue.qsize()
+    queueStats['puts'] += 1
+    queueStats['totalDepth'] += depth
+    queueStats['maxDepth'] = max(queueStats['maxDepth'], depth)
+    pipelineQueue.put(item)
+
+def describeQueueStats(queueStats):
+    meanDepth = float(queueStats['totalDepth']) / queueStats['puts'] if queueStats['puts'] > 0 else 0.0
+    return "max depth %d/%d, mean depth %.1f" % (queueStats['maxDepth'], PIPELINE_QUEUE_SIZE, meanDepth)
+
+#Starts a daemon thread for a pipeline stage, so a failure elsewhere never leaves the process waiting on it
+def startPipelineStage(target, *arguments):
+    thread = threading.Thread(target=target, args=arguments)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+#Maximum size of a chromosome's ingested records that is kept in memory before they are moved to a temporary file
+RECORD_SPILL_MEMORY_SIZE = 1024 * 1024
+
+#The (data, counter) records of one chromosome's LoF and splice lines, pickled to a temporary file as they are ingested
+#so that the ingested VAT never has to be held in memory
+class ChromosomeRecords(object):
+    def __init__(self):
+        self.spillFile = tempfile.SpooledTemporaryFile(RECORD_SPILL_MEMORY_SIZE)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        pickle.dump(record, self.spillFile, protocol=2)
+        self.count += 1
+
+    def __iter__(self):
+        self.spillFile.seek(0)
+        for recordIndex in range(self.count):
+            yield pickle.load(self.spillFile)
+        self.spillFile.seek(0, os.SEEK_END)
+
+    def close(self):
+        self.spillFile.close()
+
+#Parses every VAT line once, writing the bed input for the gerp scores of each LoF or splice line as it goes if gerp is given
+#Returns the header lines, a list of (chromosome, records) for each of chrs with LoF or splice lines, in order of their first such line,
+#where records is a ChromosomeRecords holding a (data, counter) record for each LoF or splice line, and data is tokenized by tokenizeSites,
+#and whether each chromosome's LoF and splice lines come in one contiguous run, so that annotating the chromosomes in turn keeps input order
+#The line counter only counts header lines and lines from chrs; other lines produce no output so only their chromosome is tokenized
+def ingestVatLines(vatLines, chrs, gerp=None):
+    headerLines = []
+    chromosomeRecords = OrderedDict()
+    grouped = True
+    counter = 0
+    headerDone = False
+    lastChromosome = None
+    for line in vatLines:
+        if not headerDone and (line == "\n" or line.startswith("#")):
+            headerLines.append(line)
+            counter += 1
+            continue
+        headerDone = True
+
+        chr_num = line.strip().split('\t', 1)[0].split("chr")[-1]
+        if chr_num not in chrs:
+            continue
+
+        if isLofOrSpliceLine(line):
+            if chr_num != lastChromosome:
+                if chr_num in chromosomeRecords:
+                    grouped = False
+                else:
+                    chromosomeRecords[chr_num] = ChromosomeRecords()
+                lastChromosome = chr_num
+            data = tokenizeSites(line)
+            chromosomeRecords[chr_num].append((data, counter))
+            if gerp is not None:
+                addGerpBedRecord(gerp, data)
+        counter += 1
+
+    return headerLines, list(chromosomeRecords.items()), grouped
+
+#Yields lines, writing each one to a file as well
+def writeLinesWhileYielding(lines, path):
+    with open(path, "w") as outputFile:
+        for line in lines:
+            outputFile.write(line)
+            yield line
+
+#Ingests a VAT file, or stdin if vatPath is -
+def ingestVatFile(vatPath, chrs, gerp=None):
+    if vatPath == STDIO_PATH:
+        vatFile = sys.stdin
+    else:
+        try:
+            vatFile = open(vatPath)
+        except:
+            printError("Failed to read %s" % (vatPath))
+
+    ingested = ingestVatLines(vatFile, chrs, gerp)
+    if vatFile is not sys.stdin:
+        vatFile.close()
+    return ingested
+
+#Splits a chromosome's records into at most shardCount contiguous (start index, end index) shards holding similar numbers of LoF and splice variants
+def getChromosomeShards(records, shardCount):
+    shardSize = max(1, -(-len(records) // shardCount))
+    return [(startIndex, min(startIndex + shardSize, len(records))) for startIndex in range(0, len(records), shardSize)]
+
+#Writer stage: writes the (lof, splice, vcf) text of each annotated record to the output files
+#It keeps draining the queue after a failure so that the annotator never blocks on a full queue
+#If a spill file is given, the rows are pickled to it along with their line counter instead
+def writeOutputRows(rowQueue, outputFiles, writerErrors, spillFile=None):
+    while True:
+        item = rowQueue.get()
+        if item is None:
+            break
+        if len(writerErrors) > 0:
+            continue
+        try:
+            counter, rows = item
+            if spillFile is not None:
+                pickle.dump(item, spillFile, protocol=2)
+            else:
+                for row, outputFile in zip(rows, outputFiles):
+                    if row:
+                        outputFile.write(row)
+        except Exception as exception:
+            writerErrors.append(exception)
+
+#Annotates VAT records from one chromosome, writing results to the lof, splice, and vcf output files, or to a spill file if one is given
+#A writer thread drains the formatted rows through a bounded queue, so writing overlaps with annotation
+def annotateVatRecords(args, referenceData, chromosomeData, records, lofOutputFile, spliceOutputFile, vcfOutputFile, spillFile=None):
+    rowQueue = queue.Queue(PIPELINE_QUEUE_SIZE)
+    rowQueueStats = getQueueStats()
+    writerErrors = []
+    writer = startPipelineStage(writeOutputRows, rowQueue, [lofOutputFile, spliceOutputFile, vcfOutputFile], writerErrors, spillFile)
+
+    for data, counter in records:
+        outputBuffers = [StringIO(), StringIO(), StringIO()]
+        annotateVatLine(args, referenceData, chromosomeData, data, counter, *outputBuffers)
+        putInPipelineQueue(rowQueue, (counter, [outputBuffer.getvalue() for outputBuffer in outputBuffers]), rowQueueStats)
+
+    putInPipelineQueue(rowQueue, None, rowQueueStats)
+    writer.join()
+    if len(writerErrors) > 0:
+        raise writerErrors[0]
+
+    if VERBOSE: print("Output queue for chromosome %s: %s" % (chromosomeData['chromosome'], describeQueueStats(rowQueueStats)))
+
+#Starts loading a chromosome's data in a background thread, so it can be read from disk while the previous chromosome is annotated
+#If another chromosome's data is in use and the memory in use with this chromosome's data would go over --max-memory,
+#loading is put off until the data is asked for instead
+def prefetchChromosomeData(args, chromosome, whileAnnotating=False):
+    prefetch = {'args' : args, 'chromosome' : chromosome, 'chromosomeData' : None, 'error' : None, 'thread' : None}
+    if whileAnnotating and not canPrefetchChromosomeData(args, chromosome):
+        if VERBOSE: print("Not prefetching chromosome %s since it would not fit in --max-memory" % (chromosome))
+        return prefetch
+    def loadPrefetch():
+        try:
+            prefetch['chromosomeData'] = loadChromosomeData(args, chromosome)
+        except BaseException as exception: #includes the SystemExit raised by printError
+            prefetch['error'] = exception
+    prefetch['thread'] = startPipelineStage(loadPrefetch)
+    return prefetch
+
+#Waits for a prefetched chromosome to finish loading and returns its data
+#Callers drop their reference to the previous chromosome's data first, so that a put off load does not have to share memory with it
+def getPrefetchedChromosomeData(prefetch):
+    if prefetch['thread'] is None:
+        return loadChromosomeData(prefetch['args'], prefetch['chromosome'])
+    prefetch['thread'].join()
+    if prefetch['error'] is not None:
+        raise prefetch['error']
+    chromosomeData = prefetch['chromosomeData']
+    prefetch['chromosomeData'] = None
+    return chromosomeData
+
+#Maximum size of a chromosome's spilled rows that is kept in memory before it is moved to a temporary file
+SPILL_MEMORY_SIZE = 16 * 1024 * 1024
+
+#Yields the (counter, rows) items pickled to a spill file
+def readSpilledRows(spillFile):
+    spillFile.seek(0)
+    while True:
+        try:
+            yield pickle.load(spillFile)
+        except EOFError:
+            break
+
+#Writes the spilled rows of every chromosome to the output files, merged back into input line order
+def writeSpilledRowsInInputOrder(spillFiles, outputFiles):
+    for counter, rows in heapq.merge(*[readSpilledRows(spillFile) for spillFile in spillFiles]):
+        for row, outputFile in zip(rows, outputFiles):
+            if row:
+                outputFile.write(row)
+
+#Annotates every chromosome range in this process, prefetching the data for the next range while the current one is annotated
+#If spill files are given, each range's rows are spilled to its own spill file instead of the output files
+#rangeDone is called with the index of each range once it is annotated
+def annotateChromosomeRanges(args, referenceData, chromosomeRanges, outputFiles, spillFiles=None, rangeDone=None):
+    if len(chromosomeRanges) == 0:
+        return
+    prefetch = prefetchChromosomeData(args, chromosomeRanges[0][0])
+    chromosomeData = None
+    for rangeIndex, (chromosome, records) in enumerate(chromosomeRanges):
+        chromosomeData = None
+        chromosomeData = getPrefetchedChromosomeData(prefetch)
+        if rangeIndex+1 < len(chromosomeRanges):
+            prefetch = prefetchChromosomeData(args, chromosomeRanges[rangeIndex+1][0], True)
+        if spillFiles is not None:
+            annotateVatRecords(args, referenceData, chromosomeData, records, None, None, None, spillFiles[rangeIndex])
+        else:
+            annotateVatRecords(args, referenceData, chromosomeData, records, *outputFiles)
+        if rangeDone is not None:
+            rangeDone(rangeIndex)
+
+#Returns the directory holding the --resume checkpoint for an output name, so several inputs can share one output directory
+def getCheckpointDirectory(outputDirectory, outputName):
+    return os.path.join(outputDirectory, ".%s.checkpoint" % (outputName))
+
+#Returns a fingerprint of a file or directory that changes when it is modified
+#For a directory, only adding or removing files changes its fingerprint
+def getPathFingerprint(path):
+    pathStatus = os.stat(path)
+    return [os.path.abspath(path), pathStatus.st_size, int(pathStatus.st_mtime)]
+
+#Returns the manifest a checkpoint is valid for: the input, the reference data and the options that change the output
+def getCheckpointManifest(args, chrs):
+    return {'version' : ALOFT_VERSION,
+            'input' : getPathFingerprint(args.vcf if args.vcf else args.vat),
+            'inputType' : 'vcf' if args.vcf else 'vat',
+            'chromosomes' : chrs,
+            'nmd_threshold' : args.nmd_threshold,
+            'vat_sites_only' : args.vat_sites_only,
+            'drop_genotypes' : args.drop_genotypes,
+            'stream' : args.stream,
+            'data' : dict((dataFile, getPathFingerprint(getattr(args, dataFile))) for dataFile in REQUIRED_DATA_FILES)}
+
+#Prepares a checkpoint directory, keeping its checkpoints only if they were made for the same manifest
+def openCheckpoint(checkpointDirectory, manifest):
+    manifestPath = os.path.join(checkpointDirectory, "manifest.json")
+    try:
+        with open(manifestPath) as manifestFile:
+            previousManifest = json.load(manifestFile)
+    except (IOError, OSError, ValueError):
+        previousManifest = None
+
+    if previousManifest == manifest:
+        if VERBOSE: print("Resuming from checkpoint in %s" % (checkpointDirectory))
+        return
+
+    if previousManifest is not None and VERBOSE: print("Discarding checkpoint in %s since the input, reference data or options changed" % (checkpointDirectory))
+    try:
+        if os.path.exists(checkpointDirectory):
+            shutil.rmtree(checkpointDirectory)
+        os.makedirs(checkpointDirectory)
+        with open(manifestPath + ".part", "w") as manifestFile:
+            json.dump(manifest, manifestFile, sort_keys=True)
+        os.rename(manifestPath + ".part", manifestPath)
+    except (IOError, OSError):
+        printError("Failed to create checkpoint directory %s" % (checkpointDirectory))
+
+#A checkpoint is only complete once its completion marker exists, so a run that stops while writing one redoes it
+def isCheckpointDone(checkpointDirectory, checkpointName):
+    return os.path.exists(os.path.join(checkpointDirectory, checkpointName + ".done"))
+
+def markCheckpointDone(checkpointDirectory, checkpointName):
+    open(os.path.join(checkpointDirectory, checkpointName + ".done"), "w").close()
+
+#Returns the path of the spilled rows checkpoint of a chromosome range
+def getRangeCheckpointPath(checkpointDirectory, rangeIndex, chromosome):
+    return os.path.join(checkpointDirectory, "range%d.chr%s.spill" % (rangeIndex, chromosome))
+
+#Worker process state, inherited from the parent process when the worker pool is forked
+WORKER_STATE = None
+
+#Tables of referenceData that worker processes read from a memory mapped reference bundle, with their number of nested dictionary levels
+BUNDLED_REFERENCE_TABLES = [('gerpScoresHash', 2), ('codingExonIntervals', 2), ('thousandGChromosomeInfo', 2)]
+
+#Number of shards each worker gets per chromosome, so that shards with slower variants even out
+SHARDS_PER_WORKER = 4
+
+#Returns the temporary lof, splice, and vcf shard paths that a worker writes for one chromosome shard, or the path of its spill shard
+def getShardPaths(args, outputName, shardIndex, spill=False):
+    return [os.path.join(args.output, ".%s.%d.%s.part" % (outputName, shardIndex, extension)) for extension in (["spill"] if spill else ["lof", "splice", "vcf"])]
+
+#Annotates one chromosome shard in a worker process, writing results to temporary shard files that the parent concatenates in order
+#When streaming, the results are returned to the parent in memory instead
+def annotateChromosomeShardInWorker(task):
+    shardIndex, (startIndex, endIndex) = task
+    args, referenceData, outputName, chromosomeData, records, spill = WORKER_STATE
+    shardRecords = records[startIndex:endIndex]
+    try:
+        if args.stream and spill:
+            spillFile = BytesIO()
+            annotateVatRecords(args, referenceData, chromosomeData, shardRecords, None, None, None, spillFile)
+            return [spillFile.getvalue()], referenceData['ppiHash']
+        elif args.stream:
+            shardFiles = [StringIO(), StringIO(), StringIO()]
+            annotateVatRecords(args, referenceData, chromosomeData, shardRecords, *shardFiles)
+            return [shardFile.getvalue() for shardFile in shardFiles], referenceData['ppiHash']
+
+        shardPaths = getShardPaths(args, outputName, shardIndex, spill)
+        if spill:
+            with open(shardPaths[0], 'wb') as spillFile:
+                annotateVatRecords(args, referenceData, chromosomeData, shardRecords, None, None, None, spillFile)
+        else:
+            shardFiles = [open(shardPath, 'w') for shardPath in shardPaths]
+            annotateVatRecords(args, referenceData, chromosomeData, shardRecords, *shardFiles)
+            for shardFile in shardFiles:
+                shardFile.close()
+    except SystemExit:
+        #printError exits, which would otherwise leave the pool waiting on this task forever
+        return None
+    return shardPaths, referenceData['ppiHash']
+
+#Annotates every chromosome range with a pool of worker processes and appends the results to the output files in input order
+#Each chromosome's data is loaded once by this process and shared with the workers, which annotate contiguous shards of the chromosome
+#The next chromosome's data is prefetched while the workers annotate the current one
+#If spill files are given, each range's rows are appended to its own spill file instead of the output files
+#rangeDone is called with the index of each range once it is annotated
+def annotateChromosomeRangesInParallel(args, referenceData, outputName, chromosomeRanges, outputFiles, spillFiles=None, rangeDone=None):
+    global WORKER_STATE
+    if len(chromosomeRanges) == 0:
+        return
+    spill = spillFiles is not None
+    prefetch = prefetchChromosomeData(args, chromosomeRanges[0][0])
+    chromosomeData = None
+    for rangeIndex, (chromosome, records) in enumerate(chromosomeRanges):
+        chromosomeData = None
+        chromosomeData = getPrefetchedChromosomeData(prefetch)
+        #the workers slice the chromosome's records, so they are read back from their spill file before forking
+        records = list(records)
+        shards = getChromosomeShards(records, args.workers * SHARDS_PER_WORKER)
+        if VERBOSE: print("Annotating %d variant lines in %d shards" % (len(records), len(shards)))
+
+        WORKER_STATE = (args, referenceData, outputName, chromosomeData, records, spill)
+        pool = getForkedPool(min(args.workers, len(shards)))
+        #only start the next prefetch after forking, since forking while another thread runs can leave its locks held in the workers
+        if rangeIndex+1 < len(chromosomeRanges):
+            prefetch = prefetchChromosomeData(args, chromosomeRanges[rangeIndex+1][0], True)
+        try:
+            for shardIndex, result in enumerate(pool.imap(annotateChromosomeShardInWorker, enumerate(shards))):
+                if result is None:
+                    printError("Worker failed to annotate chromosome %s" % (chromosome))
+                shardResults, workerPPIHash = result
+                for shardResult, outputFile in zip(shardResults, [spillFiles[rangeIndex]] if spill else outputFiles):
+                    if args.stream:
+                        outputFile.write(shardResult)
+                    else:
+                        with open(shardResult, 'rb' if spill else 'r') as shardFile:
+                            shutil.copyfileobj(shardFile, outputFile)
+                        os.remove(shardResult)
+                if workerPPIHash is not None:
+                    for hashKey in workerPPIHash:
+                        referenceData['ppiHash'][hashKey].update(workerPPIHash[hashKey])
+            if rangeDone is not None:
+                rangeDone(rangeIndex)
+        finally:
+            pool.terminate()
+            WORKER_STATE = None
+            #remove shards left behind by a failed run
+            if not args.stream:
+                for shardIndex in range(len(shards)):
+                    for shardPath in getShardPaths(args, outputName, shardIndex, spill):
+                        if os.path.exists(shardPath):
+                            os.remove(shardPath)
+
+def annotateVatLine(args, referenceData, chromosomeData, data, counter, lofOutputFile, spliceOutputFile, vcfOutputFile):
+    chr_num = data[0].split("chr")[-1]
+    start = int(data[1])
+    end = start+len(data[3])-1
+
+    segdupIndex = referenceData['segdupIndex']
+    gerpScoresHash = referenceData['gerpScoresHash']
+    codingExonIntervals = referenceData['codingExonIntervals']
+    transcriptAttributes = referenceData['transcriptAttributes']
+    disorderPredictions = referenceData['disorderPredictions']
+    thousandGChromosomeInfo = referenceData['thousandGChromosomeInfo']
+    networkx = referenceData['networkx']
+    ppi = referenceData['ppi']
+    ppiHash = referenceData['ppiHash']
+    rgenes = referenceData['rgenes']
+    dgenes = referenceData['dgenes']
+
+    ancestorData = chromosomeData['ancestorData']
+    exomesChromosomeInfo = chromosomeData['exomesChromosomeInfo']
+    genomeSequences = chromosomeData['genomeSequences']
+    GERPelements = chromosomeData['GERPelements']
+    transcript_strand = chromosomeData['transcript_strand']
+    CDS = chromosomeData['CDS']
+    exon = chromosomeData['exon']
+    stop_codon = chromosomeData['stop_codon']
+    chromosomesPFam = chromosomeData['chromosomesPFam']
+    transcriptModels = chromosomeData['transcriptModels']
+
+    #outdata is rebuilt for every line so that the rows of a line never depend on which lines were annotated before it
+    outdata = {i : "" for i in set(basicparams) | set(LOFparams) | set(spliceparams)}
+
+    #Filter lines
+    if isLofOrSpliceRecord(data):
+        ancesdata = ancestorData[start:start+len(data[3])].upper()
+        if data[3] == ancesdata:
+            ancestral = "Ref"
+        elif data[4] == ancesdata:
+            ancestral = "Alt"
+        else:
+            ancestral = "Neither"
+        
+        segdupOverlaps = getSegDupOverlaps(segdupIndex, chr_num, start, end)
+
+        ##screen for variant types here.  skip variant if it is not deletion(N)FS, insertion(N)FS, or premature SNP
+        lineinfo = {'AA':'AA='+ancesdata,\
+                    'Ancestral':'Ancestral='+ancestral,\
+                    'SegDup':'SegDup='+str(len(segdupOverlaps))}
+        infotypes = ['AA', 'Ancestral', 'GERPscore', 'SegDup']
+
+        outdata["ancestral_allele"] = ancesdata
+        outdata["segmental_duplications"] = str(segdupOverlaps)
+        
+        dataInfoComponents = data[7].split(';')
+        found = 0
+        for info in dataInfoComponents:
+            infotype = info.split('=')[0]
+            if infotype == 'VA':
+                variants = info.split('VA=')[-1].split(',')
+                found = 1
+            if infotype!='AA' and infotype!='VA':
+                lineinfo[infotype]=info
+                infotypes.append(infotype)
+        
+        if found==1:
+            lineinfo['VA']='VA='
+            infotypes.append('VA')
+
+        def writeVCFUpToBasicParams(outfile):
+            outfile.write("\t".join(data[:SITE_COLUMN_COUNT] if args.drop_genotypes else data))
+            outfile.write('\t'+ '\t'.join(outdata[i] for i in basicparams))
+        
+        LOFvariants = []
+        splicevariants = []
+        othervariants = []
+        for variant in variants:
+            details = variant.split(":")
+
+            refAltPosition = getRefAltPositionKey(data, int(details[0]) - 1)
+
+            GERPscore = gerpScoresHash[chr_num][refAltPosition]
+            lineinfo['GERPscore'] = 'GERPscore='+"%.2f" % GERPscore
+            outdata["GERP_score"] = "%.2f" % GERPscore
+
+            #Adding 1000G fields
+            thousandGTags = ['1000GPhase1_AF', '1000GPhase1_ASN_AF', '1000GPhase1_AFR_AF', '1000GPhase1_EUR_AF']
+            thousandGComponents = []
+            for thousandGTag in thousandGTags:
+                thousandGComponents.append(thousandGTag + "=NA")
+            
+            if chr_num in thousandGChromosomeInfo and refAltPosition in thousandGChromosomeInfo[chr_num]:
+                for info in thousandGChromosomeInfo[chr_num][refAltPosition].split(";"):
+                    infotype = info.split('=')[0]  
+                    newComponent = "1000GPhase1_" + info
+                    thousandGComponentIndex = -1
+                    for findIndex in range(len(thousandGTags)):
+                        if infotype == "_".join(thousandGTags[findIndex].split("_")[1:]):
+                            thousandGComponentIndex = findIndex
+                            break
+                    
+                    if thousandGComponentIndex >= 0:
+                        thousandGComponents[thousandGComponentIndex] = newComponent
+            
+            infotypes += ['1000GPhase1'] + thousandGTags
+            if chr_num in thousandGChromosomeInfo and refAltPosition in thousandGChromosomeInfo[chr_num]:
+                lineinfo['1000GPhase1'] = '1000GPhase1=Yes'
+            else:
+                lineinfo['1000GPhase1'] = '1000GPhase1=No'
+            
+            #Add 1000G entries to output
+            for tagIndex in range(len(thousandGTags)):
+                lineinfo[thousandGTags[tagIndex]] = thousandGComponents[tagIndex]
+            
+            #Add exomes info to output
+            infotypes += ['ESP6500', 'ESP6500_AAF']
+            if refAltPosition in exomesChromosomeInfo:
+                lineinfo['ESP6500'] = 'ESP6500=Yes'
+                lineinfo['ESP6500_AAF'] = 'ESP6500_AAF=' + exomesChromosomeInfo[refAltPosition]
+            else:
+                lineinfo['ESP6500'] = 'ESP6500=No'
+                lineinfo['ESP6500_AAF'] = 'ESP6500_AAF=NA,NA,NA'
+            
+            for tag in ['1000GPhase1'] + thousandGTags + ['ESP6500', 'ESP6500_AAF']:
+                outdata[tag] = lineinfo[tag]
+
+            ##alternate allele corresponding to variant
+            subst = data[4].split(',')[int(variant.split(':')[0])-1]
+            
+            if "deletionFS" not in variant and "insertionFS" not in variant:
+                if "premature" not in variant and "splice" not in variant:
+                    othervariants.append(variant)
+                    continue
+
+            outdata["gene"], outdata["gene_id"] = details[1], details[2]
+
+            if details[5].split("/")[0]==details[5].split("/")[1]:
+                pf = "full"
+            else:
+                pf = "partial"
+            outdata["partial/full"] = pf
+            
+            transcripts = []
+
+            for i in range(6, len(details)-1, 3):
+                transcripts.append(details[i:i+3])
+            longesttranscript = max([int(i[2].split('_')[0]) for i in transcripts])
+
+            ##calculate distance to dominant and recessive genes
+            gene_name = outdata["gene"]
+            if ppi is not None and gene_name in ppi:
+                dominantdist, numberOfDominantNeighbors = parsePPI(networkx, ppi, ppiHash, "dgenes", gene_name, dgenes)
+                outdata["shortest_path_to_dominant_gene"] = 'NA' if dominantdist is None else str(dominantdist)
+                outdata["dominant_neighbors"] = str(numberOfDominantNeighbors)
+
+                recessdist, numberOfRecessiveNeighbors = parsePPI(networkx, ppi, ppiHash, "rgenes", gene_name, rgenes)
+                outdata["shortest_path_to_recessive_gene"] = 'NA' if recessdist is None else str(recessdist)
+                outdata["recessive_neighbors"] = str(numberOfRecessiveNeighbors)
+            else:
+                outdata["shortest_path_to_recessive_gene"] = 'NA'
+                outdata["recessive_neighbors"] = 'NA'
+
+                outdata["shortest_path_to_dominant_gene"] = 'NA'
+                outdata["dominant_neighbors"] = 'NA'
+
+            outdata["#_paralogs_associated_to_gene"] = str(transcriptAttributes.getParalogCount(outdata["gene_id"].split('.')[0]))
+
+            ##number of associated pseudogenes computation goes here
+
+            if "splice" in variant:
+                ##check that is a SNP splice variant
+                if len(data[3])>1 or len(subst)>1:
+                    splicevariants.append(variant)
+                    continue
+                splicevariants.append(':'.join(details[:6]))
+
+                for entry in transcripts:
+                    splicevariants[-1]+=':' + ':'.join(entry[0:1] + [pf] + entry[1:])
+                    transcript = entry[1]
+                    outdata["transcript"] = transcript
+                    outdata["coding_transcript_length"] = entry[2]
+                    outdata["coding_transcript"] = "YES" if int(outdata["coding_transcript_length"])==longesttranscript else "NO"
+                    ispositivestr = transcript_strand[transcript]=='+'
+
+                    GERPelementdata, GERPrejectiondata, exonCountData = getGERPData(True, GERPelements, codingExonIntervals[chr_num][transcript] if transcript in codingExonIntervals[chr_num] else None, start, end, transcript_strand[transcript])
+
+                    outdata['GERP_element'] = GERPelementdata
+                    outdata['percentage_gerp_elements_in_truncated_exons'] = GERPrejectiondata
+                    outdata['truncated_exons:total_exons'] = exonCountData
+
+                    outdata["#_pseudogenes_associated_to_transcript"] = str(transcriptAttributes.getPseudogeneCount(transcript))
+
+                    transcriptRow = transcriptAttributes.getRow(transcript.split('.')[0])
+                    outdata["dN/dS_(macaque)"] = getSpliceDNdS(transcriptAttributes, transcriptRow, 'macaque')
+                    outdata["dN/dS_(mouse)"] = getSpliceDNdS(transcriptAttributes, transcriptRow, 'mouse')
+                    
+                    writeVCFUpToBasicParams(spliceOutputFile)
+
+                    spliceSearchData = searchInSplices(chr_num, transcript, genomeSequences, ispositivestr, start, CDS, subst)
+
+                    def writeSpliceOutput(failure):
+                        spliceOutputFile.write('\t'+'\t'.join(outdata[i] for i in ["shortest_path_to_recessive_gene", "recessive_neighbors"]))
+                        spliceOutputFile.write("\t%s: pos=" % (failure) +str(start)+' transcript='+transcript+'\n')
+
+                    if not spliceSearchData['found']:
+                        writeSpliceOutput("CDS_match_not_found")
+                        continue
+
+                    if not spliceSearchData['new']:
+                        writeSpliceOutput("no_donor_or_acceptor_pair")
+                        continue
+
+                    new = spliceSearchData['new']
+                    donor = spliceSearchData['donor']
+                    acceptor = spliceSearchData['acceptor']
+                    intronlength = spliceSearchData['intronlength']
+
+                    outdata["donor"] = donor
+                    outdata["acceptor"] = acceptor
+                    outdata["intron_length"] = str(intronlength)
+                    ##write to output
+                    if new[0]==0:
+                        isCanonical = 'YES' if (donor in ['GT', 'GC'] or (donor == 'AT' and acceptor == 'AC')) else 'NO'
+                        otherCanonical = 'YES' if (acceptor=='AG' or (acceptor == 'AC' and donor == 'AT')) else 'NO'
+                    elif new[0]==1:
+                        isCanonical = 'YES' if (acceptor=='AG' or (acceptor == 'AC' and donor == 'AT')) else 'NO'
+                        otherCanonical = 'YES' if (donor in ['GT', 'GC'] or (donor == 'AT' and acceptor == 'AC')) else 'NO'
+                    outdata["SNP_in_canonical_site"] = isCanonical
+                    outdata["other_splice_site_canonical"] = otherCanonical
+                    
+                    if new[0]==0:
+                        outdata["SNP_location"] = "donor"
+                        outdata["alt_donor"] = new[1].upper()
+                        outdata["alt_acceptor"] = acceptor
+                    else:
+                        outdata["SNP_location"] = "acceptor"
+                        outdata["alt_donor"] = donor
+                        outdata["alt_acceptor"] = new[1].upper()
+
+                    if new[0] == 1: #acceptor snp location
+                        nagNagPositions = getMatchingNagnagnagPositions(genomeSequences, start, ispositivestr)
+                        outdata['nagnag_positions'] = '/'.join(map(str, nagNagPositions)) if len(nagNagPositions) > 0 else '.'
+                        alternateAcceptorSite = 'YES' if len(nagNagPositions) > 0 else 'NO'
+                    else:
+                        outdata['nagnag_positions'] = 'NA'
+                        alternateAcceptorSite = 'NA'
+
+                    #calculation of filters
+                    failed_filters = []
+                    if isCanonical == 'NO':
+                        failed_filters.append('ref_noncanonical')
+                        if new[0] == 0 and new[1].upper() != 'GT': #snp is in donor, and alt donor is not GT
+                            failed_filters.append('alt_noncanonical')
+                        elif new[0] != 0 and new[1].upper() != 'AG': #snp is in acceptor, and alt acceptor is not AG
+                            failed_filters.append('alt_noncanonical')
+
+                    if otherCanonical == 'NO':
+                        failed_filters.append('other_noncanonical')
+                    if intronlength < 15:
+                        failed_filters.append('short_intron')
+                        smallIntron = 'YES'
+                    else:
+                        smallIntron = 'NO'
+                    if len(segdupOverlaps) > 3:
+                        failed_filters.append('heavily_duplicated')
+                        heavilyDuplicated = 'YES'
+                    else:
+                        heavilyDuplicated = 'NO'
+
+                    isLofAnc = 'NO'
+                    if ancesdata==subst:
+                        failed_filters.append('lof_anc')
+                        isLofAnc = 'YES'
+
+                    outdata["num_of_lof_flags"] = str(len(failed_filters)) if len(failed_filters) > 0 else "none"
+                    outdata["lof_flags"] = ','.join(failed_filters)
+
+########################################################
+                    spliceOutputFile.write("\t"+"\t".join(outdata[i] for i in spliceparams)+"\n")
+#########################################################
+                    splicevariants[-1]+=':'+':'.join(['GERPelement='+("YES" if GERPelementdata != '.' else "NO"), 'exoncounts='+exonCountData, donor+'/'+acceptor, 'is_canonical=' + isCanonical, 'other_noncanonical=' + otherCanonical, 'intron_length=' + str(intronlength), 'small_intron=' + smallIntron, 'heavily_duplicated=' + heavilyDuplicated, 'lof_anc=' + isLofAnc, 'alternate_acceptor_site=' + alternateAcceptorSite])
+                    
+            else:   ##deletionFS, insertionFS, or prematureStop
+                LOFvariants.append(':'.join(details[:6]))
+
+                for entry in transcripts:
+                    LOFvariants[-1]+=':'+':'.join(entry[0:1] + [pf] + entry[1:])
+                    
+                    tlength = entry[2].split('_')[0]
+                    outdata["coding_transcript_length"] = tlength
+                    try:
+                        LOFposition = entry[2].split('_')[1]
+                    except:
+                        LOFposition = '.'
+                    outdata["coding_transcript"] = "YES" if int(tlength)==longesttranscript else "NO"
+                    transcript = entry[1]
+                    outdata["transcript"]=transcript
+                   
+          #calculation of filters
+                    failed_filters = []
+
+                    nearStart = 'NO'
+                    nearEnd = 'NO'
+                    try:    #since LOFposition may not be provided
+                        if float(LOFposition)/float(tlength) <= 0.05:
+                            failed_filters.append('near_start')
+                            nearStart = 'YES'
+                        if float(LOFposition)/float(tlength) >= 0.95:
+                            failed_filters.append('near_stop')
+                            nearEnd = 'YES'
+                    except:
+                        pass
+                    
+                    isLofAnc = 'NO'
+                    if ancesdata==subst:
+                        failed_filters.append('lof_anc')
+                        isLofAnc = 'YES'
+                    
+                    heavilyDuplicated = 'NO'
+                    if len(segdupOverlaps) > 3:
+                        failed_filters.append('heavily_duplicated')
+                        heavilyDuplicated = 'YES'
+
+                    outdata["num_of_lof_flags"] = str(len(failed_filters)) if len(failed_filters) > 0 else "none"
+                    outdata["lof_flags"] = ','.join(failed_filters)
+
+                    outdata["variant_position_in_CDS"] = "NA"
+                    outdata["stop_position_in_CDS"] = "NA"
+                    outdata["5'_flanking_splice_site"] = "NA"
+                    outdata["3'_flanking_splice _site"] = "NA"
+                    outdata["canonical_splice_flank"] = "NA"
+                    outdata["#_pseudogenes_associated_to_transcript"] = str(transcriptAttributes.getPseudogeneCount(transcript))
+                    transcriptRow = transcriptAttributes.getRow(transcript.split('.')[0])
+                    dNdSmacaque = transcriptAttributes.getDNdSText(transcriptRow, 'macaque')
+                    dNdSmouse = transcriptAttributes.getDNdSText(transcriptRow, 'mouse')
+                    outdata["dN/dS_(macaque)"] = dNdSmacaque if dNdSmacaque is not None else "NA"
+                    outdata["dN/dS_(mouse)"] = dNdSmouse if dNdSmouse is not None else "NA"
+                    
+                    writeVCFUpToBasicParams(lofOutputFile)
+                    
+                    try:
+                        nmdData = findNMDForIndelsAndPrematureStop(args.nmd_threshold, data, chr_num, transcript, start, end, exon, stop_codon, genomeSequences, CDS, subst, transcript_strand, transcriptModels)
+                    except KeyError:
+                        printError("Failed to lookup indel data for transcript %s" % transcript, False)
+                        continue
+
+                    if nmdData['NMD'] is None:
+                        continue
+
+                    outdata['causes_NMD'] = nmdData['NMD']
+
+                    if nmdData['issinglecodingexon']:
+                        outdata["is_single_coding_exon"] = nmdData['issinglecodingexon']
+
+                    #NA for premature SNPs
+                    if nmdData['newCDSpos'] and not ('prematureStop' in variant and (len(data[3])>1 or len(subst)>1)):
+                        outdata['variant_position_in_CDS'] = str(nmdData['newCDSpos'])
+
+                    if nmdData['NMD'] not in ['YES', 'NO']:
+                        lofOutputFile.write('\t'+'\t'.join(outdata[i] for i in LOFparams) + '\n')
+                        continue
+
+                    lofPosition = nmdData['newCDSpos'] if "prematureStop" in variant else nmdData['stopCDS']
+
+                    outdata["5'_flanking_splice_site"] = nmdData['splice1']
+                    outdata["3'_flanking_splice_site"] = nmdData['splice2']
+                    if nmdData['splice1'] == '.' and nmdData['splice2'] == '.':
+                        outdata["canonical_splice_flank"] = 'NA'
+                    elif nmdData['splice1'] == 'AG' and nmdData['splice2'] == 'GC':
+                        outdata["canonical_splice_flank"] = 'YES'
+                    else:
+                        outdata["canonical_splice_flank"] = nmdData['canonical']
+                        if nmdData['canonical'] == 'NO':
+                            failed_filters.append("canonical_splice_flank")
+                            outdata["num_of_lof_flags"] = str(len(failed_filters)) if len(failed_filters) > 0 else "none"
+                            outdata["lof_flags"] = ','.join(failed_filters)
+                    
+                    outdata["stop_position_in_CDS"] = str(lofPosition)
+
+                    vcfPfamDescriptions = {}
+                    phosphorylationResults = {}
+
+                    oneNA = False
+                    oneNO = False
+                    oneYES = False
+
+                    stopPositionInAminoSpace = int(entry[2].split('_')[2]) if "prematureStop" in variant else (lofPosition - 1) // 3 + 1
+
+                    if "prematureStop" not in variant:
+                        stopPositionForGERP = calculateAbsolutePosition(lofPosition, codingExonIntervals[chr_num][transcript], transcript_strand[transcript])
+                    else:
+                        stopPositionForGERP = start
+                    
+                    GERPelementdata, GERPrejectiondata, exonCountData = getGERPData(False, GERPelements, codingExonIntervals[chr_num][transcript] if transcript in codingExonIntervals[chr_num] else None, stopPositionForGERP, stopPositionForGERP + len(data[3]) - 1, transcript_strand[transcript])
+
+                    outdata['GERP_element'] = GERPelementdata
+                    outdata['percentage_gerp_elements_in_truncated_exons'] = GERPrejectiondata
+                    outdata['truncated_exons:total_exons'] = exonCountData
+
+                    for paramKey in pfamParams + ptmParams:
+                        shortDescription, verboseDescriptionMatched, verboseDescriptionLost = getPfamDescription(transcriptAttributes.getProtein(transcriptRow), chr_num, stopPositionInAminoSpace, chromosomesPFam, paramKey)
+                        
+                        if paramKey in pfamParams:
+                            vcfPfamDescriptions[paramKey] = "%s=%s" % (paramKey, shortDescription)
+                        elif paramKey in phosphorylationTags:
+                            if shortDescription == "YES":
+                                phosphorylationResults[paramKey] = shortDescription
+
+                            if shortDescription == 'YES':
+                                oneYES = True
+                            elif shortDescription == 'NO':
+                                oneNO = True
+                            elif shortDescription == 'NA':
+                                oneNA = True
+                        else:
+                            vcfPfamDescriptions[paramKey] = ''
+
+                        outdata[paramKey] = verboseDescriptionMatched
+                        outdata[pfamParamsWithTruncations[pfamParamsWithTruncations.index(paramKey)+1]] = verboseDescriptionLost
+
+                    if len(phosphorylationResults) == 0:
+                        if oneNA and oneNO:
+                            vcfPfamDescriptions['PTM'] = 'PTM=NO/NA'
+                        elif oneNA:
+                            vcfPfamDescriptions['PTM'] = 'PTM=NA'
+                        else:
+                            vcfPfamDescriptions['PTM'] = 'PTM=NO'
+                    else:
+                        vcfPfamDescriptions['PTM'] = 'PTM=' + '|'.join([key + "/" + value for key, value in phosphorylationResults.items()])
+
+                    disorderPredictionData = disorderPredictions.getPrediction(transcript, stopPositionInAminoSpace)
+                    outdata["disorder_prediction"] = disorderPredictionData
+
+#########################################################
+                    lofOutputFile.write('\t' + '\t'.join(outdata[i] for i in LOFparams)+'\n')
+#########################################################
+                    LOFvariants[-1]+=':'+':'.join(['GERPelement='+("YES" if GERPelementdata != '.' else "NO"), 'exoncounts='+exonCountData, 'nearstart=' + nearStart, 'nearend=' + nearEnd, 'canonical='+nmdData['canonical'], nmdData['splice1']+'/'+nmdData['splice2'], str(nmdData['newCDSpos']), 'lofposition='+str(lofPosition), nmdData['nextATG'], 'nmd=' + nmdData['NMD'], nmdData['incrcodingpos'], 'lof_anc=' + isLofAnc, 'heavily_duplicated='+heavilyDuplicated, 'disorder_prediction='+disorderPredictionData]) + ':' + ':'.join([vcfPfamDescriptions[param] for param in pfamParams + ['PTM']])
+
+        vcfOutputFile.write('\t'.join(data[k] for k in range(0,7))+'\t')
+        allvariants = []
+        for variant in LOFvariants:
+            allvariants.append(variant)
+        for variant in splicevariants:
+            allvariants.append(variant)
+        for variant in othervariants:
+            allvariants.append(variant)
+        lineinfo['VA']+=','.join(allvariants) 
+        vcfOutputFile.write(';'.join(lineinfo[infotype] for infotype in infotypes))
+        if len(data[8:]) > 0:
+            vcfOutputFile.write('\t' + '\t'.join(data[8:]) + '\n')
+        else:
+            vcfOutputFile.write('\n')
+
+#Returns the Pfam, transmembrane and PTM domain tables, {domain type: {chromosome: {protein: [lines]}}}
+def getChromosomesPFam(args, chrs):
+    proteinFeaturesList = list(getChromosomesPfamTable(chrs, args.protein_features, "%s.*.txt", ["PF", "SSF", "SM"]).items())
+    transmembraneFeaturesList = list(getChromosomesPfamTable(chrs, args.protein_features, "%s.ens73.alldomainfeatures.txt", ["Tmhmm", "Sigp"]).items())
+    phosphorylationFeaturesList = list(getChromosomesPfamTable(chrs, args.phosphorylation, "*.chr%s.txt", phosphorylationTags, 3).items())
+
+    return dict(proteinFeaturesList + phosphorylationFeaturesList + transmembraneFeaturesList)
+
+#Version of the reference index; bump when the tables it holds or how they are read change
+REFERENCE_INDEX_VERSION = 3
+
+#Tables of the reference index, with their number of nested dictionary levels (0 for tables kept as one value)
+REFERENCE_INDEX_TABLES = [('transcriptAttributes', 0), ('rgenes', 0), ('dgenes', 0)]
+
+#Sources the tables of the reference index are read from; each one is read independently of the others
+REFERENCE_INDEX_SOURCES = ['transcriptToProteinHash', 'rgenes', 'dgenes', 'numpseudogenes', 'paralogs', 'dNdS']
+
+#Returns the tables of the reference index from the tables read from its sources
+#The transcript and gene tables are combined into one attribute table
+def getReferenceIndexTables(sourceTables):
+    transcriptAttributes = attribute_table.getAttributeTable(sourceTables['transcriptToProteinHash'], sourceTables['numpseudogenes'], sourceTables['paralogs'], sourceTables['dNdSmacaque'], sourceTables['dNdSmouse'])
+    return {'transcriptAttributes' : transcriptAttributes, 'rgenes' : sourceTables['rgenes'], 'dgenes' : sourceTables['dgenes']}
+
+#Reads the tables of the reference index that come from one source
+def readReferenceIndexSource(args, chrs, source):
+    if source == 'transcriptToProteinHash':
+        return {'transcriptToProteinHash' : getTranscriptToProteinHash(args.ensembl_table)}
+    elif source == 'rgenes':
+        if VERBOSE: print("Reading recessive genes list")
+        return {'rgenes' : [line.strip() for line in open(args.recessive_genes)]}
+    elif source == 'dgenes':
+        if VERBOSE: print("Reading dominant genes list")
+        return {'dgenes' : [line.strip() for line in open(args.dominant_genes)]}
+    elif source == 'numpseudogenes':
+        if VERBOSE: print("Reading pseudogene data")
+        return {'numpseudogenes' : getPseudogeneData(args.pseudogenes)}
+    elif source == 'paralogs':
+        if VERBOSE: print("Reading paralog data")
+        return {'paralogs' : getParalogData(args.paralogs)}
+    elif source == 'dNdS':
+        if VERBOSE: print("Reading dNdS data")
+        dNdSmacaque, dNdSmouse = getdNdSData(args.dNdS)
+        return {'dNdSmacaque' : dNdSmacaque, 'dNdSmouse' : dNdSmouse}
+
+def getReferenceIndexPath(args):
+    return os.path.join(args.cache, "reference.index")
+
+#Returns the files the Pfam, transmembrane and PTM tables are read from, which getChromosomesPfamTable finds by pattern
+def getPfamTablePaths(args, chrs):
+    patterns = [os.path.join(args.protein_features, "%s.*.txt"), os.path.join(args.protein_features, "%s.ens73.alldomainfeatures.txt"), os.path.join(args.phosphorylation, "*.chr%s.txt")]
+    return sorted(set(path for pattern in patterns for chromosome in chrs for path in glob.glob(pattern % (chromosome))))
+
+#Returns the manifest a reference index is up to date for: the files its tables were read from and the chromosomes
+def getReferenceIndexManifest(args, chrs):
+    return {'version' : REFERENCE_INDEX_VERSION,
+            'chromosomes' : chrs,
+            'data' : dict((dataFile, getPathFingerprint(getattr(args, dataFile))) for dataFile in ['ensembl_table', 'recessive_genes', 'dominant_genes', 'pseudogenes', 'paralogs', 'dNdS'])}
+
+#Returns the reference index in the cache directory if there is one and it is up to date, otherwise None
+def openReferenceIndex(args, chrs):
+    referenceIndexPath = getReferenceIndexPath(args)
+    referenceIndex = reference_bundle.openReferenceBundle(referenceIndexPath)
+    if referenceIndex is None:
+        return None
+
+    try:
+        manifest = referenceIndex.getTable('manifest', 0)
+    except KeyError:
+        manifest = None
+    if manifest != getReferenceIndexManifest(args, chrs):
+        if VERBOSE: print("Not using reference index %s since it was built from other data files" % (referenceIndexPath))
+        referenceIndex.close()
+        return None
+
+    if VERBOSE: print("Using reference index %s" % (referenceIndexPath))
+    return referenceIndex
+
+#Builds one part of the reference index in a worker process. Tables are returned to the parent process, while the
+#transcript model and the sequences are written to their caches directly. Returns None if building the part failed
+def buildReferenceIndexPart(args, chrs, part):
+    partType, name = part
+    try:
+        if partType == 'table':
+            return readReferenceIndexSource(args, chrs, name)
+        elif partType == 'annotation':
+            transcript_store.getCachedChromosomeCDSAndExonDictionaries(getCDSAndExonDictionaries, args.annotation, name, getTranscriptsDirectory(args))
+        elif partType == 'annotation_interval':
+            transcript_store.getCachedCodingExonIntervals(getCodingExonIntervals, args.annotation_interval, getTranscriptsDirectory(args))
+        elif partType == 'elements':
+            for elementPath in glob.glob(os.path.join(args.elements, "*chr%s_*.txt" % (name)))[:1]:
+                element_store.getCachedGERPElements(elementPath, getElementsDirectory(args))
+        elif partType == 'exomes':
+            exomeInputPath = getESPExomeInputPath(args.exomes, name)
+            if exomeInputPath is not None:
+                exomeStore = frequency_store.getFrequencyStore(exomeInputPath, getFrequenciesDirectory(args), functools.partial(readESPRecords, name))
+                if exomeStore is None:
+                    printError("Failed to write ESP6500 store of %s to %s" % (exomeInputPath, getFrequenciesDirectory(args)))
+                exomeStore.close()
+        elif partType == 'disopred':
+            disopredArchive = disorder_store.getDisopredArchive(args.disopred_sequences, getDisopredDirectory(args))
+            if disopredArchive is None:
+                printError("Failed to write DISOPRED archive of %s to %s" % (args.disopred_sequences, getDisopredDirectory(args)))
+            disopredArchive.close()
+        elif partType == 'thousandG':
+            thousandGStore = frequency_store.getFrequencyStore(args.thousandG, getFrequenciesDirectory(args), read1000GRecords)
+            if thousandGStore is None:
+                printError("Failed to write 1000G store of %s to %s" % (args.thousandG, getFrequenciesDirectory(args)))
+            thousandGStore.close()
+        else:
+            #chromosomes without a sequence file are skipped, they only fail a run that has variants on them
+            pattern = os.path.join(args.genome, "chr%s.fa" % (name)) if partType == 'genome' else os.path.join(args.ancestor, "*_%s.fa" % (name))
+            for fastaPath in glob.glob(pattern)[:1]:
+                packedSequence = sequence_store.getPackedSequence(fastaPath, getSequencesDirectory(args))
+                if packedSequence is None:
+                    printError("Failed to write packed sequence of %s to %s" % (fastaPath, getSequencesDirectory(args)), False)
+                else:
+                    packedSequence.close()
+        return {}
+    except SystemExit:
+        #printError already reported the problem; exiting from a pool worker would leave the pool waiting for its result
+        return None
+
+#Runs the index subcommand: builds the reference index from the data files, with independent parts built in parallel
+def indexMain(programName, commandLineArguments):
+    startProgramExecutionTime = datetime.datetime.now()
+
+    parser, args = parseIndexCommandLineArguments(programName, commandLineArguments)
+
+    chrs = [line.strip() for line in open(args.chromosomes)]
+
+    #the byte offset index of the GTF is written once before the chromosomes' transcript models are parsed from it in parallel
+    transcript_store.getChromosomeOffsets(args.annotation, getTranscriptsDirectory(args))
+
+    parts = [('table', source) for source in REFERENCE_INDEX_SOURCES] + [('annotation_interval', None), ('thousandG', None), ('disopred', None)] + [(partType, chromosome) for chromosome in chrs for partType in ['annotation', 'elements', 'genome', 'ancestor', 'exomes']]
+    if VERBOSE: print("Building %d parts of the reference index with %d worker processes" % (len(parts), args.workers))
+
+    pool = getForkedPool(args.workers)
+    try:
+        results = pool.map(functools.partial(buildReferenceIndexPart, args, chrs), parts)
+    finally:
+        pool.terminate()
+
+    if any(result is None for result in results):
+        printError("Failed to build the reference index")
+
+    sourceTables = {}
+    for result in results:
+        sourceTables.update(result)
+    indexTables = getReferenceIndexTables(sourceTables)
+
+    referenceIndexPath = getReferenceIndexPath(args)
+    try:
+        reference_bundle.writeReferenceBundleFile(referenceIndexPath, [('manifest', getReferenceIndexManifest(args, chrs), 0)] + [(name, indexTables[name], depth) for name, depth in REFERENCE_INDEX_TABLES])
+    except (IOError, OSError):
+        printError("Failed to write reference index %s" % (referenceIndexPath))
+
+    if VERBOSE: print("Wrote reference index %s in %d seconds" % (referenceIndexPath, (datetime.datetime.now() - startProgramExecutionTime).seconds))
+
 def main(programName, commandLineArguments):
     startProgramExecutionTime = datetime.datetime.now()
 
     parser, args = parseCommandLineArguments(programName, commandLineArguments)
 
+    if args.output == STDIO_PATH:
+        vcfOutputFile = takeOverStdout()
+        outputDirectory = os.curdir
+    else:
+        outputDirectory = args.output
+
+    chrs = [line.strip() for line in open(args.chromosomes)]
+
     if args.vcf:
-        #run VAT
-        vatPath = os.path.join(args.output, os.path.basename(args.vcf) + ".vat")
-        run_vat([programName, args.vcf, vatPath, args.annotation_interval, args.annotation_sequence], VERBOSE)
+        outputName = getInputName(args.vcf) + ".vat"
+        vatPath = os.path.join(outputDirectory, outputName)
     else:
+        outputName = getInputName(args.vat)
         vatPath = args.vat
-    
-    if VERBOSE: print("Running ALoFT on %s" % (vatPath) + "\n")
-    
-    try:
-        vatFile = open(vatPath)
-    except:
-        printError("Failed to read %s" % (vatPath))
-    
-    tabbedOutputLofPath = os.path.join(args.output, os.path.basename(vatPath) + ".aloft.lof")
-    tabbedOutputSplicePath = os.path.join(args.output, os.path.basename(vatPath) + ".aloft.splice")
-    vcfOutputPath = os.path.join(args.output, os.path.basename(vatPath) + ".aloft.vcf")
+
+    checkpointDirectory = None
+    if args.resume:
+        checkpointDirectory = getCheckpointDirectory(outputDirectory, outputName)
+        openCheckpoint(checkpointDirectory, getCheckpointManifest(args, chrs))
+        if args.vcf and args.stream:
+            #the VAT output is kept with the checkpoint instead of in memory, so a resumed run does not have to run VAT again
+            vatPath = os.path.join(checkpointDirectory, outputName)
+
+    vatLines = None
+    if args.vcf and args.resume and isCheckpointDone(checkpointDirectory, "vat"):
+        if VERBOSE: print("Using VAT output of %s from checkpoint" % (args.vcf))
+    elif args.vcf and args.stream:
+        #run VAT
+        if VERBOSE: print("Running VAT on %s" % (args.vcf))
+        vatLines = stream_vat(args.vcf, args.annotation_interval, args.annotation_sequence, VERBOSE, args.vat_sites_only)
+        if args.resume:
+            #the checkpoint is only marked done once every line is ingested
+            vatLines = writeLinesWhileYielding(vatLines, vatPath)
+    elif args.vcf:
+        #run VAT
+        run_vat([programName, args.vcf, vatPath, args.annotation_interval, args.annotation_sequence], VERBOSE, args.vat_sites_only)
+        if args.resume:
+            markCheckpointDone(checkpointDirectory, "vat")
+
+    #the bed input for the gerp scores is written while the VAT is ingested
+    gerp = None
+    if args.resume and isCheckpointDone(checkpointDirectory, "gerp"):
+        if VERBOSE: print("Using gerp scores from checkpoint")
+        with open(os.path.join(checkpointDirectory, "gerp.pickle"), "rb") as gerpFile:
+            gerpScoresHash = pickle.load(gerpFile)
+    else:
+        gerp = startGerpScores(outputDirectory, args.scores, args.stream)
+
+    if vatLines is not None:
+        if VERBOSE: print("Running ALoFT on VAT output of %s" % (args.vcf) + "\n")
+        headerLines, chromosomeRanges, grouped = ingestVatLines(vatLines, chrs, gerp)
+        vatLines = None
+        if args.resume:
+            markCheckpointDone(checkpointDirectory, "vat")
+    else:
+        if VERBOSE: print("Running ALoFT on %s" % (vatPath) + "\n")
+        headerLines, chromosomeRanges, grouped = ingestVatFile(vatPath, chrs, gerp)
+
+    if gerp is not None:
+        gerpScoresHash = finishGerpScores(gerp)
+        gerp = None
+        if args.resume:
+            with open(os.path.join(checkpointDirectory, "gerp.pickle"), "wb") as gerpFile:
+                pickle.dump(gerpScoresHash, gerpFile, protocol=2)
+            markCheckpointDone(checkpointDirectory, "gerp")
+
+    tabbedOutputLofPath = os.path.join(outputDirectory, outputName + ".aloft.lof")
+    tabbedOutputSplicePath = os.path.join(outputDirectory, outputName + ".aloft.splice")
+    vcfOutputPath = os.path.join(outputDirectory, outputName + ".aloft.vcf")
 
     lofOutputFile = abortIfCannotWriteFile(parser, tabbedOutputLofPath)
     spliceOutputFile = abortIfCannotWriteFile(parser, tabbedOutputSplicePath)
-    vcfOutputFile = abortIfCannotWriteFile(parser, vcfOutputPath)
-    
-    chrs = [line.strip() for line in open(args.chromosomes)]
+    if args.output != STDIO_PATH:
+        vcfOutputFile = abortIfCannotWriteFile(parser, vcfOutputPath)
     
     #Load exon intervals from .interval file, used later for intersecting with gerp elements
-    codingExonIntervals = getCodingExonIntervals(args.annotation_interval)
+    transcriptsDirectory = getTranscriptsDirectory(args)
+    codingExonIntervals = transcript_store.getCachedCodingExonIntervals(getCodingExonIntervals, args.annotation_interval, transcriptsDirectory)
 
-    gerpScoresHash = getGerpScores(vatPath, args.output, args.scores)
-    
-    segdupdata = getSegDupData(vatFile, args.segdup, chrs)
-    
-    if VERBOSE:
-        print('Building CDS and exon dictionaries...')
-        startTime = datetime.datetime.now()
-    
-    transcript_strand, CDS, exon, stop_codon = getCDSAndExonDictionaries(args.annotation, chrs)
+    segdupIndex = getSegDupIndex(args.segdup, chrs)
     
-    if VERBOSE:
-        print(str((datetime.datetime.now() - startTime).seconds) + " seconds.")
-        print('Begin ALoFT Calculations and Write-Out (this may take a while)...')
+    if VERBOSE: print('Begin ALoFT Calculations and Write-Out (this may take a while)...')
             
-    transcriptToProteinHash = getTranscriptToProteinHash(args.ensembl_table)
-
-    proteinFeaturesList = list(getChromosomesPfamTable(chrs, args.protein_features, "%s.*.txt", ["PF", "SSF", "SM"]).items())
-    transmembraneFeaturesList = list(getChromosomesPfamTable(chrs, args.protein_features, "%s.ens73.alldomainfeatures.txt", ["Tmhmm", "Sigp"]).items())
-    phosphorylationTags = ["ACETYLATION", "DI-METHYLATION", "METHYLATION", "MONO-METHYLATION", "O-GlcNAc", "PHOSPHORYLATION", "SUMOYLATION", "TRI-METHYLATION", "UBIQUITINATION"]
-    phosphorylationFeaturesList = list(getChromosomesPfamTable(chrs, args.phosphorylation, "*.chr%s.txt", phosphorylationTags, 3).items())
+    #the small tabular data files are read from the reference index if "index" built one from the same files
+    referenceIndex = openReferenceIndex(args, chrs)
+    if referenceIndex is not None:
+        indexTables = dict((name, referenceIndex.getTable(name, depth)) for name, depth in REFERENCE_INDEX_TABLES)
+    else:
+        sourceTables = {}
+        for source in REFERENCE_INDEX_SOURCES:
+            sourceTables.update(readReferenceIndexSource(args, chrs, source))
+        indexTables = getReferenceIndexTables(sourceTables)
+        del sourceTables
 
-    chromosomesPFam = dict(proteinFeaturesList + phosphorylationFeaturesList + transmembraneFeaturesList)
+    transcriptAttributes = indexTables['transcriptAttributes']
 
     #Scan 1000G file
     if VERBOSE: print("Scanning 1000G file")
-    thousandGChromosomeInfo = get1000GChromosomeInfo(args.thousandG)
+    thousandGChromosomeInfo = get1000GFrequencies(args)
+
+    if VERBOSE: print("Opening DISOPRED predictions")
+    disorderPredictions = getDisorderPredictions(args)
     
+    networkx = None
     ppi = None
     ppiHashPath = None
 
@@ -971,61 +2389,18 @@ def main(programName, commandLineArguments):
         else:
             ppiHash = {"dgenes" : {}, "rgenes" : {}}
     
-    if VERBOSE: print("Reading recessive genes list")
-    rgenes = [line.strip() for line in open(args.recessive_genes)]
-    
-    if VERBOSE: print("Reading dominant genes list")
-    dgenes = [line.strip() for line in open(args.dominant_genes)]
-    
-    if VERBOSE: print("Reading pseudogene data")
-    numpseudogenes = getPseudogeneData(args.pseudogenes)
-    
-    if VERBOSE: print("Reading paralog data")
-    paralogs = getParalogData(args.paralogs)
-    
-    if VERBOSE: print("Reading dNdS data")
-    dNdSmacaque, dNdSmouse = getdNdSData(args.dNdS)
-
-    ptmParams = ["ACETYLATION", "DI-METHYLATION", "METHYLATION", "MONO-METHYLATION", "O-GlcNAc","PHOSPHORYLATION", "SUMOYLATION", "TRI-METHYLATION", "UBIQUITINATION"]
-
-    #params for PF, SSF, SM, etc
-    #this variable could use a better name since it's not just PFAM, but not sure what to call it
-    pfamParams = ["PF", "SSF", "SM", "Tmhmm", "Sigp"]
-
-    pfamParamsWithTruncations = sum([[param, param + "truncated"] for param in pfamParams + ptmParams], []) #using sum to flatten the list
-
-    ##list of output parameters for LOF and splice variants
-    basicparams = ["gene", "gene_id", "partial/full", "transcript", "coding_transcript_length", "coding_transcript"]
-    LOFparams = ["is_single_coding_exon",\
-                "variant_position_in_CDS", "stop_position_in_CDS",\
-                "causes_NMD", "5'_flanking_splice_site",\
-                "3'_flanking_splice_site", "canonical_splice_flank",\
-                "ancestral_allele",\
-                "num_of_lof_flags", "lof_flags",\
-                "GERP_score", "GERP_element", "percentage_gerp_elements_in_truncated_exons", "truncated_exons:total_exons",\
-                "segmental_duplications", "disorder_prediction"] + pfamParamsWithTruncations +\
-                ["1000GPhase1", "1000GPhase1_AF", "1000GPhase1_ASN_AF",\
-                "1000GPhase1_AFR_AF", "1000GPhase1_EUR_AF",\
-                "ESP6500", "ESP6500_AAF",\
-                "#_pseudogenes_associated_to_transcript",\
-                "#_paralogs_associated_to_gene",\
-                "dN/dS_(macaque)", "dN/dS_(mouse)",\
-                "shortest_path_to_recessive_gene", "recessive_neighbors",\
-                "shortest_path_to_dominant_gene", "dominant_neighbors"]
-    spliceparams = ["donor", "acceptor",\
-                "SNP_in_canonical_site", "other_splice_site_canonical",\
-                "SNP_location", "alt_donor", "alt_acceptor", "nagnag_positions",\
-                "intron_length", "num_of_lof_flags", "lof_flags",\
-                "GERP_score", "GERP_element", "percentage_gerp_elements_in_truncated_exons", "truncated_exons:total_exons",\
-                "segmental_duplications", "1000GPhase1", "1000GPhase1_AF", "1000GPhase1_ASN_AF",\
-                "1000GPhase1_AFR_AF", "1000GPhase1_EUR_AF",\
-                "ESP6500", "ESP6500_AAF",\
-                "#_pseudogenes_associated_to_transcript",\
-                "#_paralogs_associated_to_gene",\
-                "dN/dS_(macaque)", "dN/dS_(mouse)",\
-                "shortest_path_to_recessive_gene", "recessive_neighbors",\
-                "shortest_path_to_dominant_gene", "dominant_neighbors"]
-    outdata = {i : "" for i in set(basicparams) | set(LOFparams) | set(spliceparams)}
+    rgenes = indexTables['rgenes']
+    dgenes = indexTables['dgenes']
+
+    referenceData = {'chrs' : chrs, 'segdupIndex' : segdupIndex, 'gerpScoresHash' : gerpScoresHash, 'codingExonIntervals' : codingExonIntervals, 'transcriptAttributes' : transcriptAttributes, 'disorderPredictions' : disorderPredictions, 'thousandGChromosomeInfo' : thousandGChromosomeInfo, 'networkx' : networkx, 'ppi' : ppi, 'ppiHash' : ppiHash, 'rgenes' : rgenes, 'dgenes' : dgenes}
+
+    if args.workers > 1:
+        #workers look up the large tables in one memory mapped bundle shared through the page cache,
+        #instead of each one copying the pages of the dictionaries it touches
+        referenceData = reference_bundle.bundleReferenceData(referenceData, BUNDLED_REFERENCE_TABLES, args.cache)
+        #drop the dictionaries before the workers are forked
+        del gerpScoresHash, codingExonIntervals, thousandGChromosomeInfo, indexTables
+        if VERBOSE: print("Wrote %d byte reference bundle for worker processes" % (len(referenceData['referenceBundle'])))
 
     lofOutputFile.write('chr\tpos\trsID\tref\talt\tscore\tPASS?\tdetails\t')
     lofOutputFile.write('\t'.join(i for i in basicparams)+'\t')
@@ -1035,11 +2410,8 @@ def main(programName, commandLineArguments):
     spliceOutputFile.write('\t'.join(i for i in basicparams)+'\t')
     spliceOutputFile.write('\t'.join(i for i in spliceparams)+'\n')
 
-    ##scan through VCF file metadata
-    counter = 0
-    vatFile.seek(0)
-    line = vatFile.readline()
-    while line=="\n" or line.startswith("#"):
+    ##write VCF file metadata
+    for line in headerLines:
         if line.startswith("#CHR"):
             #for variantTag in ['GERPelement', 'exoncounts', 'nearstart', 'nearend', 'canonical', 'other_noncanonical', 'lofposition', 'nmd', 'intron_length', 'small_intron', 'heavily_duplicated', 'disorder_prediction', 'PTM', 'lof_anc', 'alternate_acceptor_site']:
             #for vcfTag in [['AA', '1', 'String'], ['Ancestral', '1', 'String'], ['SegDup', '1', 'Integer'], ['GERPscore', '1', 'Float'], ['1000GPhase1', '1', 'String'], ['1000GPhase1_AF', '1', 'Float'], ['1000GPhase1_ASN_AF', '1', 'Float'], ['1000GPhase1_AFR_AF', '1', 'Float'], ['1000GPhase1_EUR_AF', '1', 'Float'], ['ESP6500', '1', 'String'], ['ESP6500_AAF', '3', 'Float'], ['VA', '.', 'String']]:
@@ -1048,464 +2420,57 @@ def main(programName, commandLineArguments):
                 vcfOutputFile.write("##INFO=<ID=%s,Number=%s,Type=%s,Description=\"%s\">\n" % (tag, number, datatype, tag))
 
         vcfOutputFile.write(line)
-        counter+=1
-        line = vatFile.readline()
-
-    currentLoadedChromosome = None
-
-    while line!="":
-        data = line.strip().split('\t')
-        chr_num = data[0].split("chr")[-1]
-        start = int(data[1])
-        end = start+len(data[3])-1
-
-        if chr_num not in chrs:
-            line = vatFile.readline()
-            continue
-
-        if not currentLoadedChromosome or currentLoadedChromosome != chr_num:
-            #This is where we get a chance to data that is unique to a chromosome
-            if VERBOSE: print("Reading data from chromosome %s..." % (chr_num))
-            ancestorData = getAncestorData(args.ancestor, chr_num)
-            exomesChromosomeInfo = getESPExomeChromosomeInfo(args.exomes, chr_num) #Scan ESP6500 (exome) fields
-            genomeSequences = getGenomeSequences(args.genome, chr_num)
-
-            elementPath = getFilePathMatchingPattern(os.path.join(args.elements, "*chr%s_*.txt" % (chr_num)), True)
-            GERPelements = mergeElements(getGERPelements(open(elementPath)))
-            currentLoadedChromosome = chr_num
-        
-        #Filter lines
-        if "deletionFS" in line or "insertionFS" in line or "premature" in line or "splice" in line:
-            ancesdata = ancestorData[start:start+len(data[3])].upper()
-            if data[3] == ancesdata:
-                ancestral = "Ref"
-            elif data[4] == ancesdata:
-                ancestral = "Alt"
-            else:
-                ancestral = "Neither"
-            
-            ##screen for variant types here.  skip variant if it is not deletion(N)FS, insertion(N)FS, or premature SNP
-            lineinfo = {'AA':'AA='+ancesdata,\
-                        'Ancestral':'Ancestral='+ancestral,\
-                        'SegDup':'SegDup='+str(segdupdata[counter].count('('))}
-            infotypes = ['AA', 'Ancestral', 'GERPscore', 'SegDup']
-    
-            outdata["ancestral_allele"] = ancesdata
-            outdata["segmental_duplications"] = '.' if segdupdata[counter].count('(') == '0' else segdupdata[counter]
-            
-            dataInfoComponents = data[7].split(';')
-            found = 0
-            for info in dataInfoComponents:
-                infotype = info.split('=')[0]
-                if infotype == 'VA':
-                    variants = info.split('VA=')[-1].split(',')
-                    found = 1
-                if infotype!='AA' and infotype!='VA':
-                    lineinfo[infotype]=info
-                    infotypes.append(infotype)
-            
-            if found==1:
-                lineinfo['VA']='VA='
-                infotypes.append('VA')
-
-            def writeVCFUpToBasicParams(outfile):
-                outfile.write("\t".join(data))
-                outfile.write('\t'+ '\t'.join(outdata[i] for i in basicparams))
-            
-            LOFvariants = []
-            splicevariants = []
-            othervariants = []
-            for variant in variants:
-                details = variant.split(":")
-
-                refAltPosition = getRefAltPositionKey(data, int(details[0]) - 1)
-
-                GERPscore = gerpScoresHash[chr_num][refAltPosition]
-                lineinfo['GERPscore'] = 'GERPscore='+"%.2f" % GERPscore
-                outdata["GERP_score"] = "%.2f" % GERPscore
-
-                #Adding 1000G fields
-                thousandGTags = ['1000GPhase1_AF', '1000GPhase1_ASN_AF', '1000GPhase1_AFR_AF', '1000GPhase1_EUR_AF']
-                thousandGComponents = []
-                for thousandGTag in thousandGTags:
-                    thousandGComponents.append(thousandGTag + "=NA")
-                
-                if chr_num in thousandGChromosomeInfo and refAltPosition in thousandGChromosomeInfo[chr_num]:
-                    for info in thousandGChromosomeInfo[chr_num][refAltPosition].split(";"):
-                        infotype = info.split('=')[0]  
-                        newComponent = "1000GPhase1_" + info
-                        thousandGComponentIndex = -1
-                        for findIndex in range(len(thousandGTags)):
-                            if infotype == "_".join(thousandGTags[findIndex].split("_")[1:]):
-                                thousandGComponentIndex = findIndex
-                                break
-                        
-                        if thousandGComponentIndex >= 0:
-                            thousandGComponents[thousandGComponentIndex] = newComponent
-                
-                infotypes += ['1000GPhase1'] + thousandGTags
-                if chr_num in thousandGChromosomeInfo and refAltPosition in thousandGChromosomeInfo[chr_num]:
-                    lineinfo['1000GPhase1'] = '1000GPhase1=Yes'
-                else:
-                    lineinfo['1000GPhase1'] = '1000GPhase1=No'
-                
-                #Add 1000G entries to output
-                for tagIndex in range(len(thousandGTags)):
-                    lineinfo[thousandGTags[tagIndex]] = thousandGComponents[tagIndex]
-                
-                #Add exomes info to output
-                infotypes += ['ESP6500', 'ESP6500_AAF']
-                if refAltPosition in exomesChromosomeInfo:
-                    lineinfo['ESP6500'] = 'ESP6500=Yes'
-                    lineinfo['ESP6500_AAF'] = 'ESP6500_AAF=' + exomesChromosomeInfo[refAltPosition]
-                else:
-                    lineinfo['ESP6500'] = 'ESP6500=No'
-                    lineinfo['ESP6500_AAF'] = 'ESP6500_AAF=NA,NA,NA'
-                
-                for tag in ['1000GPhase1'] + thousandGTags + ['ESP6500', 'ESP6500_AAF']:
-                    outdata[tag] = lineinfo[tag]
-
-                ##alternate allele corresponding to variant
-                subst = data[4].split(',')[int(variant.split(':')[0])-1]
-                
-                if "deletionFS" not in variant and "insertionFS" not in variant:
-                    if "premature" not in variant and "splice" not in variant:
-                        othervariants.append(variant)
-                        continue
-    
-                outdata["gene"], outdata["gene_id"] = details[1], details[2]
-    
-                if details[5].split("/")[0]==details[5].split("/")[1]:
-                    pf = "full"
-                else:
-                    pf = "partial"
-                outdata["partial/full"] = pf
-                
-                transcripts = []
-    
-                for i in range(6, len(details)-1, 3):
-                    transcripts.append(details[i:i+3])
-                longesttranscript = max([int(i[2].split('_')[0]) for i in transcripts])
-    
-                ##calculate distance to dominant and recessive genes
-                gene_name = outdata["gene"]
-                if ppi is not None and gene_name in ppi:
-                    dominantdist, numberOfDominantNeighbors = parsePPI(networkx, ppi, ppiHash, "dgenes", gene_name, dgenes)
-                    outdata["shortest_path_to_dominant_gene"] = 'NA' if dominantdist is None else str(dominantdist)
-                    outdata["dominant_neighbors"] = str(numberOfDominantNeighbors)
-
-                    recessdist, numberOfRecessiveNeighbors = parsePPI(networkx, ppi, ppiHash, "rgenes", gene_name, rgenes)
-                    outdata["shortest_path_to_recessive_gene"] = 'NA' if recessdist is None else str(recessdist)
-                    outdata["recessive_neighbors"] = str(numberOfRecessiveNeighbors)
-                else:
-                    outdata["shortest_path_to_recessive_gene"] = 'NA'
-                    outdata["recessive_neighbors"] = 'NA'
-    
-                    outdata["shortest_path_to_dominant_gene"] = 'NA'
-                    outdata["dominant_neighbors"] = 'NA'
-    
-                outdata["#_paralogs_associated_to_gene"] = str(len(paralogs[outdata["gene_id"].split('.')[0]])) if outdata["gene_id"].split('.')[0] in paralogs else "0"
-    
-                ##number of associated pseudogenes computation goes here
-    
-                if "splice" in variant:
-                    ##check that is a SNP splice variant
-                    if len(data[3])>1 or len(subst)>1:
-                        splicevariants.append(variant)
-                        continue
-                    splicevariants.append(':'.join(details[:6]))
-    
-                    for entry in transcripts:
-                        splicevariants[-1]+=':' + ':'.join(entry[0:1] + [pf] + entry[1:])
-                        transcript = entry[1]
-                        outdata["transcript"] = transcript
-                        outdata["coding_transcript_length"] = entry[2]
-                        outdata["coding_transcript"] = "YES" if int(outdata["coding_transcript_length"])==longesttranscript else "NO"
-                        ispositivestr = transcript_strand[transcript]=='+'
-
-                        GERPelementdata, GERPrejectiondata, exonCountData = getGERPData(True, GERPelements, codingExonIntervals[chr_num][transcript] if transcript in codingExonIntervals[chr_num] else None, start, end, transcript_strand[transcript])
-
-                        outdata['GERP_element'] = GERPelementdata
-                        outdata['percentage_gerp_elements_in_truncated_exons'] = GERPrejectiondata
-                        outdata['truncated_exons:total_exons'] = exonCountData
-    
-                        outdata["#_pseudogenes_associated_to_transcript"] = str(numpseudogenes[transcript]) if transcript in numpseudogenes else "0"
-
-                        macaque = 'NA'
-                        if transcript.split('.')[0] in dNdSmacaque:
-                            if dNdSmacaque[transcript.split('.')[0]] != 'N/A':
-                                macaque = "%.3f" % float(dNdSmacaque[transcript.split('.')[0]])
-
-                        outdata["dN/dS_(macaque)"] =  macaque
-
-                        mouse = 'NA'
-                        if transcript.split('.')[0] in dNdSmouse:
-                            if dNdSmouse[transcript.split('.')[0]] != 'N/A':
-                                mouse = "%.3f" % float(dNdSmouse[transcript.split('.')[0]])
-
-                        outdata["dN/dS_(mouse)"] = mouse
-                        
-                        writeVCFUpToBasicParams(spliceOutputFile)
-
-                        spliceSearchData = searchInSplices(chr_num, transcript, genomeSequences, ispositivestr, start, CDS, subst)
-
-                        def writeSpliceOutput(failure):
-                            spliceOutputFile.write('\t'+'\t'.join(outdata[i] for i in ["shortest_path_to_recessive_gene", "recessive_neighbors"]))
-                            spliceOutputFile.write("\t%s: pos=" % (failure) +str(start)+' transcript='+transcript+'\n')
-
-                        if not spliceSearchData['found']:
-                            writeSpliceOutput("CDS_match_not_found")
-                            continue
-
-                        if not spliceSearchData['new']:
-                            writeSpliceOutput("no_donor_or_acceptor_pair")
-                            continue
-
-                        new = spliceSearchData['new']
-                        donor = spliceSearchData['donor']
-                        acceptor = spliceSearchData['acceptor']
-                        intronlength = spliceSearchData['intronlength']
-
-                        outdata["donor"] = donor
-                        outdata["acceptor"] = acceptor
-                        outdata["intron_length"] = str(intronlength)
-                        ##write to output
-                        if new[0]==0:
-                            isCanonical = 'YES' if (donor in ['GT', 'GC'] or (donor == 'AT' and acceptor == 'AC')) else 'NO'
-                            otherCanonical = 'YES' if (acceptor=='AG' or (acceptor == 'AC' and donor == 'AT')) else 'NO'
-                        elif new[0]==1:
-                            isCanonical = 'YES' if (acceptor=='AG' or (acceptor == 'AC' and donor == 'AT')) else 'NO'
-                            otherCanonical = 'YES' if (donor in ['GT', 'GC'] or (donor == 'AT' and acceptor == 'AC')) else 'NO'
-                        outdata["SNP_in_canonical_site"] = isCanonical
-                        outdata["other_splice_site_canonical"] = otherCanonical
-                        
-                        if new[0]==0:
-                            outdata["SNP_location"] = "donor"
-                            outdata["alt_donor"] = new[1].upper()
-                            outdata["alt_acceptor"] = acceptor
-                        else:
-                            outdata["SNP_location"] = "acceptor"
-                            outdata["alt_donor"] = donor
-                            outdata["alt_acceptor"] = new[1].upper()
-
-                        if new[0] == 1: #acceptor snp location
-                            nagNagPositions = getMatchingNagnagnagPositions(genomeSequences, start, ispositivestr)
-                            outdata['nagnag_positions'] = '/'.join(map(str, nagNagPositions)) if len(nagNagPositions) > 0 else '.'
-                            alternateAcceptorSite = 'YES' if len(nagNagPositions) > 0 else 'NO'
-                        else:
-                            outdata['nagnag_positions'] = 'NA'
-                            alternateAcceptorSite = 'NA'
-    
-                        #calculation of filters
-                        failed_filters = []
-                        if isCanonical == 'NO':
-                            failed_filters.append('ref_noncanonical')
-                            if new[0] == 0 and new[1].upper() != 'GT': #snp is in donor, and alt donor is not GT
-                                failed_filters.append('alt_noncanonical')
-                            elif new[0] != 0 and new[1].upper() != 'AG': #snp is in acceptor, and alt acceptor is not AG
-                                failed_filters.append('alt_noncanonical')
-
-                        if otherCanonical == 'NO':
-                            failed_filters.append('other_noncanonical')
-                        if intronlength < 15:
-                            failed_filters.append('short_intron')
-                            smallIntron = 'YES'
-                        else:
-                            smallIntron = 'NO'
-                        if segdupdata[counter].count('(') > 3:
-                            failed_filters.append('heavily_duplicated')
-                            heavilyDuplicated = 'YES'
-                        else:
-                            heavilyDuplicated = 'NO'
-
-                        isLofAnc = 'NO'
-                        if ancesdata==subst:
-                            failed_filters.append('lof_anc')
-                            isLofAnc = 'YES'
-    
-                        outdata["num_of_lof_flags"] = str(len(failed_filters)) if len(failed_filters) > 0 else "none"
-                        outdata["lof_flags"] = ','.join(failed_filters)
-
-    ########################################################
-                        spliceOutputFile.write("\t"+"\t".join(outdata[i] for i in spliceparams)+"\n")
-    #########################################################
-                        splicevariants[-1]+=':'+':'.join(['GERPelement='+("YES" if GERPelementdata != '.' else "NO"), 'exoncounts='+exonCountData, donor+'/'+acceptor, 'is_canonical=' + isCanonical, 'other_noncanonical=' + otherCanonical, 'intron_length=' + str(intronlength), 'small_intron=' + smallIntron, 'heavily_duplicated=' + heavilyDuplicated, 'lof_anc=' + isLofAnc, 'alternate_acceptor_site=' + alternateAcceptorSite])
-                        
-                else:   ##deletionFS, insertionFS, or prematureStop
-                    LOFvariants.append(':'.join(details[:6]))
-    
-                    for entry in transcripts:
-                        LOFvariants[-1]+=':'+':'.join(entry[0:1] + [pf] + entry[1:])
-                        
-                        tlength = entry[2].split('_')[0]
-                        outdata["coding_transcript_length"] = tlength
-                        try:
-                            LOFposition = entry[2].split('_')[1]
-                        except:
-                            LOFposition = '.'
-                        outdata["coding_transcript"] = "YES" if int(tlength)==longesttranscript else "NO"
-                        transcript = entry[1]
-                        outdata["transcript"]=transcript
-                       
-              #calculation of filters
-                        failed_filters = []
-
-                        nearStart = 'NO'
-                        nearEnd = 'NO'
-                        try:    #since LOFposition may not be provided
-                            if float(LOFposition)/float(tlength) <= 0.05:
-                                failed_filters.append('near_start')
-                                nearStart = 'YES'
-                            if float(LOFposition)/float(tlength) >= 0.95:
-                                failed_filters.append('near_stop')
-                                nearEnd = 'YES'
-                        except:
-                            pass
-                        
-                        isLofAnc = 'NO'
-                        if ancesdata==subst:
-                            failed_filters.append('lof_anc')
-                            isLofAnc = 'YES'
-                        
-                        heavilyDuplicated = 'NO'
-                        if segdupdata[counter].count('(') > 3:
-                            failed_filters.append('heavily_duplicated')
-                            heavilyDuplicated = 'YES'
-
-                        outdata["num_of_lof_flags"] = str(len(failed_filters)) if len(failed_filters) > 0 else "none"
-                        outdata["lof_flags"] = ','.join(failed_filters)
-    
-                        outdata["variant_position_in_CDS"] = "NA"
-                        outdata["stop_position_in_CDS"] = "NA"
-                        outdata["5'_flanking_splice_site"] = "NA"
-                        outdata["3'_flanking_splice _site"] = "NA"
-                        outdata["canonical_splice_flank"] = "NA"
-                        outdata["#_pseudogenes_associated_to_transcript"] = str(numpseudogenes[transcript]) if transcript in numpseudogenes else "0"
-                        outdata["dN/dS_(macaque)"] = dNdSmacaque[transcript.split('.')[0]] if transcript.split('.')[0] in dNdSmacaque else "NA"
-                        outdata["dN/dS_(mouse)"] = dNdSmouse[transcript.split('.')[0]] if transcript.split('.')[0] in dNdSmouse else "NA"
-                        
-                        writeVCFUpToBasicParams(lofOutputFile)
-                        
-                        try:
-                            nmdData = findNMDForIndelsAndPrematureStop(args.nmd_threshold, data, chr_num, transcript, start, end, exon, stop_codon, genomeSequences, CDS, subst, transcript_strand)
-                        except KeyError:
-                            printError("Failed to lookup indel data for transcript %s" % transcript, False)
-                            continue
-
-                        if nmdData['NMD'] is None:
-                            continue
-
-                        outdata['causes_NMD'] = nmdData['NMD']
-
-                        if nmdData['issinglecodingexon']:
-                            outdata["is_single_coding_exon"] = nmdData['issinglecodingexon']
-
-                        #NA for premature SNPs
-                        if nmdData['newCDSpos'] and not ('prematureStop' in variant and (len(data[3])>1 or len(subst)>1)):
-                            outdata['variant_position_in_CDS'] = str(nmdData['newCDSpos'])
-
-                        if nmdData['NMD'] not in ['YES', 'NO']:
-                            lofOutputFile.write('\t'+'\t'.join(outdata[i] for i in LOFparams) + '\n')
-                            continue
-
-                        lofPosition = nmdData['newCDSpos'] if "prematureStop" in variant else nmdData['stopCDS']
-
-                        outdata["5'_flanking_splice_site"] = nmdData['splice1']
-                        outdata["3'_flanking_splice_site"] = nmdData['splice2']
-                        if nmdData['splice1'] == '.' and nmdData['splice2'] == '.':
-                            outdata["canonical_splice_flank"] = 'NA'
-                        elif nmdData['splice1'] == 'AG' and nmdData['splice2'] == 'GC':
-                            outdata["canonical_splice_flank"] = 'YES'
-                        else:
-                            outdata["canonical_splice_flank"] = nmdData['canonical']
-                            if nmdData['canonical'] == 'NO':
-                                failed_filters.append("canonical_splice_flank")
-                                outdata["num_of_lof_flags"] = str(len(failed_filters)) if len(failed_filters) > 0 else "none"
-                                outdata["lof_flags"] = ','.join(failed_filters)
-                        
-                        outdata["stop_position_in_CDS"] = str(lofPosition)
-
-                        vcfPfamDescriptions = {}
-                        phosphorylationResults = {}
-
-                        oneNA = False
-                        oneNO = False
-                        oneYES = False
 
-                        stopPositionInAminoSpace = int(entry[2].split('_')[2]) if "prematureStop" in variant else (lofPosition - 1) // 3 + 1
-
-                        if "prematureStop" not in variant:
-                            stopPositionForGERP = calculateAbsolutePosition(lofPosition, codingExonIntervals[chr_num][transcript], transcript_strand[transcript])
-                        else:
-                            stopPositionForGERP = start
-                        
-                        GERPelementdata, GERPrejectiondata, exonCountData = getGERPData(False, GERPelements, codingExonIntervals[chr_num][transcript] if transcript in codingExonIntervals[chr_num] else None, stopPositionForGERP, stopPositionForGERP + len(data[3]) - 1, transcript_strand[transcript])
-
-                        outdata['GERP_element'] = GERPelementdata
-                        outdata['percentage_gerp_elements_in_truncated_exons'] = GERPrejectiondata
-                        outdata['truncated_exons:total_exons'] = exonCountData
-
-                        for paramKey in pfamParams + ptmParams:
-                            shortDescription, verboseDescriptionMatched, verboseDescriptionLost = getPfamDescription(transcriptToProteinHash, chr_num, transcript.split(".")[0], stopPositionInAminoSpace, chromosomesPFam, paramKey)
-                            
-                            if paramKey in pfamParams:
-                                vcfPfamDescriptions[paramKey] = "%s=%s" % (paramKey, shortDescription)
-                            elif paramKey in phosphorylationTags:
-                                if shortDescription == "YES":
-                                    phosphorylationResults[paramKey] = shortDescription
-
-                                if shortDescription == 'YES':
-                                    oneYES = True
-                                elif shortDescription == 'NO':
-                                    oneNO = True
-                                elif shortDescription == 'NA':
-                                    oneNA = True
-                            else:
-                                vcfPfamDescriptions[paramKey] = ''
-
-                            outdata[paramKey] = verboseDescriptionMatched
-                            outdata[pfamParamsWithTruncations[pfamParamsWithTruncations.index(paramKey)+1]] = verboseDescriptionLost
-
-                        if len(phosphorylationResults) == 0:
-                            if oneNA and oneNO:
-                                vcfPfamDescriptions['PTM'] = 'PTM=NO/NA'
-                            elif oneNA:
-                                vcfPfamDescriptions['PTM'] = 'PTM=NA'
-                            else:
-                                vcfPfamDescriptions['PTM'] = 'PTM=NO'
-                        else:
-                            vcfPfamDescriptions['PTM'] = 'PTM=' + '|'.join([key + "/" + value for key, value in phosphorylationResults.items()])
-
-                        disorderPredictionData = getDisopredData(args.disopred_sequences, transcript, stopPositionInAminoSpace)
-                        outdata["disorder_prediction"] = disorderPredictionData
-
-    #########################################################
-                        lofOutputFile.write('\t' + '\t'.join(outdata[i] for i in LOFparams)+'\n')
-    #########################################################
-                        LOFvariants[-1]+=':'+':'.join(['GERPelement='+("YES" if GERPelementdata != '.' else "NO"), 'exoncounts='+exonCountData, 'nearstart=' + nearStart, 'nearend=' + nearEnd, 'canonical='+nmdData['canonical'], nmdData['splice1']+'/'+nmdData['splice2'], str(nmdData['newCDSpos']), 'lofposition='+str(lofPosition), nmdData['nextATG'], 'nmd=' + nmdData['NMD'], nmdData['incrcodingpos'], 'lof_anc=' + isLofAnc, 'heavily_duplicated='+heavilyDuplicated, 'disorder_prediction='+disorderPredictionData]) + ':' + ':'.join([vcfPfamDescriptions[param] for param in pfamParams + ['PTM']])
-
-            vcfOutputFile.write('\t'.join(data[k] for k in range(0,7))+'\t')
-            allvariants = []
-            for variant in LOFvariants:
-                allvariants.append(variant)
-            for variant in splicevariants:
-                allvariants.append(variant)
-            for variant in othervariants:
-                allvariants.append(variant)
-            lineinfo['VA']+=','.join(allvariants) 
-            vcfOutputFile.write(';'.join(lineinfo[infotype] for infotype in infotypes))
-            if len(data[8:]) > 0:
-                vcfOutputFile.write('\t' + '\t'.join(data[8:]) + '\n')
-            else:
-                vcfOutputFile.write('\n')
-        
-        line=vatFile.readline()
-        counter+=1
+    #if the input is not grouped by chromosome, each chromosome is still annotated once,
+    #and its rows are spilled so they can be merged back into input order afterwards
+    spillFiles = None
+    if not grouped:
+        if VERBOSE: print("Input is not grouped by chromosome; annotating %d chromosomes one at a time" % (len(chromosomeRanges)))
+        spillFiles = [tempfile.SpooledTemporaryFile(SPILL_MEMORY_SIZE) for _ in chromosomeRanges]
+
+    #with --resume, each range's rows are spilled to a checkpoint file instead, and ranges checkpointed by an earlier run are skipped
+    rangeIndexes = list(range(len(chromosomeRanges)))
+    rangeDone = None
+    if args.resume:
+        rangeIndexes = [rangeIndex for rangeIndex in rangeIndexes if not isCheckpointDone(checkpointDirectory, "range%d" % (rangeIndex))]
+        if VERBOSE: print("%d of %d chromosome ranges are already annotated in the checkpoint" % (len(chromosomeRanges) - len(rangeIndexes), len(chromosomeRanges)))
+        spillFiles = [open(getRangeCheckpointPath(checkpointDirectory, rangeIndex, chromosomeRanges[rangeIndex][0]), "wb") for rangeIndex in rangeIndexes]
+        def rangeDone(pendingIndex):
+            spillFiles[pendingIndex].close()
+            markCheckpointDone(checkpointDirectory, "range%d" % (rangeIndexes[pendingIndex]))
+    pendingRanges = [chromosomeRanges[rangeIndex] for rangeIndex in rangeIndexes]
+
+    if args.workers > 1:
+        if VERBOSE: print("Annotating %d chromosome ranges with %d worker processes" % (len(pendingRanges), args.workers))
+        #the header was written through the file object, so flush it before shards are appended
+        for outputFile in [lofOutputFile, spliceOutputFile, vcfOutputFile]:
+            outputFile.flush()
+        annotateChromosomeRangesInParallel(args, referenceData, outputName, pendingRanges, [lofOutputFile, spliceOutputFile, vcfOutputFile], spillFiles, rangeDone)
+    else:
+        annotateChromosomeRanges(args, referenceData, pendingRanges, [lofOutputFile, spliceOutputFile, vcfOutputFile], spillFiles, rangeDone)
+
+    if args.resume:
+        #only concatenate the checkpointed ranges once every range is done
+        spillFiles = [open(getRangeCheckpointPath(checkpointDirectory, rangeIndex, chromosome), "rb") for rangeIndex, (chromosome, records) in enumerate(chromosomeRanges)]
+
+    if spillFiles is not None:
+        writeSpilledRowsInInputOrder(spillFiles, [lofOutputFile, spliceOutputFile, vcfOutputFile])
+        for spillFile in spillFiles:
+            spillFile.close()
+    for chromosome, records in chromosomeRanges:
+        records.close()
     
     vcfOutputFile.close()
     lofOutputFile.close()
     spliceOutputFile.close()
-    vatFile.close()
+
+    if 'referenceBundle' in referenceData:
+        referenceData['referenceBundle'].close()
+    if referenceIndex is not None:
+        referenceIndex.close()
+    if isinstance(referenceData['thousandGChromosomeInfo'], frequency_store.FrequencyStore):
+        referenceData['thousandGChromosomeInfo'].close()
+    referenceData['disorderPredictions'].close()
 
     if ppiHash is not None:
         try:
@@ -1514,7 +2479,14 @@ def main(programName, commandLineArguments):
         except:
             printError("Failed to write PPI cache, skipping..", False)
 
+    if args.resume:
+        #the outputs are complete, so the checkpoint is no longer needed
+        shutil.rmtree(checkpointDirectory)
+
     if VERBOSE: print("Finished execution in %d seconds" % ((datetime.datetime.now() - startProgramExecutionTime).seconds))
 
 if __name__ == "__main__":
-    main(sys.argv[0], sys.argv[1:])
+    if sys.argv[1:2] == ["index"]:
+        indexMain(sys.argv[0] + " index", sys.argv[2:])
+    else:
+        main(sys.argv[0], sys.argv[1:])
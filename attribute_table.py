@@ -0,0 +1,110 @@
+#Interned table of per-transcript and per-gene attributes
+#Every transcript or gene ID is interned once and mapped to a row, and the attributes of the pseudogene, paralog, dN/dS and
+#Ensembl protein tables are kept in typed columns indexed by that row instead of in a separate dictionary each
+
+from array import array
+
+#intern was moved to sys in python 3
+try:
+    intern
+except NameError:
+    from sys import intern
+
+DNDS_SPECIES = ['macaque', 'mouse']
+
+class AttributeTable(object):
+    def __init__(self):
+        self.rows = {}
+        self.pseudogeneCounts = array('I')
+        self.paralogCounts = array('I')
+        #index into proteins, or -1 for IDs without a protein
+        self.proteinIndexes = array('i')
+        self.proteins = []
+        self.proteinRows = {}
+        #dN/dS as numbers, or NaN if missing or not a number, next to the text it was read from, or None if missing
+        self.dNdS = dict((species, array('d')) for species in DNDS_SPECIES)
+        self.dNdSTexts = dict((species, []) for species in DNDS_SPECIES)
+
+    def __len__(self):
+        return len(self.rows)
+
+    #Returns the row of an ID, adding a row without attributes for it if there is none
+    def addRow(self, identifier):
+        row = self.rows.get(identifier)
+        if row is None:
+            row = len(self.rows)
+            self.rows[intern(identifier)] = row
+            self.pseudogeneCounts.append(0)
+            self.paralogCounts.append(0)
+            self.proteinIndexes.append(-1)
+            for species in DNDS_SPECIES:
+                self.dNdS[species].append(float('nan'))
+                self.dNdSTexts[species].append(None)
+        return row
+
+    #Returns the row of an ID, or None if there is none
+    def getRow(self, identifier):
+        return self.rows.get(identifier)
+
+    def setProtein(self, identifier, protein):
+        proteinIndex = self.proteinRows.get(protein)
+        if proteinIndex is None:
+            proteinIndex = len(self.proteins)
+            self.proteins.append(protein)
+            self.proteinRows[protein] = proteinIndex
+        self.proteinIndexes[self.addRow(identifier)] = proteinIndex
+
+    def setDNdS(self, identifier, species, dNdSText):
+        row = self.addRow(identifier)
+        self.dNdSTexts[species][row] = intern(dNdSText)
+        try:
+            self.dNdS[species][row] = float(dNdSText)
+        except ValueError:
+            pass
+
+    def getPseudogeneCount(self, identifier):
+        row = self.rows.get(identifier)
+        return 0 if row is None else self.pseudogeneCounts[row]
+
+    def getParalogCount(self, identifier):
+        row = self.rows.get(identifier)
+        return 0 if row is None else self.paralogCounts[row]
+
+    #Returns the protein of a row, or None if it has none
+    def getProtein(self, row):
+        if row is None or self.proteinIndexes[row] < 0:
+            return None
+        return self.proteins[self.proteinIndexes[row]]
+
+    #Returns the dN/dS text of a row as it was read, or None if it has none
+    def getDNdSText(self, row, species):
+        return None if row is None else self.dNdSTexts[species][row]
+
+    #Returns the dN/dS of a row, or NaN if it has none or it is not a number
+    def getDNdS(self, row, species):
+        return float('nan') if row is None else self.dNdS[species][row]
+
+    #the ID dictionary is only needed to add rows, the protein index is rebuilt from the proteins when unpickled
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['proteinRows']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rows = dict((intern(identifier), row) for identifier, row in self.rows.items())
+        self.proteinRows = dict((protein, proteinIndex) for proteinIndex, protein in enumerate(self.proteins))
+
+#Returns an attribute table holding the tables read by getTranscriptToProteinHash, getPseudogeneData, getParalogData and getdNdSData
+def getAttributeTable(transcriptToProteinHash, numpseudogenes, paralogs, dNdSmacaque, dNdSmouse):
+    attributeTable = AttributeTable()
+    for transcript, protein in transcriptToProteinHash.items():
+        attributeTable.setProtein(transcript, protein)
+    for transcript, pseudogeneCount in numpseudogenes.items():
+        attributeTable.pseudogeneCounts[attributeTable.addRow(transcript)] = pseudogeneCount
+    for gene, geneParalogs in paralogs.items():
+        attributeTable.paralogCounts[attributeTable.addRow(gene)] = len(geneParalogs)
+    for species, dNdSTable in zip(DNDS_SPECIES, [dNdSmacaque, dNdSmouse]):
+        for transcript, dNdSText in dNdSTable.items():
+            attributeTable.setDNdS(transcript, species, dNdSText)
+    return attributeTable
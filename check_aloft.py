@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+#Consistency checks for ALoFT, run against a data directory and a small input
+#  python check_aloft.py workers --data data --vat small.vat
+#runs ALoFT on the input serially and with several worker processes, and checks that the outputs are byte for byte the same
+#  python check_aloft.py stores --data data
+#converts the data files into the stores ALoFT keeps in its cache directory, and checks that looking values up in the stores
+#gives the same values as the readers of the original text files
+
+import os, sys, subprocess, shutil, tempfile, argparse, filecmp, glob, random
+
+#Output files ALoFT writes for an input
+OUTPUT_EXTENSIONS = [".aloft.lof", ".aloft.splice", ".aloft.vcf"]
+
+def getScriptDirectory():
+    return os.path.dirname(os.path.realpath(__file__))
+
+#Runs aloft.py on args.vat with extra options, writing into outputDirectory
+def runAloft(args, outputDirectory, options):
+    command = [sys.executable, os.path.join(getScriptDirectory(), "aloft.py"), "--vat", args.vat, "--data", args.data, "--cache", args.cache, "--output", outputDirectory] + options
+    if args.verbose: print("Running %s" % (" ".join(command)))
+    with open(os.devnull, "w") as devnull:
+        if subprocess.call(command, stdout=None if args.verbose else devnull, stderr=None if args.verbose else devnull) != 0:
+            print("FAILED: %s" % (" ".join(command)))
+            return False
+    return True
+
+#Returns the names of the output files that differ between two output directories
+def getDifferingOutputs(args, expectedDirectory, outputDirectory):
+    name = os.path.basename(args.vat)
+    differing = []
+    for extension in OUTPUT_EXTENSIONS:
+        expectedPath = os.path.join(expectedDirectory, name + extension)
+        outputPath = os.path.join(outputDirectory, name + extension)
+        if not os.path.exists(outputPath) or not filecmp.cmp(expectedPath, outputPath, shallow=False):
+            differing.append(name + extension)
+    return differing
+
+#Returns the number of LoF and splice variants on each chromosome of the VAT file
+#With several workers, a chromosome is split into shards of these variants, so only chromosomes with more than one are ever split
+def getChromosomeRecordCounts(vatPath):
+    import aloft
+    recordCounts = {}
+    with open(vatPath) as vatFile:
+        for line in vatFile:
+            if line.startswith("#") or not aloft.isLofOrSpliceLine(line):
+                continue
+            chromosome = line.split("\t", 1)[0]
+            recordCounts[chromosome] = recordCounts.get(chromosome, 0) + 1
+    return recordCounts
+
+#Checks that the outputs of every worker count are the same as a serial run's
+#The rows of a VAT line never depend on the lines annotated before it, so this holds however the lines are split up
+def checkWorkers(args):
+    recordCounts = getChromosomeRecordCounts(args.vat)
+    shardedChromosomes = [chromosome for chromosome in recordCounts if recordCounts[chromosome] > 1]
+    if len(shardedChromosomes) == 0:
+        print("warning: no chromosome in %s has more than one LoF or splice variant, so no chromosome is split into shards" % (args.vat))
+    elif args.verbose:
+        print("Chromosomes split into shards: %s" % (", ".join(sorted(shardedChromosomes))))
+
+    workDirectory = tempfile.mkdtemp(prefix="aloft_check.")
+    try:
+        serialDirectory = os.path.join(workDirectory, "workers1")
+        if not runAloft(args, serialDirectory, ["--workers", "1"]):
+            return False
+        passed = True
+        for workers in args.workers:
+            outputDirectory = os.path.join(workDirectory, "workers%d" % (workers))
+            if not runAloft(args, outputDirectory, ["--workers", str(workers)]):
+                passed = False
+                continue
+            differing = getDifferingOutputs(args, serialDirectory, outputDirectory)
+            if len(differing) > 0:
+                print("FAILED: --workers %d output differs from --workers 1 in %s" % (workers, ", ".join(differing)))
+                passed = False
+            else:
+                print("ok: --workers %d output is the same as --workers 1" % (workers))
+        return passed
+    finally:
+        shutil.rmtree(workDirectory)
+
+#Number of bases compared at a time when checking a sequence
+SEQUENCE_CHUNK_SIZE = 1024 * 1024
+
+#Returns a description of the first difference between a sequence read from a FASTA file and its packed sequence, or None if they are the same
+def getSequenceDifference(args, expected, packed):
+    if len(expected) != len(packed):
+        return "length %d instead of %d" % (len(packed), len(expected))
+    for start in range(0, len(expected), SEQUENCE_CHUNK_SIZE):
+        expectedChunk = expected[start:start + SEQUENCE_CHUNK_SIZE]
+        packedChunk = packed[start:start + SEQUENCE_CHUNK_SIZE]
+        if expectedChunk != packedChunk:
+            position = start + next(index for index in range(len(expectedChunk)) if expectedChunk[index] != packedChunk[index])
+            return "%r instead of %r at position %d" % (packedChunk[position - start], expectedChunk[position - start], position)
+    #single bases and short slices are read differently from chunks
+    for trial in range(args.lookups):
+        start = random.randint(0, len(expected))
+        stop = min(len(expected), start + random.randint(0, 100))
+        if expected[start:stop] != packed[start:stop] or (start < len(expected) and expected[start] != packed[start]):
+            return "different bases in %d-%d" % (start, stop)
+    return None
+
+#Checks the packed genome and ancestor sequences against the sequences read from the FASTA files
+def checkSequences(aloft, args, chromosomes):
+    sequencesDirectory = aloft.getSequencesDirectory(args)
+    passed = True
+    for chromosome in chromosomes:
+        for name, path, pattern, readSequence in [("genome", args.genome, "chr%s.fa", aloft.getGenomeSequences), ("ancestor", args.ancestor, "*_%s.fa", aloft.getAncestorData)]:
+            if len(glob.glob(os.path.join(path, pattern % (chromosome)))) == 0:
+                continue
+            expected = readSequence(path, chromosome)
+            packed = readSequence(path, chromosome, sequencesDirectory)
+            if not isinstance(packed, aloft.sequence_store.PackedSequence):
+                print("FAILED: %s sequence of chromosome %s could not be packed" % (name, chromosome))
+                passed = False
+                continue
+            difference = getSequenceDifference(args, expected, packed)
+            packed.close()
+            if difference is not None:
+                print("FAILED: packed %s sequence of chromosome %s has %s" % (name, chromosome, difference))
+                passed = False
+            elif args.verbose:
+                print("Packed %s sequence of chromosome %s is the same" % (name, chromosome))
+    return passed
+
+#Returns keys that are not in a table, for checking lookups that have to fail
+def getMissingKeys(table):
+    return ["aloft_check_missing", max([key for key in table if isinstance(key, int)] + [0]) + 1]
+
+#Returns a description of the first lookup that gives a different result in a bundled table than in the table it was written from,
+#or None if there is none. Lookups are done at every level of nesting, including lookups of keys that are missing
+def getBundleTableDifference(args, table, bundleTable, depth, keyPath=()):
+    keys = list(table)
+    for key in random.sample(keys, min(len(keys), args.lookups)) + getMissingKeys(table):
+        if (key in table) != (key in bundleTable) or (key not in table and bundleTable.get(key) is not None):
+            return "a different result for a lookup of %r" % (keyPath + (key,),)
+        if key not in table:
+            continue
+        if depth > 1:
+            difference = getBundleTableDifference(args, table[key], bundleTable[key], depth - 1, keyPath + (key,))
+            if difference is not None:
+                return difference
+        elif bundleTable[key] != table[key]:
+            return "%r instead of %r for %r" % (bundleTable[key], table[key], keyPath + (key,))
+    return None
+
+#Checks the reference bundle that worker processes look the large tables up in against the tables read from the data files
+def checkBundle(aloft, args, chromosomes):
+    tables = {'codingExonIntervals' : aloft.getCodingExonIntervals(args.annotation_interval), 'thousandGChromosomeInfo' : aloft.get1000GChromosomeInfo(args.thousandG)}
+    bundledTables = [(name, depth) for name, depth in aloft.BUNDLED_REFERENCE_TABLES if name in tables]
+    referenceData = aloft.reference_bundle.bundleReferenceData(tables, bundledTables, args.cache)
+    passed = True
+    for name, depth in bundledTables:
+        difference = getBundleTableDifference(args, tables[name], referenceData[name], depth)
+        if difference is not None:
+            print("FAILED: bundled %s has %s" % (name, difference))
+            passed = False
+        elif args.verbose:
+            print("Bundled %s is the same" % (name))
+    referenceData['referenceBundle'].close()
+    return passed
+
+#Returns a description of the first lookup that gives a different result in one chromosome of a frequency store than in the
+#records read from the frequency file, or None if there is none
+#Every position looked up is also looked up with alleles that no record has, which has to fail
+def getFrequencyDifference(aloft, args, expected, chromosomeFrequencies):
+    keys = list(expected)
+    for key in random.sample(keys, min(len(keys), args.lookups)):
+        if key not in chromosomeFrequencies:
+            return "no record for %r" % (key,)
+        if chromosomeFrequencies[key] != expected[key]:
+            return "%r instead of %r for %r" % (chromosomeFrequencies[key], expected[key], key)
+        missingKey = aloft.getVariantKey(aloft.getVariantKeyPosition(key), "N", "N")
+        if missingKey not in expected and missingKey in chromosomeFrequencies:
+            return "a record for %r" % (missingKey,)
+    return None
+
+#Checks the 1000G store against the records read from the 1000G file
+def checkThousandG(aloft, args, chromosomes):
+    expected = aloft.get1000GChromosomeInfo(args.thousandG)
+    store = aloft.frequency_store.getFrequencyStore(args.thousandG, aloft.getFrequenciesDirectory(args), aloft.read1000GRecords)
+    if store is None:
+        print("FAILED: 1000G store of %s could not be written" % (args.thousandG))
+        return False
+    passed = True
+    for chromosome in chromosomes:
+        if (chromosome in expected) != (chromosome in store):
+            print("FAILED: 1000G store %s chromosome %s" % ("is missing" if chromosome in expected else "has an extra", chromosome))
+            passed = False
+            continue
+        if chromosome not in expected:
+            continue
+        difference = getFrequencyDifference(aloft, args, expected[chromosome], store[chromosome])
+        if difference is not None:
+            print("FAILED: 1000G store has %s on chromosome %s" % (difference, chromosome))
+            passed = False
+        elif args.verbose:
+            print("1000G store of chromosome %s is the same" % (chromosome))
+    store.close()
+    return passed
+
+#Checks the ESP6500 store of each chromosome against the allele frequencies read from its ESP6500 file
+def checkExomes(aloft, args, chromosomes):
+    passed = True
+    for chromosome in chromosomes:
+        if len(glob.glob(os.path.join(args.exomes, '*.chr%s.*.vcf' % chromosome))) == 0:
+            continue
+        expected = aloft.getESPExomeChromosomeInfo(args.exomes, chromosome)
+        chromosomeFrequencies = aloft.getESPExomeFrequencies(args, chromosome)
+        if len(expected) > 0 and not isinstance(chromosomeFrequencies, aloft.frequency_store.ChromosomeFrequencies):
+            print("FAILED: ESP6500 store of chromosome %s could not be written" % (chromosome))
+            passed = False
+            continue
+        difference = getFrequencyDifference(aloft, args, expected, chromosomeFrequencies)
+        if isinstance(chromosomeFrequencies, aloft.frequency_store.ChromosomeFrequencies):
+            chromosomeFrequencies.store.close()
+        if difference is not None:
+            print("FAILED: ESP6500 store has %s on chromosome %s" % (difference, chromosome))
+            passed = False
+        elif args.verbose:
+            print("ESP6500 store of chromosome %s is the same" % (chromosome))
+    return passed
+
+#Checks the disorder predictions looked up in the DISOPRED archive against the predictions getDisopredData reads from the .diso files
+#Each transcript is checked without a premature stop and with stops before, inside and after its residues
+def checkDisopred(aloft, args, chromosomes):
+    archive = aloft.disorder_store.getDisopredArchive(args.disopred_sequences, aloft.getDisopredDirectory(args))
+    if archive is None:
+        print("FAILED: DISOPRED archive of %s could not be written" % (args.disopred_sequences))
+        return False
+    disorderPredictions = aloft.disorder_store.DisorderPredictions(args.disopred_sequences, archive)
+    transcriptIDs = [fileName[:-len(".diso")] for fileName in os.listdir(args.disopred_sequences) if fileName.endswith(".diso")]
+    passed = True
+    for transcriptID in random.sample(transcriptIDs, min(len(transcriptIDs), args.lookups)) + ["aloft_check_missing"]:
+        for stopPosition in [None, 0, 1, random.randint(1, 2000), 1000000]:
+            expected = aloft.getDisopredData(args.disopred_sequences, transcriptID, stopPosition)
+            prediction = disorderPredictions.getPrediction(transcriptID, stopPosition)
+            if prediction != expected:
+                print("FAILED: DISOPRED archive has %r instead of %r for transcript %s with a stop at %s" % (prediction, expected, transcriptID, stopPosition))
+                passed = False
+                break
+    disorderPredictions.close()
+    return passed
+
+#Returns a description of the first difference between the cached GERP elements and the merged elements, or None
+#Element lookups and rejection percentages are checked for random intervals and exons around the elements
+def getElementDifference(aloft, args, expected, gerpElements):
+    if len(gerpElements) != len(expected):
+        return "%d elements instead of %d" % (len(gerpElements), len(expected))
+    for index in range(len(expected)):
+        if gerpElements[index] != expected[index]:
+            return "element %r instead of %r" % (gerpElements[index], expected[index])
+    if len(expected) == 0:
+        return None
+
+    low, high = min(element[0] for element in expected) - 1000, max(element[1] for element in expected) + 1000
+    for _ in range(args.lookups):
+        start = random.randint(low, high)
+        end = start + random.randint(0, 2000)
+        elementIndex = aloft.findGERPelementIndex(expected, start, end)
+        if gerpElements.findElementIndex(start, end) != elementIndex:
+            return "element index %d instead of %d for %d-%d" % (gerpElements.findElementIndex(start, end), elementIndex, start, end)
+        if elementIndex == -1:
+            continue
+
+        exons = []
+        exonStart = start - random.randint(0, 5000)
+        for _ in range(random.randint(1, 4)):
+            exonEnd = exonStart + random.randint(0, 3000)
+            exons.append((exonStart, exonEnd))
+            exonStart = exonEnd + random.randint(1, 3000)
+        for direction in ['+', '-']:
+            truncatedExons = aloft.getTruncatedExons(exons, start, direction, True)
+            if not truncatedExons:
+                continue
+            percentage = gerpElements.getRejectionElementIntersectionPercentage(exons, truncatedExons, elementIndex, direction, True)
+            expectedPercentage = aloft.getRejectionElementIntersectionPercentage(exons, truncatedExons, expected, elementIndex, direction)
+            if percentage != expectedPercentage:
+                return "rejection percentage %r instead of %r for exons %r on the %s strand" % (percentage, expectedPercentage, exons, direction)
+    return None
+
+#Checks the cached GERP elements of each chromosome against the elements merged from its element file
+def checkElements(aloft, args, chromosomes):
+    passed = True
+    for chromosome in chromosomes:
+        elementPaths = glob.glob(os.path.join(args.elements, "*chr%s_*.txt" % (chromosome)))
+        if len(elementPaths) == 0:
+            continue
+        with open(elementPaths[0]) as elementFile:
+            expected = aloft.mergeElements(aloft.getGERPelements(elementFile))
+        gerpElements = aloft.element_store.getCachedGERPElements(elementPaths[0], aloft.getElementsDirectory(args))
+        difference = getElementDifference(aloft, args, expected, gerpElements)
+        if difference is not None:
+            print("FAILED: cached GERP elements have %s on chromosome %s" % (difference, chromosome))
+            passed = False
+        elif args.verbose:
+            print("Cached GERP elements of chromosome %s are the same" % (chromosome))
+    return passed
+
+#Stores that the stores check can check, in the order they are checked
+STORE_CHECKS = [('sequences', checkSequences), ('bundle', checkBundle), ('thousandG', checkThousandG), ('exomes', checkExomes), ('disopred', checkDisopred), ('elements', checkElements)]
+
+#Checks the stores converted from the data files against the original readers
+#Unless a cache directory is given, the stores are converted into a new temporary one, so they are checked as converted by this version
+def checkStores(args):
+    sys.path.insert(0, getScriptDirectory())
+    import aloft
+    dataFiles = aloft.getDataFiles(args.parser, args.data)
+    for dataFile, dataPath in dataFiles.items():
+        setattr(args, dataFile, dataPath)
+    random.seed(args.seed)
+
+    if args.chromosomes_to_check:
+        chromosomes = args.chromosomes_to_check.split(",")
+    else:
+        chromosomes = [line.strip() for line in open(args.chromosomes) if line.strip()]
+
+    workDirectory = None
+    if args.cache is None:
+        workDirectory = tempfile.mkdtemp(prefix="aloft_check.")
+        args.cache = workDirectory
+    elif not os.path.exists(args.cache):
+        os.makedirs(args.cache)
+    try:
+        passed = True
+        for name, checkStore in STORE_CHECKS:
+            if args.stores and name not in args.stores.split(","):
+                continue
+            if checkStore(aloft, args, chromosomes):
+                print("ok: %s" % (name))
+            else:
+                passed = False
+        return passed
+    finally:
+        if workDirectory is not None:
+            shutil.rmtree(workDirectory)
+
+def parseCommandLineArguments(commandLineArguments):
+    parser = argparse.ArgumentParser(description='Check that ALoFT gives the same output however it is run.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    subparsers = parser.add_subparsers(dest='check')
+
+    workersParser = subparsers.add_parser('workers', help='Compare the output of a serial run with the output of runs with several worker processes')
+    workersParser.add_argument('--vat', help='Path to a small VAT file to annotate', required=True)
+    workersParser.add_argument('--workers', help='Comma separated worker counts to compare with a serial run', default='4')
+
+    workersParser.add_argument('--cache', help='Cache directory passed to aloft.py', default='cache/')
+
+    storesParser = subparsers.add_parser('stores', help='Compare lookups in the stores of the cache directory with the readers of the original data files')
+    storesParser.add_argument('--cache', help='Cache directory holding the stores to check. By default, the stores are converted into a temporary directory')
+    storesParser.add_argument('--stores', help='Comma separated stores to check, out of %s. By default, all of them are checked' % (",".join(name for name, checkStore in STORE_CHECKS)))
+    storesParser.add_argument('--chromosomes', dest='chromosomes_to_check', help='Comma separated chromosomes to check. By default, the chromosomes listed in the data files are checked')
+    storesParser.add_argument('--lookups', help='Number of random lookups in each table or sequence', type=int, default=1000)
+    storesParser.add_argument('--seed', help='Seed for the random lookups', type=int, default=0)
+
+    for subparser in [workersParser, storesParser]:
+        subparser.add_argument('--data', help="Path to data directory containing data.txt which contains paths to all aloft data files", default='data')
+        subparser.add_argument('--verbose', '-v', help='Verbose mode', action='store_true')
+
+    args = parser.parse_args(commandLineArguments)
+    args.parser = parser
+    if args.check is None:
+        parser.print_help()
+        sys.exit(1)
+    if args.check == 'workers':
+        args.workers = [int(workers) for workers in args.workers.split(",")]
+    return args
+
+if __name__ == "__main__":
+    args = parseCommandLineArguments(sys.argv[1:])
+    passed = {'workers' : checkWorkers, 'stores' : checkStores}[args.check](args)
+    sys.exit(0 if passed else 1)
@@ -1,34 +1,99 @@
 import os
 import re
+import gzip
 import struct
 import subprocess
 import sys
 from subprocess import Popen, PIPE
 import platform
 import glob
+import multiprocessing
 from collections import OrderedDict
 
+#str.maketrans was string.maketrans in python 2
+try:
+	maketrans = str.maketrans
+except AttributeError:
+	from string import maketrans
+
 def getScriptDirectory():
 	return os.path.dirname(os.path.realpath(__file__))
 
 def platformName():
 	return platform.system() + "_" + platform.machine()
 
+#Returns a pool of worker processes that are forked from the current process, so they share its loaded data
+def getForkedPool(processes):
+	try:
+		context = multiprocessing.get_context('fork')
+	except (AttributeError, ValueError):
+		#python 2.x forks on all platforms it supports
+		context = multiprocessing
+	return context.Pool(processes)
+
+#Opens a text file for reading, which is decompressed if its name ends with .gz
+def openTextFile(path):
+	if path.endswith(".gz"):
+		#gzip.open reads bytes by default, which are not strings in python 3
+		return gzip.open(path, 'rt') if sys.version_info[0] >= 3 else gzip.open(path)
+	return open(path)
+
 def printError(error, exit=True):
 	sys.stderr.write("Error: %s\n" % error)
 	if exit:
 		sys.stderr.write("Exiting..\n")
 		sys.exit(1)
 
+#Alleles of up to this many bases in total, all of them A, C, G or T, are packed into integer variant keys
+PACKED_ALLELES_MAX_LENGTH = 12
+packableAllelesPattern = re.compile('[ACGT]*$')
+packedBasesTable = maketrans('ACGT', '0123')
+
+#Returns the key identifying a variant. Unless its alleles are too long or contain other characters than ACGT, the key is an integer
+#holding the position in its upper 32 bits, then the lengths of the ref and alt alleles in 4 bits each, and then their bases in 2 bits each
+#Other variants, such as long indels, are keyed by (position, ref, alt), which never equals an integer key
+def getVariantKey(position, ref, alt):
+	alleles = ref + alt
+	if len(alleles) > PACKED_ALLELES_MAX_LENGTH or position < 0 or position >= (1 << 31) or not packableAllelesPattern.match(alleles):
+		return (position, ref, alt)
+	return (position << 32) | (len(ref) << 28) | (len(alt) << 24) | (int(alleles.translate(packedBasesTable), 4) if alleles else 0)
+
+#Returns the position of a variant key
+def getVariantKeyPosition(variantKey):
+	return variantKey[0] if isinstance(variantKey, tuple) else variantKey >> 32
+
 def getRefAltPositionKey(lineComponents, altIndex):
 	position = int(lineComponents[1]) #convert to int since it'll raise an error if it's not really an integer, just for safety
 	ref = lineComponents[3]
 	alts = lineComponents[4].split(",")
 	#alt = alts[altIndex] if altIndex < len(alts) else alts[0]
 	alt = alts[altIndex]
-	return "_".join([str(position), ref, alt])
+	return getVariantKey(position, ref, alt)
+
+#Returns true if intervals are in ascending order and do not overlap, and each one starts no later than it ends
+def areSortedIntervals(intervals):
+	return all(interval[0] <= interval[1] for interval in intervals) and all(intervals[index][1] < intervals[index+1][0] for index in range(len(intervals)-1))
+
+#If sortedExons is set, the exons are known to satisfy areSortedIntervals and are bisected for the exon holding start
+def getTruncatedExons(exons, start, direction, sortedExons=False):
+	if sortedExons:
+		#find the first exon that ends at or after start
+		low = 0
+		high = len(exons)
+		while low < high:
+			mid = (low+high)//2
+			if exons[mid][1] < start:
+				low = mid+1
+			else:
+				high = mid
+		if low == len(exons) or exons[low][0] > start:
+			return None
+		if direction == '+':
+			return exons[low:]
+		elif direction == '-':
+			return exons[0:low+1]
+		return None
 
-def getTruncatedExons(exons, start, direction):
 	truncatedExons = None
 	stopExonIndex = 0
 	for block in exons:
@@ -43,45 +108,27 @@ def getTruncatedExons(exons, start, direction):
 
 	return truncatedExons
 
+#Merges runs of adjacent elements that intersect in a single sweep
+#An element that is the same as the previous one, or ends within it, is dropped; one that extends it is merged into
+#(start, end), arbitrarily losing the score
 def mergeElements(elements):
-	mergedElements = list(elements)
-	while True:
-		mergedElements, didMerge = _mergeElements(mergedElements)
-		if not didMerge:
-			break
-	return mergedElements
-
-def _mergeElements(elements):
-	didMerge = False
 	mergedElements = []
-	for elementIndex, element in enumerate(elements):
-		if elementIndex+1 < len(elements):
-			nextElement = elements[elementIndex+1]
-			#skip next element since it's same as current one
-			if nextElement[0] == element[0] and nextElement[1] == element[1]:
-				mergedElements.append(element)
-				didMerge = True
-				if elementIndex+2 < len(elements):
-					mergedElements += elements[elementIndex+2:]
-				break
-			#merge next element with current one since they intersect
-			elif nextElement[0] <= element[1]:
-				didMerge = True
-				if nextElement[1] < element[1]:
-					mergedElements.append(element)
-				else:
-					#arbitrarily choose one of the elements to merge the last field from
-					mergedElements.append((element[0], nextElement[1]))
-				if elementIndex+2 < len(elements):
-					mergedElements += elements[elementIndex+2:]
-				break
-			#no intersection
-			else:
-				mergedElements.append(element)
-		#last element
-		else:
-			mergedElements.append(element)
-	return mergedElements, didMerge
+	for element in elements:
+		if len(mergedElements) > 0:
+			lastElement = mergedElements[-1]
+			#skip element since it's same as the last one
+			if element[0] == lastElement[0] and element[1] == lastElement[1]:
+				continue
+			#merge element with the last one since they intersect
+			elif element[0] <= lastElement[1]:
+				if element[1] >= lastElement[1]:
+					mergedElements[-1] = (lastElement[0], element[1])
+					#an element with its start after its end can only now become the same as the one before it
+					if len(mergedElements) > 1 and mergedElements[-2][0] == lastElement[0] and mergedElements[-2][1] == element[1]:
+						mergedElements.pop()
+				continue
+		mergedElements.append(element)
+	return mergedElements
 
 #not used by aloft anymore but may be useful to keep around
 def getRejectionElementIntersectionData(exons, truncatedExons, GERPelements, GERPelementIndex, direction):
@@ -162,45 +209,50 @@ def getRejectionElementIntersectionPercentage(exons, truncatedExons, GERPelement
 
 	return float(distanceCovered) / truncatedExonsLength * 100.0
 
+#Returns (residue number, whether the residue is predicted disordered) for every residue of an open DISOPRED file, in file order
+def readDisopredResidues(disoFile):
+	#this file is in a terrible format, skip first 5 lines
+	for _ in range(5):
+		disoFile.readline()
+
+	residues = []
+	for disoLine in disoFile:
+		if disoLine.strip():
+			disoLineComponents = [component for component in re.split(r'[\t ]', disoLine.strip()) if component]
+			residueNumber = int(disoLineComponents[0])
+			residues.append((residueNumber, disoLineComponents[2] == '*'))
+	return residues
+
+#Returns the disorder prediction of a transcript from its counts of disordered and all residues, overall and at or after the premature stop
+def formatDisopredData(transcriptID, stopPosition, disorderedResidues, residueCount, disorderedResiduesAfterPrematureStop, residueCountAfterPrematureStop):
+	if stopPosition is not None:
+		if residueCountAfterPrematureStop == 0:
+			disorderedResiduesAfterPrematureStopPercentage = '.'
+			printError("Residue count after stop position %d is zero for %s" % (stopPosition, transcriptID), False)
+		else:
+			disorderedResiduesAfterPrematureStopPercentage = "%.2f" % (100.0 * disorderedResiduesAfterPrematureStop / residueCountAfterPrematureStop)
+
+		return "/".join(["%.2f" % (100.0 * disorderedResidues / residueCount), disorderedResiduesAfterPrematureStopPercentage])
+	else:
+		return "/".join([str(disorderedResidues), str(residueCount), "%.2f" % (100.0 * disorderedResidues / residueCount)])
+
 def getDisopredData(disopredSequencesPath, transcriptID, stopPosition):
 	newData = "."
 	try:
 		disoFilePath = os.path.join(disopredSequencesPath, "%s.diso" % (transcriptID))
 		disoFile = open(disoFilePath)
+		residues = readDisopredResidues(disoFile)
 
-		#this file is in a terrible format, skip first 5 lines
-		for _ in range(5):
-			disoFile.readline()
-
-		disorderedResidues = 0
-		residueCount = 0
+		disorderedResidues = sum(1 for residueNumber, disordered in residues if disordered)
+		residueCount = len(residues)
 
 		disorderedResiduesAfterPrematureStop = 0
 		residueCountAfterPrematureStop = 0
-
-		for disoLine in disoFile:
-			if disoLine.strip():
-				disoLineComponents = [component for component in re.split(r'[\t ]', disoLine.strip()) if component]
-				residueNumber = int(disoLineComponents[0])
-				if disoLineComponents[2] == '*':
-					disorderedResidues += 1
-					if stopPosition is not None and residueNumber >= stopPosition:
-						disorderedResiduesAfterPrematureStop += 1
-
-				residueCount += 1
-				if stopPosition is not None and residueNumber >= stopPosition:
-					residueCountAfterPrematureStop += 1
-
 		if stopPosition is not None:
-			if residueCountAfterPrematureStop == 0:
-				disorderedResiduesAfterPrematureStopPercentage = '.'
-				printError("Residue count after stop position %d is zero for %s" % (stopPosition, transcriptID), False)
-			else:
-				disorderedResiduesAfterPrematureStopPercentage = "%.2f" % (100.0 * disorderedResiduesAfterPrematureStop / residueCountAfterPrematureStop)
+			disorderedResiduesAfterPrematureStop = sum(1 for residueNumber, disordered in residues if disordered and residueNumber >= stopPosition)
+			residueCountAfterPrematureStop = sum(1 for residueNumber, disordered in residues if residueNumber >= stopPosition)
 
-			newData = "/".join(["%.2f" % (100.0 * disorderedResidues / residueCount), disorderedResiduesAfterPrematureStopPercentage])
-		else:
-			newData = "/".join([str(disorderedResidues), str(residueCount), "%.2f" % (100.0 * disorderedResidues / residueCount)])
+		newData = formatDisopredData(transcriptID, stopPosition, disorderedResidues, residueCount, disorderedResiduesAfterPrematureStop, residueCountAfterPrematureStop)
 	except IOError:
 		#print("Skipping transcript %s" % (transcriptID))
 		pass
@@ -272,7 +324,11 @@ def getChromosomesPfamTable(chrs, pfamDirectory, strformat, domainTypeList, doma
 	return chromosomesPFam
 
 def getGERPelements(elementFile):
-	return [(int(eline.split('\t')[0]),int(eline.split('\t')[1]), float(eline.split('\t')[3])) for eline in elementFile]
+	elements = []
+	for eline in elementFile:
+		fields = eline.split('\t')
+		elements.append((int(fields[0]), int(fields[1]), float(fields[3])))
+	return elements
 
 def getCodingExonIntervals(annotationIntervalPath):
 	codingExonIntervals = {}
@@ -0,0 +1,231 @@
+#Packed archive of the DISOPRED predictions of every transcript
+#The directory of per-transcript .diso files is converted once into one file holding, for each transcript, the prefix sums
+#of its disordered residues in residue order, so the disorder at or after any stop position is a difference of two prefix
+#sums instead of a parse of the transcript's file. Recently used transcripts are kept decoded in memory
+#The archive records the number, latest modification time and total size of the .diso files it was converted from, and is
+#converted again when any of them changes
+
+import os, mmap, pickle, struct, tempfile
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+from common import readDisopredResidues, formatDisopredData
+from transcript_store import getCachePath
+
+DISOPRED_ARCHIVE_MAGIC = b'ALOFTDA2'
+
+#modification time of the .diso directory, number, latest modification time and total size of the .diso files, offset of the index
+DISOPRED_ARCHIVE_HEADER = struct.Struct('<QQQQQ')
+
+#Number of decoded transcripts kept in memory
+DISOPRED_CACHED_TRANSCRIPTS = 1024
+
+PREFIX_SUM_SIZE = array('I').itemsize
+RESIDUE_NUMBER_SIZE = array('i').itemsize
+
+#Returns (residue numbers, or None if they are 1 to n in order, prefix sums of disordered residues) for a transcript's
+#residues; the prefix sum k is the number of disordered residues among the k residues with the lowest numbers
+def getResiduePrefixSums(residues):
+    residues = sorted(residues, key=lambda residue: residue[0])
+    prefixSums = array('I', [0])
+    for residueNumber, disordered in residues:
+        prefixSums.append(prefixSums[-1] + (1 if disordered else 0))
+    residueNumbers = [residueNumber for residueNumber, disordered in residues]
+    if residueNumbers == list(range(1, len(residueNumbers) + 1)):
+        return None, prefixSums
+    try:
+        residueNumbers = array('i', residueNumbers)
+    except OverflowError:
+        #kept as a list, which the archive does not store
+        pass
+    return residueNumbers, prefixSums
+
+#Returns the disorder prediction of a transcript from its prefix sums, formatted like getDisopredData
+def getDisorderPrediction(transcriptID, stopPosition, residueNumbers, prefixSums):
+    residueCount = len(prefixSums) - 1
+    disorderedResidues = prefixSums[residueCount]
+    if stopPosition is None:
+        return formatDisopredData(transcriptID, stopPosition, disorderedResidues, residueCount, 0, 0)
+
+    #the number of residues before the stop position
+    if residueNumbers is None:
+        residuesBeforeStop = min(max(stopPosition - 1, 0), residueCount)
+    else:
+        residuesBeforeStop = bisect_left(residueNumbers, stopPosition)
+    return formatDisopredData(transcriptID, stopPosition, disorderedResidues, residueCount, disorderedResidues - prefixSums[residuesBeforeStop], residueCount - residuesBeforeStop)
+
+def getArrayBytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+def getArrayFromBytes(typecode, data):
+    values = array(typecode)
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+    return values
+
+#Returns the .diso file names of disopredSequencesPath, sorted, and the fingerprint of the directory and those files:
+#(directory modification time, number of files, latest modification time, total size)
+#Editing or replacing a file in place does not change the directory's modification time, but changes the latest
+#modification time of its files
+def getDisopredFiles(disopredSequencesPath):
+    fileNames = sorted(fileName for fileName in os.listdir(disopredSequencesPath) if fileName.endswith(".diso"))
+    latestModificationTime = 0
+    totalSize = 0
+    for fileName in fileNames:
+        try:
+            fileStatus = os.stat(os.path.join(disopredSequencesPath, fileName))
+        except OSError:
+            continue
+        latestModificationTime = max(latestModificationTime, int(fileStatus.st_mtime))
+        totalSize += fileStatus.st_size
+    fingerprint = (int(os.stat(disopredSequencesPath).st_mtime), len(fileNames), latestModificationTime, totalSize)
+    return fileNames, fingerprint
+
+#Converts the .diso files of disopredSequencesPath into the archive
+#The index maps each transcript to (offset, number of residues, whether its residue numbers are stored), or to None if its
+#file could not be parsed, in which case the file is read again when the transcript is looked up so that it fails the same way
+def writeDisopredArchiveFile(archiveFile, disopredSequencesPath, fileNames, fingerprint):
+    archiveFile.write(DISOPRED_ARCHIVE_MAGIC)
+    archiveFile.write(DISOPRED_ARCHIVE_HEADER.pack(0, 0, 0, 0, 0))
+
+    index = {}
+    for fileName in fileNames:
+        transcriptID = fileName[:-len(".diso")]
+        try:
+            with open(os.path.join(disopredSequencesPath, fileName)) as disoFile:
+                residues = readDisopredResidues(disoFile)
+            residueNumbers, prefixSums = getResiduePrefixSums(residues)
+        except IOError:
+            #unreadable files are skipped, as getDisopredData does
+            continue
+        except (ValueError, IndexError):
+            index[transcriptID] = None
+            continue
+        if isinstance(residueNumbers, list):
+            index[transcriptID] = None
+            continue
+
+        index[transcriptID] = (archiveFile.tell(), len(prefixSums) - 1, residueNumbers is not None)
+        archiveFile.write(getArrayBytes(prefixSums))
+        if residueNumbers is not None:
+            archiveFile.write(getArrayBytes(residueNumbers))
+
+    indexOffset = archiveFile.tell()
+    pickle.dump(index, archiveFile, protocol=2)
+    archiveFile.seek(len(DISOPRED_ARCHIVE_MAGIC))
+    archiveFile.write(DISOPRED_ARCHIVE_HEADER.pack(*(fingerprint + (indexOffset,))))
+
+def writeDisopredArchive(disopredSequencesPath, archivePath, fileNames, fingerprint):
+    archiveDirectory = os.path.dirname(archivePath)
+    temporaryDescriptor, temporaryPath = tempfile.mkstemp(dir=archiveDirectory, prefix=".%s." % os.path.basename(archivePath))
+    try:
+        with os.fdopen(temporaryDescriptor, 'w+b') as archiveFile:
+            writeDisopredArchiveFile(archiveFile, disopredSequencesPath, fileNames, fingerprint)
+        #renaming is atomic, so concurrent processes never see a partially written file
+        os.rename(temporaryPath, archivePath)
+    except:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+
+class DisopredArchive(object):
+    def __init__(self, archivePath):
+        with open(archivePath, 'rb') as archiveFile:
+            self.data = mmap.mmap(archiveFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self.data[:len(DISOPRED_ARCHIVE_MAGIC)] != DISOPRED_ARCHIVE_MAGIC:
+                raise ValueError("%s is not a DISOPRED archive" % (archivePath))
+            header = DISOPRED_ARCHIVE_HEADER.unpack_from(self.data, len(DISOPRED_ARCHIVE_MAGIC))
+            self.fingerprint, indexOffset = header[:-1], header[-1]
+            self.index = pickle.loads(self.data[indexOffset:])
+        except Exception as exception:
+            self.data.close()
+            raise ValueError("%s is not a readable DISOPRED archive: %s" % (archivePath, exception))
+
+    def __contains__(self, transcriptID):
+        return transcriptID in self.index
+
+    #Returns (residue numbers or None, prefix sums) of a transcript in the archive, or None if its file could not be parsed
+    def getPrefixSums(self, transcriptID):
+        entry = self.index[transcriptID]
+        if entry is None:
+            return None
+        offset, residueCount, hasResidueNumbers = entry
+        prefixSumsEnd = offset + PREFIX_SUM_SIZE * (residueCount + 1)
+        prefixSums = getArrayFromBytes('I', self.data[offset:prefixSumsEnd])
+        residueNumbers = getArrayFromBytes('i', self.data[prefixSumsEnd:prefixSumsEnd + RESIDUE_NUMBER_SIZE * residueCount]) if hasResidueNumbers else None
+        return residueNumbers, prefixSums
+
+    def close(self):
+        self.data.close()
+
+#Disorder predictions of transcripts, looked up in an archive if there is one and read from the .diso files otherwise
+class DisorderPredictions(object):
+    def __init__(self, disopredSequencesPath, archive=None):
+        self.disopredSequencesPath = disopredSequencesPath
+        self.archive = archive
+        self.transcriptCache = OrderedDict()
+
+    #Returns (residue numbers or None, prefix sums) of a transcript, or None if it has no prediction
+    def getTranscript(self, transcriptID):
+        if transcriptID in self.transcriptCache:
+            transcript = self.transcriptCache.pop(transcriptID)
+        else:
+            transcript = None
+            if self.archive is not None and transcriptID not in self.archive:
+                return None
+            if self.archive is not None:
+                transcript = self.archive.getPrefixSums(transcriptID)
+            if transcript is None:
+                try:
+                    with open(os.path.join(self.disopredSequencesPath, "%s.diso" % (transcriptID))) as disoFile:
+                        residues = readDisopredResidues(disoFile)
+                except IOError:
+                    return None
+                transcript = getResiduePrefixSums(residues)
+            if len(self.transcriptCache) >= DISOPRED_CACHED_TRANSCRIPTS:
+                self.transcriptCache.popitem(last=False)
+        self.transcriptCache[transcriptID] = transcript
+        return transcript
+
+    #Returns the same disorder prediction as getDisopredData
+    def getPrediction(self, transcriptID, stopPosition):
+        transcript = self.getTranscript(transcriptID)
+        if transcript is None:
+            return "."
+        residueNumbers, prefixSums = transcript
+        return getDisorderPrediction(transcriptID, stopPosition, residueNumbers, prefixSums)
+
+    def close(self):
+        if self.archive is not None:
+            self.archive.close()
+
+#Returns the archive of the .diso files of disopredSequencesPath kept in archiveDirectory, converting the files first if that
+#was not done yet or if files were added, removed or changed since. Returns None if the archive can not be written
+def getDisopredArchive(disopredSequencesPath, archiveDirectory):
+    archivePath = getCachePath(archiveDirectory, os.path.normpath(disopredSequencesPath), ".archive")
+    fileNames, fingerprint = getDisopredFiles(disopredSequencesPath)
+    archive = None
+    try:
+        if os.path.exists(archivePath):
+            try:
+                archive = DisopredArchive(archivePath)
+            except ValueError:
+                #written by another version; it is converted again below
+                pass
+            if archive is not None:
+                if archive.fingerprint == fingerprint:
+                    return archive
+                #unmap the stale archive before its file is replaced
+                archive.close()
+                archive = None
+        if not os.path.exists(archiveDirectory):
+            os.makedirs(archiveDirectory)
+        writeDisopredArchive(disopredSequencesPath, archivePath, fileNames, fingerprint)
+        return DisopredArchive(archivePath)
+    except (IOError, OSError, ValueError):
+        if archive is not None:
+            archive.close()
+        return None
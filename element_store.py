@@ -0,0 +1,112 @@
+#GERP elements of a chromosome as parallel typed arrays, cached on disk
+#The merged elements are kept as arrays of starts, ends and scores instead of a list of tuples, and are written once per
+#element file into the cache directory, next to a fingerprint of the file they were read from
+#An element is looked up by bisecting the array of ends, and the running total of the bases the elements cover gives the
+#covered length of any interval with two bisects
+
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from sequence_store import getPositionArray
+from transcript_store import loadPackedModel, writePackedModel, getSourceFingerprint, getCachePath
+from common import getGERPelements, mergeElements, findGERPelementIndex, getRejectionElementIntersectionPercentage
+
+#Bump when the layout below changes so that older cached elements are read again
+ELEMENT_STORE_VERSION = 2
+
+class GERPElements(object):
+    #elements is a list of merged (start, end, score) or (start, end) tuples, as returned by mergeElements
+    def __init__(self, elements):
+        try:
+            self.starts = getPositionArray(element[0] for element in elements)
+            self.ends = getPositionArray(element[1] for element in elements)
+        except OverflowError:
+            self.starts = [element[0] for element in elements]
+            self.ends = [element[1] for element in elements]
+        self.scores = array('d', [element[2] if len(element) > 2 else 0.0 for element in elements])
+        self.hasScores = array('b', [len(element) > 2 for element in elements])
+        #bisecting needs elements that are sorted and do not overlap, which mergeElements leaves unless an element starts after its end
+        self.isSorted = all(start <= end for start, end in zip(self.starts, self.ends)) and all(nextStart > end for nextStart, end in zip(self.starts[1:], self.ends))
+
+        #coveredBases[k] is the number of bases covered by the first k elements
+        coveredBases = [0]
+        for start, end in zip(self.starts, self.ends):
+            coveredBases.append(coveredBases[-1] + end - start + 1)
+        try:
+            self.coveredBases = getPositionArray(coveredBases)
+        except OverflowError:
+            self.coveredBases = coveredBases
+
+    def __len__(self):
+        return len(self.starts)
+
+    #Returns an element as the tuple it was merged into
+    def __getitem__(self, index):
+        if self.hasScores[index]:
+            return (self.starts[index], self.ends[index], self.scores[index])
+        return (self.starts[index], self.ends[index])
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(sys.getsizeof(values) for values in [self.starts, self.ends, self.scores, self.hasScores, self.coveredBases])
+
+    #Returns the index of the element intersecting the inclusive interval [start, end], or -1 if there is none
+    #If several elements intersect it, findGERPelementIndex decides which one, as it always did
+    def findElementIndex(self, start, end):
+        if not self.isSorted:
+            return findGERPelementIndex(self, start, end)
+        elementIndex = bisect_left(self.ends, start)
+        if elementIndex == len(self.ends) or self.starts[elementIndex] > end:
+            return -1
+        if elementIndex + 1 < len(self.starts) and self.starts[elementIndex + 1] <= end:
+            return findGERPelementIndex(self, start, end)
+        return elementIndex
+
+    #Returns the number of bases of the inclusive interval [start, end] covered by the elements with indexes low to high
+    def getCoveredBases(self, low, high, start, end):
+        first = max(low, bisect_left(self.ends, start))
+        last = min(high, bisect_right(self.starts, end) - 1)
+        if first > last:
+            return 0
+        coveredBases = self.coveredBases[last + 1] - self.coveredBases[first]
+        #the first and last elements may stick out of the interval
+        if self.starts[first] < start:
+            coveredBases -= start - self.starts[first]
+        if self.ends[last] > end:
+            coveredBases -= self.ends[last] - end
+        return coveredBases
+
+    #Returns the same percentage as getRejectionElementIntersectionPercentage, from the running total of covered bases
+    #instead of intersecting every truncated exon with every element. sortedExons tells if the exons satisfy areSortedIntervals
+    def getRejectionElementIntersectionPercentage(self, exons, truncatedExons, elementIndex, direction, sortedExons):
+        if not self.isSorted or not sortedExons:
+            return getRejectionElementIntersectionPercentage(exons, truncatedExons, self, elementIndex, direction)
+
+        #the elements that walking from elementIndex towards the truncated exons reaches
+        if direction == '+':
+            low, high = elementIndex, bisect_right(self.starts, truncatedExons[-1][1]) - 1
+        elif direction == '-':
+            low, high = bisect_left(self.ends, truncatedExons[0][0]), elementIndex
+        else:
+            low, high = 0, -1
+
+        distanceCovered = sum(self.getCoveredBases(low, high, truncatedExon[0], truncatedExon[1]) for truncatedExon in truncatedExons)
+        truncatedExonsLength = sum([block[1] - block[0] + 1 for block in truncatedExons])
+
+        return float(distanceCovered) / truncatedExonsLength * 100.0
+
+def getElementsPath(elementsDirectory, elementPath):
+    return getCachePath(elementsDirectory, elementPath, ".elements")
+
+#Returns the merged elements of a GERP element file, loaded from elementsDirectory if they were read before from the same file
+def getCachedGERPElements(elementPath, elementsDirectory):
+    fingerprint = getSourceFingerprint(elementPath, None, ELEMENT_STORE_VERSION)
+    cachedElementsPath = getElementsPath(elementsDirectory, elementPath)
+
+    gerpElements = loadPackedModel(cachedElementsPath, fingerprint)
+    if gerpElements is not None:
+        return gerpElements
+
+    with open(elementPath) as elementFile:
+        gerpElements = GERPElements(mergeElements(getGERPelements(elementFile)))
+    writePackedModel(cachedElementsPath, fingerprint, gerpElements)
+    return gerpElements
@@ -0,0 +1,202 @@
+#Position indexed on-disk store for population frequency files such as 1000G
+#A frequency file is converted once into blocks of records sorted by position, each compressed on its own, with the first
+#position of every block kept in an index. A lookup bisects the index and decompresses only the block that can hold the
+#position, and recently used blocks are kept decoded in memory
+
+import os, sys, mmap, pickle, struct, tempfile, zlib
+from bisect import bisect_right
+from collections import OrderedDict
+from sequence_store import getPositionArray
+from common import getVariantKeyPosition
+from transcript_store import getCachePath
+
+FREQUENCY_STORE_MAGIC = b'ALOFTFS2'
+
+#source file size, source file modification time, offset of the index
+FREQUENCY_STORE_HEADER = struct.Struct('<QQQ')
+
+#Number of records after which a block is closed, once the position changes
+FREQUENCY_STORE_BLOCK_RECORDS = 256
+
+#Number of decoded blocks kept in memory
+FREQUENCY_STORE_CACHED_BLOCKS = 256
+
+#Raised while converting a file whose chromosomes are not grouped together
+class UngroupedChromosomesError(Exception):
+    pass
+
+#Writes the records of one chromosome, sorted by position, as blocks; a position is never split across two blocks
+#so that a lookup only ever has to look in one block
+def writeChromosomeBlocks(storeFile, records):
+    records.sort(key=lambda record: record[0])
+    firstPositions, blockOffsets, blockLengths = getPositionArray(), [], getPositionArray()
+
+    blockStart = 0
+    for recordIndex in range(len(records) + 1):
+        if recordIndex == len(records) or (recordIndex - blockStart >= FREQUENCY_STORE_BLOCK_RECORDS and records[recordIndex][0] != records[recordIndex - 1][0]):
+            if recordIndex > blockStart:
+                blockRecords = records[blockStart:recordIndex]
+                #like the dictionaries the store replaces, a key may only occur once
+                assert(len(set(key for position, key, value in blockRecords)) == len(blockRecords))
+                block = zlib.compress(pickle.dumps([(key, value) for position, key, value in blockRecords], protocol=2))
+                firstPositions.append(records[blockStart][0])
+                blockOffsets.append(storeFile.tell())
+                blockLengths.append(len(block))
+                storeFile.write(block)
+            blockStart = recordIndex
+
+    return firstPositions, blockOffsets, blockLengths
+
+#Converts a frequency file into a store; readRecords(sourcePath) yields (chromosome, position, key, value) for every record
+#If grouped is set, each chromosome is sorted and written as soon as the next one starts, otherwise the whole file is held in memory
+def writeFrequencyStoreFile(storeFile, sourcePath, sourceStatus, readRecords, grouped):
+    storeFile.seek(0)
+    storeFile.truncate()
+    storeFile.write(FREQUENCY_STORE_MAGIC)
+    storeFile.write(FREQUENCY_STORE_HEADER.pack(0, 0, 0))
+
+    index = {}
+    chromosomeRecords = OrderedDict()
+    currentChromosome = None
+    for chromosome, position, key, value in readRecords(sourcePath):
+        if chromosome != currentChromosome and chromosome not in chromosomeRecords:
+            if chromosome in index:
+                raise UngroupedChromosomesError()
+            if grouped and currentChromosome is not None:
+                index[currentChromosome] = writeChromosomeBlocks(storeFile, chromosomeRecords.pop(currentChromosome))
+            chromosomeRecords[chromosome] = []
+        currentChromosome = chromosome
+        chromosomeRecords[chromosome].append((position, key, value))
+
+    for chromosome, records in chromosomeRecords.items():
+        index[chromosome] = writeChromosomeBlocks(storeFile, records)
+
+    indexOffset = storeFile.tell()
+    pickle.dump(index, storeFile, protocol=2)
+    storeFile.seek(len(FREQUENCY_STORE_MAGIC))
+    storeFile.write(FREQUENCY_STORE_HEADER.pack(sourceStatus.st_size, int(sourceStatus.st_mtime), indexOffset))
+
+def writeFrequencyStore(sourcePath, storePath, readRecords):
+    sourceStatus = os.stat(sourcePath)
+    storeDirectory = os.path.dirname(storePath)
+    temporaryDescriptor, temporaryPath = tempfile.mkstemp(dir=storeDirectory, prefix=".%s." % os.path.basename(storePath))
+    try:
+        with os.fdopen(temporaryDescriptor, 'w+b') as storeFile:
+            try:
+                writeFrequencyStoreFile(storeFile, sourcePath, sourceStatus, readRecords, True)
+            except UngroupedChromosomesError:
+                writeFrequencyStoreFile(storeFile, sourcePath, sourceStatus, readRecords, False)
+        #renaming is atomic, so concurrent processes never see a partially written file
+        os.rename(temporaryPath, storePath)
+    except:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+
+class FrequencyStore(object):
+    def __init__(self, storePath):
+        with open(storePath, 'rb') as storeFile:
+            self.data = mmap.mmap(storeFile.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if self.data[:len(FREQUENCY_STORE_MAGIC)] != FREQUENCY_STORE_MAGIC:
+                raise ValueError("%s is not a frequency store" % (storePath))
+            self.sourceSize, self.sourceModificationTime, indexOffset = FREQUENCY_STORE_HEADER.unpack_from(self.data, len(FREQUENCY_STORE_MAGIC))
+            self.index = pickle.loads(self.data[indexOffset:])
+        except Exception as exception:
+            self.data.close()
+            raise ValueError("%s is not a readable frequency store: %s" % (storePath, exception))
+        self.blockCache = OrderedDict()
+
+    def __contains__(self, chromosome):
+        return chromosome in self.index
+
+    def __getitem__(self, chromosome):
+        return self.getChromosome(chromosome)
+
+    #only the index and the cached blocks live in memory
+    def __sizeof__(self):
+        size = object.__sizeof__(self)
+        for firstPositions, blockOffsets, blockLengths in self.index.values():
+            size += (firstPositions.itemsize + blockLengths.itemsize) * len(firstPositions) + sys.getsizeof(blockOffsets)
+        return size + sum(sys.getsizeof(block) for block in self.blockCache.values())
+
+    #Returns the records of a chromosome; if decodeValue is given, looked up values are passed through it
+    def getChromosome(self, chromosome, decodeValue=None):
+        if chromosome not in self.index:
+            raise KeyError(chromosome)
+        return ChromosomeFrequencies(self, chromosome, decodeValue)
+
+    #Returns the records of a block as {key: value}, decoding it if it is not cached
+    def getBlock(self, chromosome, blockIndex):
+        cacheKey = (chromosome, blockIndex)
+        if cacheKey in self.blockCache:
+            block = self.blockCache.pop(cacheKey)
+        else:
+            firstPositions, blockOffsets, blockLengths = self.index[chromosome]
+            blockOffset = blockOffsets[blockIndex]
+            block = dict(pickle.loads(zlib.decompress(self.data[blockOffset:blockOffset + blockLengths[blockIndex]])))
+            if len(self.blockCache) >= FREQUENCY_STORE_CACHED_BLOCKS:
+                self.blockCache.popitem(last=False)
+        self.blockCache[cacheKey] = block
+        return block
+
+    #Returns the value of the record with key at position, or None if there is none
+    def find(self, chromosome, position, key):
+        firstPositions = self.index[chromosome][0]
+        blockIndex = bisect_right(firstPositions, position) - 1
+        if blockIndex < 0:
+            return None
+        return self.getBlock(chromosome, blockIndex).get(key)
+
+    def close(self):
+        self.data.close()
+
+#The records of one chromosome of a store, looked up by variant keys
+class ChromosomeFrequencies(object):
+    def __init__(self, store, chromosome, decodeValue=None):
+        self.store = store
+        self.chromosome = chromosome
+        self.decodeValue = decodeValue
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.store)
+
+    def find(self, key):
+        return self.store.find(self.chromosome, getVariantKeyPosition(key), key)
+
+    def __contains__(self, key):
+        return self.find(key) is not None
+
+    def __getitem__(self, key):
+        value = self.find(key)
+        if value is None:
+            raise KeyError(key)
+        return value if self.decodeValue is None else self.decodeValue(value)
+
+#Returns the store of a frequency file kept in storeDirectory, converting the file first if that was not done yet or if
+#the file changed since. Returns None if the store can not be written
+def getFrequencyStore(sourcePath, storeDirectory, readRecords):
+    storePath = getCachePath(storeDirectory, os.path.normpath(sourcePath), ".store")
+    sourceStatus = os.stat(sourcePath)
+    store = None
+    try:
+        if os.path.exists(storePath):
+            try:
+                store = FrequencyStore(storePath)
+            except ValueError:
+                #written by another version; it is converted again below
+                pass
+            if store is not None:
+                if store.sourceSize == sourceStatus.st_size and store.sourceModificationTime == int(sourceStatus.st_mtime):
+                    return store
+                #unmap the stale store before its file is replaced
+                store.close()
+                store = None
+        if not os.path.exists(storeDirectory):
+            os.makedirs(storeDirectory)
+        writeFrequencyStore(sourcePath, storePath, readRecords)
+        return FrequencyStore(storePath)
+    except (IOError, OSError, ValueError):
+        if store is not None:
+            store.close()
+        return None
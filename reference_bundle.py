@@ -0,0 +1,214 @@
+#Read-only, memory mapped bundle of the large reference tables for worker processes
+#The nested dictionaries (transcript models, Pfam tables, 1000G frequencies, ...) are written once into a file holding an
+#open addressing hash table of pickled values. Forked workers all map the same file, so its pages are shared through the
+#OS page cache instead of each worker touching (and so copying) its own dictionaries
+
+import os, mmap, pickle, struct, tempfile, zlib, numbers
+from array import array
+from collections import OrderedDict
+
+REFERENCE_BUNDLE_MAGIC = b'ALOFTRB1'
+
+#number of hash slots, offset of the slots
+REFERENCE_BUNDLE_HEADER = struct.Struct('<QQ')
+
+#key length, value length
+REFERENCE_BUNDLE_RECORD = struct.Struct('<II')
+
+REFERENCE_BUNDLE_SLOT = struct.Struct('<Q')
+
+#Number of unpickled values kept in memory, so that the values of hot keys are not unpickled again for every row
+REFERENCE_BUNDLE_CACHED_VALUES = 4096
+
+#Returns a bundle key component for a string, integer or tuple of them; components are length prefixed so that nested keys can never collide
+#Integers of any type (such as python 2 longs) encode the same when they are equal, like they hash the same as dictionary keys
+def encodeKeyComponent(key):
+    if isinstance(key, tuple):
+        key = b't' + b''.join(encodeKeyComponent(component) for component in key)
+    else:
+        key = ('i' + str(int(key))) if isinstance(key, numbers.Integral) else ('s' + key)
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+    return struct.pack('<I', len(key)) + key
+
+def getKeyHash(key):
+    return zlib.crc32(key) & 0xffffffff
+
+def getSlotArray(slotCount):
+    slots = array('L' if array('L').itemsize == 8 else 'Q', [0]) * slotCount
+    assert(slots.itemsize == REFERENCE_BUNDLE_SLOT.size)
+    return slots
+
+#Writes the tables into bundleFile; tables is a list of (name, table, depth), where depth is the number of nested dictionary levels
+#A depth of 0 stores the table as one value
+def writeReferenceBundle(bundleFile, tables):
+    recordOffsets = []
+    recordHashes = []
+
+    bundleFile.write(REFERENCE_BUNDLE_MAGIC)
+    bundleFile.write(REFERENCE_BUNDLE_HEADER.pack(0, 0))
+    offset = [len(REFERENCE_BUNDLE_MAGIC) + REFERENCE_BUNDLE_HEADER.size]
+
+    def writeRecord(key, value):
+        bundleFile.write(REFERENCE_BUNDLE_RECORD.pack(len(key), len(value)))
+        bundleFile.write(key)
+        bundleFile.write(value)
+        recordOffsets.append(offset[0])
+        recordHashes.append(getKeyHash(key))
+        offset[0] += REFERENCE_BUNDLE_RECORD.size + len(key) + len(value)
+
+    #nested dictionaries get an empty record for every key, so that lookups of missing keys fail at the same level as they did
+    def writeTable(prefix, table, depth):
+        if depth == 0:
+            writeRecord(prefix, pickle.dumps(table, protocol=2))
+            return
+        for key, value in table.items():
+            key = prefix + encodeKeyComponent(key)
+            if depth > 1:
+                writeRecord(key, b'')
+                writeTable(key, value, depth - 1)
+            else:
+                writeRecord(key, pickle.dumps(value, protocol=2))
+
+    for name, table, depth in tables:
+        writeTable(encodeKeyComponent(name), table, depth)
+
+    slotCount = 1
+    while slotCount < 2 * len(recordOffsets):
+        slotCount *= 2
+    slots = getSlotArray(slotCount)
+    for recordOffset, recordHash in zip(recordOffsets, recordHashes):
+        slot = recordHash & (slotCount - 1)
+        while slots[slot] != 0:
+            slot = (slot + 1) & (slotCount - 1)
+        slots[slot] = recordOffset
+
+    bundleFile.write(slots.tobytes() if hasattr(slots, 'tobytes') else slots.tostring())
+    bundleFile.seek(len(REFERENCE_BUNDLE_MAGIC))
+    bundleFile.write(REFERENCE_BUNDLE_HEADER.pack(slotCount, offset[0]))
+    bundleFile.flush()
+
+class ReferenceBundle(object):
+    def __init__(self, bundleFile):
+        self.bundleFile = bundleFile
+        self.data = mmap.mmap(bundleFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(REFERENCE_BUNDLE_MAGIC)] != REFERENCE_BUNDLE_MAGIC:
+            raise ValueError("Not a reference bundle")
+        self.slotCount, self.slotsOffset = REFERENCE_BUNDLE_HEADER.unpack_from(self.data, len(REFERENCE_BUNDLE_MAGIC))
+        self.valueCache = OrderedDict()
+
+    def __len__(self):
+        return len(self.data)
+
+    #Returns the offset and length of the value stored under key, or None if there is no such key
+    def find(self, key):
+        slot = getKeyHash(key) & (self.slotCount - 1)
+        while True:
+            recordOffset = REFERENCE_BUNDLE_SLOT.unpack_from(self.data, self.slotsOffset + slot * REFERENCE_BUNDLE_SLOT.size)[0]
+            if recordOffset == 0:
+                return None
+            keyLength, valueLength = REFERENCE_BUNDLE_RECORD.unpack_from(self.data, recordOffset)
+            keyOffset = recordOffset + REFERENCE_BUNDLE_RECORD.size
+            if self.data[keyOffset:keyOffset + keyLength] == key:
+                return keyOffset + keyLength, valueLength
+            slot = (slot + 1) & (self.slotCount - 1)
+
+    #Returns the unpickled value stored under key, raising KeyError if there is no such key
+    #Recently used values are kept, so like a dictionary's values they are the same objects on every lookup
+    def getValue(self, key):
+        if key in self.valueCache:
+            value = self.valueCache.pop(key)
+        else:
+            location = self.find(key)
+            if location is None:
+                raise KeyError(key)
+            valueOffset, valueLength = location
+            value = pickle.loads(self.data[valueOffset:valueOffset + valueLength])
+            if len(self.valueCache) >= REFERENCE_BUNDLE_CACHED_VALUES:
+                self.valueCache.popitem(last=False)
+        self.valueCache[key] = value
+        return value
+
+    def getTable(self, name, depth):
+        if depth == 0:
+            location = self.find(encodeKeyComponent(name))
+            if location is None:
+                raise KeyError(name)
+            valueOffset, valueLength = location
+            return pickle.loads(self.data[valueOffset:valueOffset + valueLength])
+        return BundleTable(self, encodeKeyComponent(name), depth)
+
+    def close(self):
+        self.data.close()
+        self.bundleFile.close()
+
+#A read-only view of one (nested) dictionary of a bundle, supporting the lookups aloft does on the dictionaries it replaces
+class BundleTable(object):
+    def __init__(self, bundle, prefix, depth):
+        self.bundle = bundle
+        self.prefix = prefix
+        self.depth = depth
+
+    def __contains__(self, key):
+        return self.bundle.find(self.prefix + encodeKeyComponent(key)) is not None
+
+    def __getitem__(self, key):
+        bundleKey = self.prefix + encodeKeyComponent(key)
+        if self.depth > 1:
+            if self.bundle.find(bundleKey) is None:
+                raise KeyError(key)
+            return BundleTable(self.bundle, bundleKey, self.depth - 1)
+        try:
+            return self.bundle.getValue(bundleKey)
+        except KeyError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+#Writes the tables into a bundle at bundlePath, through a temporary file that is renamed into place so that readers never see a partial bundle
+def writeReferenceBundleFile(bundlePath, tables):
+    bundleDirectory = os.path.dirname(bundlePath)
+    temporaryDescriptor, temporaryPath = tempfile.mkstemp(dir=bundleDirectory, prefix=".%s." % os.path.basename(bundlePath))
+    try:
+        with os.fdopen(temporaryDescriptor, 'w+b') as bundleFile:
+            writeReferenceBundle(bundleFile, tables)
+        os.rename(temporaryPath, bundlePath)
+    except:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+
+#Returns the bundle at bundlePath, or None if there is no readable bundle there
+def openReferenceBundle(bundlePath):
+    try:
+        bundleFile = open(bundlePath, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        return ReferenceBundle(bundleFile)
+    except (ValueError, struct.error, mmap.error):
+        bundleFile.close()
+        return None
+
+#Returns a copy of referenceData where the tables named in bundledTables, a list of (name, depth), are replaced by views
+#of a reference bundle written to an unlinked temporary file in bundleDirectory
+#Tables that are not dictionaries, such as views of a bundle or other stores, are left as they are
+def bundleReferenceData(referenceData, bundledTables, bundleDirectory):
+    bundledTables = [(name, depth) for name, depth in bundledTables if isinstance(referenceData[name], dict)]
+    bundleFile = tempfile.TemporaryFile(dir=bundleDirectory)
+    try:
+        writeReferenceBundle(bundleFile, [(name, referenceData[name], depth) for name, depth in bundledTables])
+        bundle = ReferenceBundle(bundleFile)
+    except:
+        bundleFile.close()
+        raise
+
+    bundledReferenceData = dict(referenceData)
+    for name, depth in bundledTables:
+        bundledReferenceData[name] = bundle.getTable(name, depth)
+    bundledReferenceData['referenceBundle'] = bundle
+    return bundledReferenceData
@@ -0,0 +1,214 @@
+#Packed on-disk store for chromosome sequences read from FASTA files
+#A sequence is converted once into 2 bits per base, with runs of other characters (N and the like) and runs of
+#lowercase (soft-masked) bases kept next to it, and is then read through mmap so that loading it is instant
+#and concurrent processes share it through the OS page cache
+
+import os, re, mmap, struct, tempfile
+from itertools import groupby
+from array import array
+from bisect import bisect_right
+
+PACKED_SEQUENCE_MAGIC = b'ALOFT2B1'
+
+#length, number of exception runs, number of soft-mask runs, source file size, source file modification time
+PACKED_SEQUENCE_HEADER = struct.Struct('<QQQQQ')
+
+#Number of bases converted at a time; a multiple of 4 so that packed bytes never straddle two chunks
+PACKED_SEQUENCE_CHUNK_SIZE = 4 * 1024 * 1024
+
+#Maps every packed byte to the 4 bases it holds
+PACKED_BYTE_BASES = ["".join("ACGT"[(packedByte >> shift) & 3] for shift in (6, 4, 2, 0)) for packedByte in range(256)]
+
+#For each of the 4 bases of a packed byte, from the first to the last, a translation table from the packed byte to that base
+PACKED_BYTE_BASE_TABLES = [bytes(bytearray(ord("ACGT"[(packedByte >> shift) & 3]) for packedByte in range(256))) for shift in (6, 4, 2, 0)]
+
+#Maps every 4 bases to their packed byte
+BASES_PACKED_BYTE = dict((bases, packedByte) for packedByte, bases in enumerate(PACKED_BYTE_BASES))
+
+exceptionPattern = re.compile('[^ACGTacgt]+')
+softMaskPattern = re.compile('[a-z]+')
+
+#Returns an array of unsigned 32 bit positions, which are enough for any chromosome
+def getPositionArray(values=()):
+    positions = array('I', values)
+    assert(positions.itemsize == 4)
+    return positions
+
+def getArrayBytes(values):
+    return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+def loadArrayBytes(values, data):
+    if hasattr(values, 'frombytes'):
+        values.frombytes(data)
+    else:
+        values.fromstring(data)
+
+#Appends the run [start, end) to a list of runs, joining it with the last run if they touch and have the same character
+def addRun(starts, ends, characters, start, end, character=None):
+    if len(ends) > 0 and ends[-1] == start and (characters is None or characters[-1] == character):
+        ends[-1] = end
+    else:
+        starts.append(start)
+        ends.append(end)
+        if characters is not None:
+            characters.append(character)
+
+#Converts a FASTA file holding one sequence into a packed sequence file
+#The sequence starts with a '0' so that it can be indexed by 1-based positions, like getGenomeSequences and getAncestorData did
+def writePackedSequence(fastaPath, packedPath):
+    sourceStatus = os.stat(fastaPath)
+    exceptionStarts, exceptionEnds, exceptionCharacters = getPositionArray(), getPositionArray(), []
+    softMaskStarts, softMaskEnds = getPositionArray(), getPositionArray()
+
+    packedDirectory = os.path.dirname(packedPath)
+    temporaryDescriptor, temporaryPath = tempfile.mkstemp(dir=packedDirectory, prefix=".%s." % os.path.basename(packedPath))
+    try:
+        with os.fdopen(temporaryDescriptor, 'wb') as packedFile:
+            packedFile.write(PACKED_SEQUENCE_MAGIC)
+            packedFile.write(PACKED_SEQUENCE_HEADER.pack(0, 0, 0, 0, 0))
+
+            def packChunk(chunk, offset):
+                for match in exceptionPattern.finditer(chunk):
+                    runStart = offset + match.start()
+                    for character, characters in groupby(match.group()):
+                        runLength = len(list(characters))
+                        addRun(exceptionStarts, exceptionEnds, exceptionCharacters, runStart, runStart + runLength, character)
+                        runStart += runLength
+                for match in softMaskPattern.finditer(chunk):
+                    addRun(softMaskStarts, softMaskEnds, None, offset + match.start(), offset + match.end())
+                #exceptions are packed as A, and restored from their runs when the sequence is read
+                bases = exceptionPattern.sub(lambda match: 'A' * len(match.group()), chunk).upper()
+                bases += 'A' * (-len(bases) % 4)
+                packedFile.write(bytearray(BASES_PACKED_BYTE[bases[i:i+4]] for i in range(0, len(bases), 4)))
+
+            length = 0
+            pending = ['0']
+            pendingLength = 1
+            with open(fastaPath) as fastaFile:
+                ##skip first >chr* line
+                fastaFile.readline()
+                for line in fastaFile:
+                    line = line.strip()
+                    pending.append(line)
+                    pendingLength += len(line)
+                    if pendingLength >= PACKED_SEQUENCE_CHUNK_SIZE:
+                        pendingSequence = ''.join(pending)
+                        packChunk(pendingSequence[:PACKED_SEQUENCE_CHUNK_SIZE], length)
+                        length += PACKED_SEQUENCE_CHUNK_SIZE
+                        pending = [pendingSequence[PACKED_SEQUENCE_CHUNK_SIZE:]]
+                        pendingLength = len(pending[0])
+            packChunk(''.join(pending), length)
+            length += pendingLength
+
+            packedFile.write(getArrayBytes(exceptionStarts))
+            packedFile.write(getArrayBytes(exceptionEnds))
+            packedFile.write(''.join(exceptionCharacters).encode('latin-1'))
+            packedFile.write(getArrayBytes(softMaskStarts))
+            packedFile.write(getArrayBytes(softMaskEnds))
+
+            packedFile.seek(len(PACKED_SEQUENCE_MAGIC))
+            packedFile.write(PACKED_SEQUENCE_HEADER.pack(length, len(exceptionStarts), len(softMaskStarts), sourceStatus.st_size, int(sourceStatus.st_mtime)))
+        #renaming is atomic, so concurrent processes never see a partially written file
+        os.rename(temporaryPath, packedPath)
+    except:
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+        raise
+
+#A chromosome sequence read from a packed sequence file, which can be sliced like the string it was converted from
+class PackedSequence(object):
+    def __init__(self, packedPath):
+        with open(packedPath, 'rb') as packedFile:
+            self.data = mmap.mmap(packedFile.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(PACKED_SEQUENCE_MAGIC)] != PACKED_SEQUENCE_MAGIC:
+            self.data.close()
+            raise ValueError("%s is not a packed sequence file" % (packedPath))
+        headerOffset = len(PACKED_SEQUENCE_MAGIC)
+        self.length, exceptionCount, softMaskCount, self.sourceSize, self.sourceModificationTime = PACKED_SEQUENCE_HEADER.unpack(self.data[headerOffset:headerOffset + PACKED_SEQUENCE_HEADER.size])
+        self.basesOffset = headerOffset + PACKED_SEQUENCE_HEADER.size
+
+        offset = self.basesOffset + (self.length + 3) // 4
+        self.exceptionStarts, offset = self.readPositions(offset, exceptionCount)
+        self.exceptionEnds, offset = self.readPositions(offset, exceptionCount)
+        self.exceptionCharacters = self.data[offset:offset + exceptionCount].decode('latin-1')
+        offset += exceptionCount
+        self.softMaskStarts, offset = self.readPositions(offset, softMaskCount)
+        self.softMaskEnds, offset = self.readPositions(offset, softMaskCount)
+
+    def readPositions(self, offset, count):
+        positions = getPositionArray()
+        loadArrayBytes(positions, self.data[offset:offset + 4 * count])
+        return positions, offset + 4 * count
+
+    def __len__(self):
+        return self.length
+
+    #only the run positions live in memory, the bases stay in the page cache
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sum(positions.itemsize * len(positions) for positions in [self.exceptionStarts, self.exceptionEnds, self.softMaskStarts, self.softMaskEnds]) + len(self.exceptionCharacters)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.length)
+            if step != 1:
+                return ''.join(self.getBases(position, position + 1) for position in range(start, stop, step))
+            return self.getBases(start, stop)
+        if index < 0:
+            index += self.length
+        if index < 0 or index >= self.length:
+            raise IndexError("sequence index out of range")
+        return self.getBases(index, index + 1)
+
+    def getBases(self, start, stop):
+        if start >= stop:
+            return ''
+        packedStart = start // 4
+        packedBytes = self.data[self.basesOffset + packedStart:self.basesOffset + (stop + 3) // 4]
+        #every 4th base is translated from the packed bytes in one pass, so no byte is decoded in python
+        bases = bytearray(4 * len(packedBytes))
+        for baseIndex, baseTable in enumerate(PACKED_BYTE_BASE_TABLES):
+            bases[baseIndex::4] = packedBytes.translate(baseTable)
+        del bases[stop - 4 * packedStart:]
+        del bases[:start - 4 * packedStart]
+
+        exceptionIndex = bisect_right(self.exceptionEnds, start)
+        while exceptionIndex < len(self.exceptionStarts) and self.exceptionStarts[exceptionIndex] < stop:
+            runStart = max(start, self.exceptionStarts[exceptionIndex])
+            runEnd = min(stop, self.exceptionEnds[exceptionIndex])
+            bases[runStart - start:runEnd - start] = self.exceptionCharacters[exceptionIndex].encode('latin-1') * (runEnd - runStart)
+            exceptionIndex += 1
+        softMaskIndex = bisect_right(self.softMaskEnds, start)
+        while softMaskIndex < len(self.softMaskStarts) and self.softMaskStarts[softMaskIndex] < stop:
+            runStart = max(start, self.softMaskStarts[softMaskIndex])
+            runEnd = min(stop, self.softMaskEnds[softMaskIndex])
+            bases[runStart - start:runEnd - start] = bases[runStart - start:runEnd - start].lower()
+            softMaskIndex += 1
+        return bases.decode('latin-1')
+
+    def close(self):
+        self.data.close()
+
+#Returns the sequence of a FASTA file as a PackedSequence, converting it into packedDirectory first if that was not done yet
+#or if the FASTA file changed since. Returns None if the packed sequence can not be written
+def getPackedSequence(fastaPath, packedDirectory):
+    #imported here since transcript_store imports this module
+    from transcript_store import getCachePath
+    packedPath = getCachePath(packedDirectory, fastaPath, ".2bit")
+    sourceStatus = os.stat(fastaPath)
+    packedSequence = None
+    try:
+        if os.path.exists(packedPath):
+            packedSequence = PackedSequence(packedPath)
+            if packedSequence.sourceSize == sourceStatus.st_size and packedSequence.sourceModificationTime == int(sourceStatus.st_mtime):
+                return packedSequence
+            #unmap the stale sequence before its file is replaced
+            packedSequence.close()
+            packedSequence = None
+        if not os.path.exists(packedDirectory):
+            os.makedirs(packedDirectory)
+        writePackedSequence(fastaPath, packedPath)
+        return PackedSequence(packedPath)
+    except (IOError, OSError, ValueError):
+        if packedSequence is not None:
+            packedSequence.close()
+        return None
@@ -31,4 +31,20 @@ def compstr(strand):
 
 #translates string, eg from ACT to T
 def translate_aa(seq):
-    return "".join(code[seq[i:i+3]] for i in range(0, len(seq)-2, 3))
\ No newline at end of file
+    return "".join(code[seq[i:i+3]] for i in range(0, len(seq)-2, 3))
+
+STOP_CODONS = frozenset(codon for codon in code if code[codon] == '*')
+
+TRANSLATABLE_BASES = frozenset('ACGT')
+
+#Returns whether a sequence is made of ACGT only, so that translate_aa can translate any codon of it
+def isTranslatable(seq):
+    return TRANSLATABLE_BASES.issuperset(seq)
+
+#Returns the index of the first stop codon of a sequence at or after codon firstCodon, in the frame of its first base, or -1
+#if there is none; this is translate_aa(seq).index('*') for a translatable sequence, without translating the other codons
+def findStopCodon(seq, firstCodon=0):
+    for i in range(3*firstCodon, len(seq)-2, 3):
+        if seq[i:i+3] in STOP_CODONS:
+            return i//3
+    return -1
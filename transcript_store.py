@@ -0,0 +1,178 @@
+#Persistent cache of the transcript model parsed from the GENCODE GTF and .interval annotation files
+#Parsing these files takes minutes, so the parsed dictionaries are stored once as flat position arrays in the cache
+#directory, next to a fingerprint of the file they were parsed from, and are loaded from there on later runs
+#The GTF model is kept per chromosome: a byte offset index of the GTF by chromosome lets one chromosome be parsed
+#without reading the lines of the others
+
+import os, pickle, tempfile, hashlib
+from sequence_store import getPositionArray
+
+#Bump when the packed layout below changes so that older cached models are rebuilt
+TRANSCRIPT_MODEL_VERSION = 1
+
+#Returns what a cached file of sourcePath has to match to be used: the layout version it was written with, the source file's
+#path, size and modification time, and the parameters it was parsed with
+def getSourceFingerprint(sourcePath, parameters, version=TRANSCRIPT_MODEL_VERSION):
+    sourceStatus = os.stat(sourcePath)
+    return (version, os.path.abspath(sourcePath), sourceStatus.st_size, int(sourceStatus.st_mtime), parameters)
+
+#Returns the path of a cache file of sourcePath in cacheDirectory, named after the source file and a short hash of its
+#absolute path, so that source files of the same name in different directories never share a cache file
+def getCachePath(cacheDirectory, sourcePath, suffix):
+    pathHash = hashlib.sha1(os.path.abspath(sourcePath).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cacheDirectory, "%s.%s%s" % (os.path.basename(sourcePath), pathHash, suffix))
+
+def getModelPath(modelDirectory, sourcePath):
+    return getCachePath(modelDirectory, sourcePath, ".model")
+
+def getChromosomeModelPath(modelDirectory, sourcePath, chromosome):
+    return getCachePath(modelDirectory, sourcePath, ".chr%s.model" % (chromosome))
+
+def getOffsetIndexPath(modelDirectory, sourcePath):
+    return getCachePath(modelDirectory, sourcePath, ".offsets")
+
+#Returns the byte ranges of each chromosome's lines in a tab separated annotation file, as {chromosome: [(start, end), ...]}
+#Ranges of consecutive lines are merged, so a file grouped by chromosome has one range per chromosome. Comment lines belong to no chromosome
+def scanChromosomeOffsets(sourcePath):
+    chromosomeOffsets = {}
+    offset = 0
+    with open(sourcePath, 'rb') as sourceFile:
+        for line in sourceFile:
+            nextOffset = offset + len(line)
+            if not line.startswith(b'#'):
+                chromosome = line.strip().split(b'\t')[0].split(b'chr')[-1].decode('utf-8')
+                ranges = chromosomeOffsets.setdefault(chromosome, [])
+                if len(ranges) > 0 and ranges[-1][1] == offset:
+                    ranges[-1] = (ranges[-1][0], nextOffset)
+                else:
+                    ranges.append((offset, nextOffset))
+            offset = nextOffset
+    return chromosomeOffsets
+
+#Offset indexes already loaded by this process, by fingerprint
+OFFSET_INDEXES = {}
+
+#Returns the byte offset index of sourcePath, loaded from modelDirectory if it was scanned before from the same file
+def getChromosomeOffsets(sourcePath, modelDirectory):
+    fingerprint = getSourceFingerprint(sourcePath, 'offsets')
+    if fingerprint in OFFSET_INDEXES:
+        return OFFSET_INDEXES[fingerprint]
+
+    offsetIndexPath = getOffsetIndexPath(modelDirectory, sourcePath)
+    chromosomeOffsets = loadPackedModel(offsetIndexPath, fingerprint)
+    if chromosomeOffsets is None:
+        chromosomeOffsets = scanChromosomeOffsets(sourcePath)
+        writePackedModel(offsetIndexPath, fingerprint, chromosomeOffsets)
+
+    OFFSET_INDEXES[fingerprint] = chromosomeOffsets
+    return chromosomeOffsets
+
+#Yields the lines of one chromosome of sourcePath, in file order
+def readChromosomeLines(sourcePath, chromosomeOffsets, chromosome):
+    with open(sourcePath, 'rb') as sourceFile:
+        for start, end in chromosomeOffsets.get(chromosome, []):
+            sourceFile.seek(start)
+            offset = start
+            while offset < end:
+                line = sourceFile.readline()
+                offset += len(line)
+                yield line.decode('utf-8')
+
+#Returns the number of bytes of one chromosome's lines in sourcePath
+def getChromosomeLinesSize(sourcePath, modelDirectory, chromosome):
+    return sum(end - start for start, end in getChromosomeOffsets(sourcePath, modelDirectory).get(chromosome, []))
+
+#Flattens {chromosome: {transcript: [(start, end), ...]}} into, per chromosome, the transcripts in order,
+#the number of intervals of each transcript and all of their coordinates
+def packIntervals(intervalsByChromosome):
+    packedIntervals = []
+    for chromosome, transcriptIntervals in intervalsByChromosome.items():
+        transcripts = list(transcriptIntervals.keys())
+        counts = getPositionArray(len(transcriptIntervals[transcript]) for transcript in transcripts)
+        coordinates = getPositionArray(coordinate for transcript in transcripts for interval in transcriptIntervals[transcript] for coordinate in interval)
+        packedIntervals.append((chromosome, transcripts, counts, coordinates))
+    return packedIntervals
+
+def unpackIntervals(packedIntervals):
+    intervalsByChromosome = {}
+    for chromosome, transcripts, counts, coordinates in packedIntervals:
+        intervals = list(zip(coordinates[0::2], coordinates[1::2]))
+        transcriptIntervals = {}
+        offset = 0
+        for transcript, count in zip(transcripts, counts):
+            transcriptIntervals[transcript] = intervals[offset:offset + count]
+            offset += count
+        intervalsByChromosome[chromosome] = transcriptIntervals
+    return intervalsByChromosome
+
+#Returns the packed model stored at modelPath, or None if there is none or it was built from something else
+def loadPackedModel(modelPath, fingerprint):
+    try:
+        with open(modelPath, 'rb') as modelFile:
+            if pickle.load(modelFile) != fingerprint:
+                return None
+            return pickle.load(modelFile)
+    except (IOError, OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+#Writes the packed model to a temporary file first and renames it into place, so that concurrent runs never read a partial model
+def writePackedModel(modelPath, fingerprint, packedModel):
+    modelDirectory = os.path.dirname(modelPath)
+    try:
+        if not os.path.exists(modelDirectory):
+            os.makedirs(modelDirectory)
+        temporaryDescriptor, temporaryPath = tempfile.mkstemp(dir=modelDirectory, prefix=".%s." % os.path.basename(modelPath))
+    except (IOError, OSError):
+        return
+    try:
+        with os.fdopen(temporaryDescriptor, 'wb') as modelFile:
+            pickle.dump(fingerprint, modelFile, protocol=2)
+            pickle.dump(packedModel, modelFile, protocol=2)
+        os.rename(temporaryPath, modelPath)
+    except (IOError, OSError):
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+
+#Returns getCDSAndExonDictionaries(lines, [chromosome]) for the lines of one chromosome of annotationPath,
+#loaded from modelDirectory if that chromosome was parsed before from the same file
+def getCachedChromosomeCDSAndExonDictionaries(getCDSAndExonDictionaries, annotationPath, chromosome, modelDirectory):
+    modelPath = getChromosomeModelPath(modelDirectory, annotationPath, chromosome)
+    fingerprint = getSourceFingerprint(annotationPath, chromosome)
+
+    packedModel = loadPackedModel(modelPath, fingerprint)
+    if packedModel is not None:
+        transcripts, strands, packedCDS, packedExon, packedStopCodon = packedModel
+        stop_codon = {}
+        for chromosome, transcriptIntervals in unpackIntervals(packedStopCodon).items():
+            stop_codon[chromosome] = dict((transcript, intervals[0]) for transcript, intervals in transcriptIntervals.items())
+        return dict(zip(transcripts, strands)), unpackIntervals(packedCDS), unpackIntervals(packedExon), stop_codon
+
+    chromosomeLines = readChromosomeLines(annotationPath, getChromosomeOffsets(annotationPath, modelDirectory), chromosome)
+    transcript_strand, CDS, exon, stop_codon = getCDSAndExonDictionaries(chromosomeLines, [chromosome])
+    try:
+        packedStopCodon = packIntervals(dict((chromosome, dict((transcript, [interval]) for transcript, interval in transcriptIntervals.items())) for chromosome, transcriptIntervals in stop_codon.items()))
+        packedModel = (list(transcript_strand.keys()), list(transcript_strand.values()), packIntervals(CDS), packIntervals(exon), packedStopCodon)
+    except OverflowError:
+        #coordinates that do not fit the position arrays are simply not cached
+        return transcript_strand, CDS, exon, stop_codon
+    writePackedModel(modelPath, fingerprint, packedModel)
+
+    return transcript_strand, CDS, exon, stop_codon
+
+#Returns getCodingExonIntervals(annotationIntervalPath), loaded from modelDirectory if it was parsed before from the same file
+def getCachedCodingExonIntervals(getCodingExonIntervals, annotationIntervalPath, modelDirectory):
+    modelPath = getModelPath(modelDirectory, annotationIntervalPath)
+    fingerprint = getSourceFingerprint(annotationIntervalPath, None)
+
+    packedModel = loadPackedModel(modelPath, fingerprint)
+    if packedModel is not None:
+        return unpackIntervals(packedModel)
+
+    codingExonIntervals = getCodingExonIntervals(annotationIntervalPath)
+    try:
+        packedModel = packIntervals(codingExonIntervals)
+    except OverflowError:
+        return codingExonIntervals
+    writePackedModel(modelPath, fingerprint, packedModel)
+
+    return codingExonIntervals
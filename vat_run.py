@@ -1,57 +1,51 @@
 #!/usr/bin/env python
 #You can just run VAT without running aloft if you want.
 
-import os, sys
+import os, sys, itertools
 from subprocess import Popen, PIPE
 import re
 from vcf_sort import *
 import gzip
 from common import printError, platformName, getScriptDirectory
 import platform
+import threading
+from collections import deque
 
-def run_vat(arguments, forceVerbose=False):
-	VAT_BIN_PATH = os.path.join(getScriptDirectory(), 'vat-bin')
-	
-	snpMapperPath = os.path.join(VAT_BIN_PATH, 'snpMapper')
-	indelMapperPath = os.path.join(VAT_BIN_PATH, 'indelMapper')
+#Indexes of the snp and indel mappers
+SNP_MAPPER = 0
+INDEL_MAPPER = 1
 
-	if not os.path.exists(snpMapperPath) or not os.path.exists(indelMapperPath):
-		printError("VAT is not installed correctly - please see INSTALL")
+#Number of mapper output lines that stream_vat buffers before it stops feeding the mappers more input
+STREAM_BUFFERED_LINES = 10000
 
-	try:
-		inputPath = arguments[1]
-		vatOutputPath = arguments[2]
-		annotationIntervalPath = arguments[3]
-		annotationSequencePath = arguments[4]
-	except:
-		printError("Failed to parse arguments\nUsage is <input_vcf> <vat_output> <annotation_interval_input> <annotation_sequence_input> <verbosity_level>\nThis program will take care of sorting the input_vcf file numerically.\nFor verbosity_level you must pass in 0 (indicating no verbosity) or 1 (indicating verbosity)")
-	verbose = False
-	if forceVerbose or (5 < len(arguments) and int(arguments[5]) > 0):
-		verbose = True
+#Appended to the ID column of the sites written to the mappers, followed by the number of the input record
+#VAT passes IDs through untouched, so the genotype columns of a record can be reattached to its output by that number
+SITE_RECORD_TAG = ";ALOFT_RECORD="
 
-	if verbose: print('Parsing VCF file...')
-	
-	try:
-		if inputPath.endswith(".gz"):
-			inputFile = gzip.open(inputPath, 'rb')
-		else:
-			inputFile = open(inputPath, 'rb')
-	except:
-		printError("Failed to open %s" % (inputPath))
-	
-	TEMP_SNP_PATH = os.path.join(os.path.split(vatOutputPath)[0],"snpinput_temp")
-	TEMP_INDEL_PATH = os.path.join(os.path.split(vatOutputPath)[0],"indelinput_temp")
-	
-	snpInputFile = open(TEMP_SNP_PATH, "w")
-	indelInputFile = open(TEMP_INDEL_PATH, "w")
-	
+#Writes a data line to a mapper input
+#If recordNumber is given, only the site columns are written, with the record number tagged onto the ID
+def writeMapperSite(mapperInputFile, lineComponents, recordNumber=None):
+	if recordNumber is None:
+		mapperInputFile.write("\t".join(lineComponents) + "\n")
+	else:
+		mapperInputFile.write("\t".join(lineComponents[:2] + [lineComponents[2] + SITE_RECORD_TAG + str(recordNumber)] + lineComponents[3:8]) + "\n")
+
+#Writes the VCF lines to the snp and indel mapper inputs, normalizing the header and any missing ID or trailing columns
+#If genotypeColumns is given, genotype columns are kept out of the mapper inputs and stored in it by record number, see writeMapperSite
+#Each record is noted in genotypeColumns before it is written to a mapper, so the mapper's output can never get ahead of it
+def writeMapperInputs(inputFile, snpInputFile, indelInputFile, genotypeColumns=None):
+	recordNumber = None
 	foundHeader = False
 	foundID = True
 	numberOfMissingComponents = 0
 	normalHeaderComponents = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO']
 	for lineBytes in inputFile:
 		line = lineBytes.decode("utf-8")
-		lineComponents = line.rstrip("\n").rstrip("\t").split("\t")
+		if genotypeColumns is not None and not line.startswith("#"):
+			#the genotype columns stay one untouched field
+			lineComponents = line.rstrip("\n").rstrip("\t").split("\t", 8 if foundID else 7)
+		else:
+			lineComponents = line.rstrip("\n").rstrip("\t").split("\t")
 
 		if line.startswith("#"):
 			if line.startswith("#CHR"):
@@ -84,6 +78,8 @@ def run_vat(arguments, forceVerbose=False):
 				lineComponents = lineComponents[0:2] + ['NA'] + lineComponents[2:]
 			if numberOfMissingComponents > 0:
 				lineComponents += ['NA'] * numberOfMissingComponents
+			if genotypeColumns is not None:
+				recordNumber = genotypeColumns.add(lineComponents[8:])
 			refComponents = lineComponents[3].split(",")
 			altComponents = lineComponents[4].split(",")
 
@@ -94,75 +90,313 @@ def run_vat(arguments, forceVerbose=False):
 				refComponent = refComponents[index]
 				altComponent = altComponents[index]
 				if len(refComponent) == 1 and len(altComponent) == 1 and not foundSnp:
-					snpInputFile.write("\t".join(lineComponents) + "\n")
+					if genotypeColumns is not None:
+						genotypeColumns.addMapper(recordNumber, SNP_MAPPER)
+					writeMapperSite(snpInputFile, lineComponents, recordNumber)
 					foundSnp = True
 					if foundIndel:
 						break
 
 				if (len(refComponent) > 1 or len(altComponent) > 1) and not foundIndel:
-					indelInputFile.write("\t".join(lineComponents) + "\n")
+					if genotypeColumns is not None:
+						genotypeColumns.addMapper(recordNumber, INDEL_MAPPER)
+					writeMapperSite(indelInputFile, lineComponents, recordNumber)
 					foundIndel = True
 					if foundSnp:
 						break
+
+			if genotypeColumns is not None:
+				genotypeColumns.release(recordNumber)
+
+#Genotype columns of the records written to the mappers, by record number, see writeMapperSite
+#A record's columns are dropped once every mapper it was written to has output a later record or finished,
+#so only the records that the mappers have yet to catch up with are held
+class GenotypeColumns:
+	def __init__(self, mapperCount):
+		self.lock = threading.Lock()
+		self.columns = {}
+		self.uses = {}
+		self.recordCount = 0
+		self.mapperRecords = [deque() for mapperIndex in range(mapperCount)]
+
+	#Stores a record's genotype columns and returns its record number; the record is held until release is called for it
+	def add(self, columns):
+		with self.lock:
+			recordNumber = self.recordCount
+			self.recordCount += 1
+			self.columns[recordNumber] = columns
+			self.uses[recordNumber] = 1
+		return recordNumber
+
+	#Notes that a record is written to a mapper, holding it until the mapper is past it
+	def addMapper(self, recordNumber, mapperIndex):
+		with self.lock:
+			self.uses[recordNumber] += 1
+			self.mapperRecords[mapperIndex].append(recordNumber)
+
+	def release(self, recordNumber):
+		with self.lock:
+			self.releaseRecord(recordNumber)
+
+	def releaseRecord(self, recordNumber):
+		self.uses[recordNumber] -= 1
+		if self.uses[recordNumber] == 0:
+			del self.uses[recordNumber]
+			del self.columns[recordNumber]
+
+	#Returns the genotype columns of a record in a mapper's output; the mappers keep input order, so it is past any earlier record
+	def get(self, mapperIndex, recordNumber):
+		with self.lock:
+			mapperRecords = self.mapperRecords[mapperIndex]
+			while len(mapperRecords) > 0 and mapperRecords[0] < recordNumber:
+				self.releaseRecord(mapperRecords.popleft())
+			return self.columns.get(recordNumber, [])
+
+	def finish(self, mapperIndex):
+		with self.lock:
+			mapperRecords = self.mapperRecords[mapperIndex]
+			while len(mapperRecords) > 0:
+				self.releaseRecord(mapperRecords.popleft())
+
+#Output lines of the mappers, buffered between the threads reading them and the consumer of stream_vat
+#The feeder waits while more than maxBufferedLines lines are buffered, unless the consumer is waiting for a line,
+#since the next line of a mapper that has caught up with its input only comes after more input is fed
+class MapperOutputs:
+	def __init__(self, mapperCount, maxBufferedLines):
+		self.condition = threading.Condition()
+		self.buffers = [deque() for mapperIndex in range(mapperCount)]
+		self.finished = [False] * mapperCount
+		self.bufferedLines = 0
+		self.consumerWaiting = False
+		self.maxBufferedLines = maxBufferedLines
+
+	def add(self, mapperIndex, line):
+		with self.condition:
+			self.buffers[mapperIndex].append(line)
+			self.bufferedLines += 1
+			if self.consumerWaiting:
+				self.condition.notify_all()
+
+	def finish(self, mapperIndex):
+		with self.condition:
+			self.finished[mapperIndex] = True
+			self.condition.notify_all()
+
+	def waitForRoom(self):
+		with self.condition:
+			while self.bufferedLines > self.maxBufferedLines and not self.consumerWaiting:
+				self.condition.wait()
+
+	#Returns the next output line of a mapper, or None once it has no more
+	def get(self, mapperIndex):
+		with self.condition:
+			buffer = self.buffers[mapperIndex]
+			while len(buffer) == 0 and not self.finished[mapperIndex]:
+				self.consumerWaiting = True
+				self.condition.notify_all()
+				self.condition.wait()
+			self.consumerWaiting = False
+			if len(buffer) == 0:
+				return None
+			self.bufferedLines -= 1
+			if self.bufferedLines == self.maxBufferedLines:
+				self.condition.notify_all()
+			return buffer.popleft()
+
+#Wraps a mapper's stdin pipe so that text can be written to it, waiting for room in the buffered mapper outputs first
+class MapperInput:
+	def __init__(self, pipe, mapperOutputs):
+		self.pipe = pipe
+		self.mapperOutputs = mapperOutputs
+
+	def write(self, text):
+		self.mapperOutputs.waitForRoom()
+		self.pipe.write(text.encode("utf-8"))
+
+#Feeds the mappers from a thread, so that reading their output can proceed at the same time
+def feedMappers(inputFile, mapperPipes, mapperOutputs, feedErrors, genotypeColumns):
+	try:
+		writeMapperInputs(inputFile, MapperInput(mapperPipes[SNP_MAPPER].stdin, mapperOutputs), MapperInput(mapperPipes[INDEL_MAPPER].stdin, mapperOutputs), genotypeColumns)
+	except Exception as exception:
+		#a mapper that exits early closes its end of the pipe
+		feedErrors.append(exception)
+	for mapperPipe in mapperPipes:
+		try:
+			mapperPipe.stdin.close()
+		except Exception:
+			pass
+
+def readMapperOutput(mapperPipe, mapperIndex, mapperOutputs):
+	try:
+		for lineBytes in mapperPipe.stdout:
+			mapperOutputs.add(mapperIndex, lineBytes.decode("utf-8"))
+	finally:
+		mapperOutputs.finish(mapperIndex)
+
+#Returns a mapper output data line without its newline, with the record number tag removed from its ID and the genotype columns
+#that were kept out of the mapper's input reattached
+def reattachGenotypeColumns(line, mapperIndex, genotypeColumns):
+	lineComponents = line.rstrip("\n").split("\t")
+	tagIndex = lineComponents[2].rfind(SITE_RECORD_TAG) if len(lineComponents) > 2 else -1
+	if tagIndex >= 0:
+		recordNumber = lineComponents[2][tagIndex + len(SITE_RECORD_TAG):]
+		lineComponents[2] = lineComponents[2][:tagIndex]
+		try:
+			lineComponents += genotypeColumns.get(mapperIndex, int(recordNumber))
+		except ValueError:
+			pass
+	return "\t".join(lineComponents)
+
+#Opens a VCF input file for reading bytes; a path of - reads from stdin
+def openVcfInput(inputPath):
+	try:
+		if inputPath == "-":
+			return getattr(sys.stdin, 'buffer', sys.stdin)
+		elif inputPath.endswith(".gz"):
+			return gzip.open(inputPath, 'rb')
+		else:
+			return open(inputPath, 'rb')
+	except:
+		printError("Failed to open %s" % (inputPath))
+
+#Starts VAT's snp and indel mappers on a VCF input, with a thread feeding them the VCF and one reading the output of each
+#With sitesOnly, the mappers only get the site columns and the sample genotype columns are reattached to their output
+def startMappers(inputPath, annotationIntervalPath, annotationSequencePath, verbose=False, sitesOnly=False):
+	VAT_BIN_PATH = os.path.join(getScriptDirectory(), 'vat-bin')
 	
-	snpInputFile.close()
-	indelInputFile.close()
-	
-	snpInputFile = open(TEMP_SNP_PATH, "r")
-	indelInputFile = open(TEMP_INDEL_PATH, "r")
-	
-	if verbose: print("Running snpMapper...")
+	snpMapperPath = os.path.join(VAT_BIN_PATH, 'snpMapper')
+	indelMapperPath = os.path.join(VAT_BIN_PATH, 'indelMapper')
+
+	if not os.path.exists(snpMapperPath) or not os.path.exists(indelMapperPath):
+		printError("VAT is not installed correctly - please see INSTALL")
+
+	inputFile = openVcfInput(inputPath)
+
+	if verbose: print("Running snpMapper and indelMapper...")
 	try:
-		snpMapperPipe = Popen([snpMapperPath, annotationIntervalPath, annotationSequencePath], stdout=PIPE, stdin=snpInputFile)
+		snpMapperPipe = Popen([snpMapperPath, annotationIntervalPath, annotationSequencePath], stdout=PIPE, stdin=PIPE)
 	except:
 		printError("Failed to open snpMapper")
-	
-	numSnp = 0
-	numIndel = 0
-	
-	sortedLines = []
-	
-	vcfOutputFile = open(vatOutputPath, "w")
-	for lineBytes in snpMapperPipe.stdout:
-		line = lineBytes.decode("utf-8")
+	try:
+		indelMapperPipe = Popen([indelMapperPath, annotationIntervalPath, annotationSequencePath], stdout=PIPE, stdin=PIPE)
+	except:
+		printError("Failed to open indelMapper")
+
+	mappers = {'inputPath' : inputPath, 'inputFile' : inputFile, 'pipes' : [snpMapperPipe, indelMapperPipe], 'feedErrors' : [],
+		'outputs' : MapperOutputs(2, STREAM_BUFFERED_LINES), 'genotypeColumns' : GenotypeColumns(2) if sitesOnly else None}
+	mappers['threads'] = [threading.Thread(target=feedMappers, args=(inputFile, mappers['pipes'], mappers['outputs'], mappers['feedErrors'], mappers['genotypeColumns']))]
+	for mapperIndex, mapperPipe in enumerate(mappers['pipes']):
+		mappers['threads'].append(threading.Thread(target=readMapperOutput, args=(mapperPipe, mapperIndex, mappers['outputs'])))
+	for thread in mappers['threads']:
+		thread.daemon = True
+		thread.start()
+	return mappers
+
+#Yields a mapper's output lines as they are produced; header lines are kept as they are, and data lines lose their newline
+def iterateMapperLines(mappers, mapperIndex):
+	genotypeColumns = mappers['genotypeColumns']
+	while True:
+		line = mappers['outputs'].get(mapperIndex)
+		if line is None:
+			break
 		if line.startswith("#"):
-			vcfOutputFile.write(line)
+			yield line
+		elif genotypeColumns is not None:
+			yield reattachGenotypeColumns(line, mapperIndex, genotypeColumns)
 		else:
-			numSnp += 1
-			sortedLines.append(line.rstrip("\n"))
-	
-	snpInputFile.close()
-	
-	os.remove(TEMP_SNP_PATH)
-	
-	if verbose: print("Running indelMapper...")
+			yield line.rstrip("\n")
+	if genotypeColumns is not None:
+		genotypeColumns.finish(mapperIndex)
+
+#Waits for the mappers to finish once all of their output is read
+def finishMappers(mappers):
+	for thread in mappers['threads']:
+		thread.join()
+	for mapperPipe in mappers['pipes']:
+		mapperPipe.wait()
+
+	if mappers['inputPath'] != "-":
+		mappers['inputFile'].close()
+	if len(mappers['feedErrors']) > 0:
+		printError("Failed to run VAT's mappers on %s: %s" % (mappers['inputPath'], mappers['feedErrors'][0]))
+
+#Runs VAT's snp and indel mappers on a VCF input and yields the lines of the VAT output as the mappers produce them,
+#without writing any intermediate files. The VCF is piped into both mappers at once, and the sorted outputs of the mappers
+#are merged and deduplicated as they come in, so only a bounded number of lines is buffered (see MapperOutputs)
+#For a VCF sorted by chromosome and position, this gives the same lines as run_vat; otherwise they keep the order of the VCF
+#With sitesOnly, the mappers only get the site columns and the sample genotype columns are reattached to their output
+def stream_vat(inputPath, annotationIntervalPath, annotationSequencePath, verbose=False, sitesOnly=False):
+	mappers = startMappers(inputPath, annotationIntervalPath, annotationSequencePath, verbose, sitesOnly)
+	snpLines = iterateMapperLines(mappers, SNP_MAPPER)
+	lineCounts = [0, 0]
+
+	#the header comes from the snp mapper, which gets the same header as the indel mapper
+	nextLine = next(snpLines, None)
+	while nextLine is not None and nextLine.startswith("#"):
+		yield nextLine
+		nextLine = next(snpLines, None)
+	if nextLine is not None:
+		snpLines = itertools.chain([nextLine], snpLines)
+
+	#merge like a stable sort of the snp lines followed by the indel lines, removing duplicate entries
+	mapperLines = [(line for line in snpLines if not line.startswith("#")), (line for line in iterateMapperLines(mappers, INDEL_MAPPER) if not line.startswith("#"))]
+	nextLines = [next(lines, None) for lines in mapperLines]
+	nextKeys = [getVCFLineKey(line) if line is not None else None for line in nextLines]
+	lastLine = None
+	while nextLines[SNP_MAPPER] is not None or nextLines[INDEL_MAPPER] is not None:
+		if nextLines[INDEL_MAPPER] is None or (nextLines[SNP_MAPPER] is not None and nextKeys[SNP_MAPPER] <= nextKeys[INDEL_MAPPER]):
+			mapperIndex = SNP_MAPPER
+		else:
+			mapperIndex = INDEL_MAPPER
+		line = nextLines[mapperIndex]
+		nextLines[mapperIndex] = next(mapperLines[mapperIndex], None)
+		nextKeys[mapperIndex] = getVCFLineKey(nextLines[mapperIndex]) if nextLines[mapperIndex] is not None else None
+		lineCounts[mapperIndex] += 1
+		if line != lastLine:
+			yield line + "\n"
+		lastLine = line
+
+	finishMappers(mappers)
+	if verbose: print("Finishing VAT. There were %d snp lines and %d indel lines in the output" % (lineCounts[SNP_MAPPER], lineCounts[INDEL_MAPPER]))
+
+def run_vat(arguments, forceVerbose=False, sitesOnly=False):
 	try:
-		indelMapperPipe = Popen([indelMapperPath, annotationIntervalPath, annotationSequencePath], stdout=PIPE, stdin=indelInputFile)
+		inputPath = arguments[1]
+		vatOutputPath = arguments[2]
+		annotationIntervalPath = arguments[3]
+		annotationSequencePath = arguments[4]
 	except:
-		printError("Failed to open indelMapper")
-	
-	for lineBytes in indelMapperPipe.stdout:
-		line = lineBytes.decode("utf-8")
-		if not line.startswith("#"):
-			sortedLines.append(line.rstrip("\n"))
-			numIndel += 1
-	
-	indelInputFile.close()
-	
-	os.remove(TEMP_INDEL_PATH)
-	
-	if verbose: print("Writing out VAT file...")
+		printError("Failed to parse arguments\nUsage is <input_vcf> <vat_output> <annotation_interval_input> <annotation_sequence_input> <verbosity_level>\nThis program will take care of sorting the input_vcf file numerically.\nFor verbosity_level you must pass in 0 (indicating no verbosity) or 1 (indicating verbosity)")
+	verbose = False
+	if forceVerbose or (5 < len(arguments) and int(arguments[5]) > 0):
+		verbose = True
+
+	if verbose: print('Parsing VCF file...')
+
+	mappers = startMappers(inputPath, annotationIntervalPath, annotationSequencePath, verbose, sitesOnly)
+	snpOutputLines = list(iterateMapperLines(mappers, SNP_MAPPER))
+	indelOutputLines = list(iterateMapperLines(mappers, INDEL_MAPPER))
+	finishMappers(mappers)
+
+	vatLines = [line for line in snpOutputLines if line.startswith("#")]
+	snpLines = [line for line in snpOutputLines if not line.startswith("#")]
+	indelLines = [line for line in indelOutputLines if not line.startswith("#")]
+	if verbose: print("Finishing VAT. There were %d snp lines and %d indel lines in the output" % (len(snpLines), len(indelLines)))
+
 	#Sort and remove duplicate entries
+	sortedLines = snpLines + indelLines
 	sortVCFLines(sortedLines)
 	lastLine = None
 	for line in sortedLines:
 		if line != lastLine:
-			vcfOutputFile.write(line + "\n")
+			vatLines.append(line + "\n")
 		lastLine = line
-	
+
+	if verbose: print("Writing out VAT file...")
+	vcfOutputFile = open(vatOutputPath, "w")
+	for line in vatLines:
+		vcfOutputFile.write(line)
 	vcfOutputFile.close()
-	
-	if verbose: print("Finishing VAT. There were %d snp lines and %d indel lines in the output" % (numSnp, numIndel))
 
 if __name__ == "__main__":
 	if len(sys.argv) < 6:
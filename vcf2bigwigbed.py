@@ -4,6 +4,31 @@
 
 import os, sys
 
+#Writes a bed line for each alternate allele of a tokenized vcf line, and returns the counter for the next line
+def writeBedRecord(outputFile, fields, counter):
+	chromosome = fields[0]
+	startPos = int(fields[1])
+	ref = fields[3]
+	alts = fields[4].split(",")
+
+	for altIndex, alt in enumerate(alts):
+		if len(ref) > len(alt):
+			# deletion event
+			diff = ref[len(alt):]
+			endPos = startPos + len(diff)
+			#indelCall = '-' + diff
+		elif len(alt) > len(ref):
+			diff = alt[len(ref):]
+			endPos = startPos
+			#indelCall = '+' + diff
+		else:
+			endPos = startPos
+			#indelCall = "."
+
+		outputFile.write("\t".join([chromosome, str(startPos-1), str(endPos), "_".join([str(counter), ref, alt])]) + "\n")
+		counter += 1
+	return counter
+
 def writeBed(vcfInputPath, outputPath):
 	inputFile = open(vcfInputPath)
 	outputFile = open(outputPath, "w")
@@ -14,28 +39,7 @@ def writeBed(vcfInputPath, outputPath):
 		if line.startswith("#"):
 			continue
 
-		fields = line.strip().split("\t")
-		chromosome = fields[0]
-		startPos = int(fields[1])
-		ref = fields[3]
-		alts = fields[4].split(",")
-
-		for altIndex, alt in enumerate(alts):
-			if len(ref) > len(alt):
-				# deletion event
-				diff = ref[len(alt):]
-				endPos = startPos + len(diff)
-				#indelCall = '-' + diff
-			elif len(alt) > len(ref):
-				diff = alt[len(ref):]
-				endPos = startPos
-				#indelCall = '+' + diff
-			else:
-				endPos = startPos
-				#indelCall = "."
-
-			outputFile.write("\t".join([chromosome, str(startPos-1), str(endPos), "_".join([str(counter), ref, alt])]) + "\n")
-			counter += 1
+		counter = writeBedRecord(outputFile, line.strip().split("\t"), counter)
 	inputFile.close()
 	outputFile.close()
 
@@ -2,14 +2,17 @@
 #Usage of running this script by itself is <input_vcf> <output_vcf>
 import os, sys, re
 
+NUMBER_RE = re.compile('([0-9]+)')
+
+#Returns the key VCF lines are sorted by: their chromosome and position, with numbers compared numerically
+def getVCFLineKey(line):
+	#find second tab index
+	tabIndex = line.find("\t")
+	tabIndex += line[tabIndex+1:].find("\t") + 1
+	return [int(c) if c.isdigit() else c for c in NUMBER_RE.split(line[:tabIndex])]
+
 def sortVCFLines(lines):
-	compiledRE = re.compile('([0-9]+)')
-	def compareFunc(line):
-		#find second tab index
-		tabIndex = line.find("\t")
-		tabIndex += line[tabIndex+1:].find("\t") + 1
-		return [int(c) if c.isdigit() else c for c in compiledRE.split(line[:tabIndex])]
-	lines.sort(key=compareFunc)
+	lines.sort(key=getVCFLineKey)
 
 def sortVCF(inputPath, outputPath):
 	regularLines = []